@@ -27,11 +27,10 @@ setup(
     packages=find_packages(exclude=('sqlalchemy_geonames.tests', )),
     install_requires=[
         'GeoAlchemy2',
-        'ipdb',
         'progressbar2',
         'psycopg2',
         'requests',
-        'SQLAlchemy',
+        'SQLAlchemy>=1.3.7,<1.4',
     ],
     entry_points={
         'console_scripts': {
@@ -39,6 +38,16 @@ setup(
         },
     },
     extras_require={
+        'parquet': {
+            'pyarrow',
+        },
+        'reverse': {
+            # cKDTree.query's `workers`
+            'scipy>=1.6',
+        },
+        'shapes': {
+            'shapely',
+        },
         'test': {
             'coverage>=4.2',
             'flake8>=3.0.4',
@@ -1,8 +1,68 @@
+import sys
+from importlib import import_module
 from .metadata import __version_info__, __version__  # noqa
-from .models import (GeonameBase, GeonameMetadata, GeonameFeature,  # noqa
-                     GeonameTimezone, GeonameCountry, Geoname)
-from .reader import (GeonameReader, GeonameFeatureReader,  # noqa
-                     GeonameTimezoneReader, GeonameCountryInfoReader,
-                     GeonameHierarchyReader, GeonameAlternateNamesReader)
-from .imports import get_importer_instances  # noqa
-from .files import filename_config  # noqa
+
+# The public API and the submodule each name is defined in. They're imported
+# on first access, so that e.g. only using the readers doesn't require
+# importing SQLAlchemy and GeoAlchemy2.
+_lazy_attributes = {
+    'GeonameBase': 'models',
+    'GeonameMetadata': 'models',
+    'GeonameFeature': 'models',
+    'GeonameFeatureTranslation': 'models',
+    'GeonameTimezone': 'models',
+    'GeonameCountry': 'models',
+    'GeonameCountryShape': 'models',
+    'GeonameAlternateName': 'models',
+    'GeonameLanguageCode': 'models',
+    'GeonameUserTag': 'models',
+    'GeonameName': 'models',
+    'Geoname': 'models',
+    'GeonameImportCheckpoint': 'models',
+    'GeonamePostalCode': 'models',
+    'GeonameAdmin1Code': 'models',
+    'GeonameAdmin2Code': 'models',
+    'GeonameReader': 'reader',
+    'GeonameFeatureReader': 'reader',
+    'GeonameTimezoneReader': 'reader',
+    'GeonameCountryInfoReader': 'reader',
+    'GeonameHierarchyReader': 'reader',
+    'GeonameAlternateNamesReader': 'reader',
+    'GeonameIsoLanguageCodesReader': 'reader',
+    'GeonameUserTagsReader': 'reader',
+    'GeonamePostalCodeReader': 'reader',
+    'GeonameAdminCodeReader': 'reader',
+    'GeonameShapeReader': 'reader',
+    'get_importer_instances': 'imports',
+    'filename_config': 'files',
+    'Sink': 'sinks',
+    'DatabaseSink': 'sinks',
+    'NDJSONSink': 'sinks',
+    'ParquetSink': 'sinks',
+    'GeonameDetail': 'views',
+}
+
+__all__ = sorted(_lazy_attributes)
+
+
+def __getattr__(name):
+    try:
+        module_name = _lazy_attributes[name]
+    except KeyError:
+        raise AttributeError('module {!r} has no attribute {!r}'.format(
+            __name__, name))
+    module = import_module('.' + module_name, __name__)
+    value = getattr(module, name)
+    globals()[name] = value
+    return value
+
+
+def __dir__():
+    return sorted(set(globals()) | set(_lazy_attributes))
+
+
+# Module level __getattr__ requires Python 3.7, import everything up front on
+# older versions.
+if sys.version_info < (3, 7):
+    for _name in _lazy_attributes:
+        __getattr__(_name)
@@ -3,6 +3,7 @@
 Some info: http://lucumr.pocoo.org/2013/5/21/porting-to-python-3-redux/
 """
 import sys
+from datetime import timedelta, tzinfo
 
 PY2 = sys.version_info[0] == 2
 
@@ -11,10 +12,12 @@ def _identity(x):
     return x
 
 if not PY2:
+    from urllib.request import pathname2url
     text_type = str
     string_types = (str, )
     implements_to_string = _identity
 else:
+    from urllib import pathname2url  # noqa
     text_type = unicode  # noqa
     string_types = (str, unicode)  # noqa
 
@@ -37,3 +40,20 @@ else:
     import decimal
 
 Decimal = decimal.Decimal
+
+
+if not PY2:
+    from datetime import timezone
+    utc = timezone.utc
+else:
+    class _UTC(tzinfo):
+        def utcoffset(self, dt):
+            return timedelta(0)
+
+        def tzname(self, dt):
+            return 'UTC'
+
+        def dst(self, dt):
+            return timedelta(0)
+
+    utc = _UTC()
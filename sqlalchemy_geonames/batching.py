@@ -0,0 +1,81 @@
+"""Sizing of the batches of rows that importers hand to their sinks"""
+from collections import deque
+
+
+class BatchSizer(object):
+    """Adapts the number of rows per batch towards a target flush duration
+
+    After each flush the measured throughput (rows/second) is used to
+    compute how many rows would take `target_seconds` to store, and the
+    batch size moves towards that. Growth and shrinkage per flush is limited
+    by `max_change`, the size is kept between `min_size` and `max_size` and
+    a batch never holds more than roughly `max_bytes` of source data, which
+    bounds memory use and statement size for wide rows.
+    """
+
+    def __init__(self, initial_size=500, target_seconds=0.5, min_size=50,
+                 max_size=50000, max_bytes=8 * 1024 * 1024, max_change=2.0,
+                 history_size=100):
+        self.size = initial_size
+        self.target_seconds = target_seconds
+        self.min_size = min_size
+        self.max_size = max_size
+        self.max_bytes = max_bytes
+        self.max_change = max_change
+        self.rows_per_second = None
+        self.bytes_per_row = None
+        self.num_flushes = 0
+        self.num_rows = 0
+        self.seconds = 0.0
+        self.smallest_size = self.largest_size = initial_size
+        # The most recently chosen batch sizes
+        self.history = deque([initial_size], maxlen=history_size)
+
+    def is_full(self, num_rows, num_bytes):
+        return num_rows >= self.size or num_bytes >= self.max_bytes
+
+    def record(self, num_rows, num_bytes, seconds):
+        """Register a flush and pick the size of the next batch"""
+        if not num_rows:
+            return
+        self.num_flushes += 1
+        self.num_rows += num_rows
+        self.seconds += seconds
+        self.bytes_per_row = self._smooth(self.bytes_per_row,
+                                          float(num_bytes) / num_rows)
+        if seconds > 0:
+            self.rows_per_second = self._smooth(self.rows_per_second,
+                                                num_rows / seconds)
+        size = self.size
+        if self.rows_per_second is not None:
+            size = self.rows_per_second * self.target_seconds
+        size = min(max(size, self.size / self.max_change),
+                   self.size * self.max_change)
+        if self.bytes_per_row:
+            size = min(size, self.max_bytes / self.bytes_per_row)
+        self.size = int(min(max(size, self.min_size), self.max_size))
+        self.smallest_size = min(self.smallest_size, self.size)
+        self.largest_size = max(self.largest_size, self.size)
+        self.history.append(self.size)
+
+    @staticmethod
+    def _smooth(previous, value, weight=0.5):
+        # Exponential moving average, so a single slow flush (e.g. when the
+        # database checkpoints) doesn't throw off the size completely
+        if previous is None:
+            return value
+        return previous * (1 - weight) + value * weight
+
+    @property
+    def stats(self):
+        return {
+            'flushes': self.num_flushes,
+            'rows': self.num_rows,
+            'seconds': self.seconds,
+            'rows_per_second': self.rows_per_second,
+            'bytes_per_row': self.bytes_per_row,
+            'batch_size': self.size,
+            'smallest_batch_size': self.smallest_size,
+            'largest_batch_size': self.largest_size,
+            'recent_batch_sizes': list(self.history),
+        }
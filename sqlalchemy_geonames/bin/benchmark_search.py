@@ -0,0 +1,124 @@
+"""Benchmark of the geoname name search (sqlalchemy_geonames.search)
+
+Searches for the names of a random sample of geonames, misspelled, and
+reports the search latency and how often the geoname searched for was the
+best match, or among the results at all. Meant to be run against a database
+with allCountries.txt imported and the name table built:
+
+    sqlageonames -t postgresql -d geonames --search-names allCountries.txt
+    python -m sqlalchemy_geonames.bin.benchmark_search \\
+        postgresql+psycopg2://user@localhost/geonames
+
+On PostgreSQL it first checks that searches use the trigram index rather
+than scanning the name table.
+"""
+from __future__ import division, print_function
+import argparse
+import random
+import time
+from sqlalchemy import func, text
+from sqlalchemy.orm import sessionmaker
+from ..engines import create_engine
+from ..models import Geoname
+from ..search import normalize_name, search
+from ..sqlite import is_sqlite
+
+
+def misspell(name, rng):
+    """`name` with a typo: a letter left out, swapped or replaced"""
+    if len(name) < 4:
+        return name
+    i = rng.randrange(1, len(name) - 1)
+    kind = rng.choice(('omit', 'swap', 'replace'))
+    if kind == 'omit':
+        return name[:i] + name[i + 1:]
+    if kind == 'swap':
+        return name[:i] + name[i + 1] + name[i] + name[i + 2:]
+    return name[:i] + rng.choice(u'aeiou') + name[i + 1:]
+
+
+def sample_geonames(session, size, min_population=0):
+    """(geonameid, name) of `size` random geonames"""
+    query = (session.query(Geoname.geonameid, Geoname.name)
+             .filter(Geoname.population >= min_population)
+             .order_by(func.random()).limit(size))
+    return query.all()
+
+
+def uses_trigram_index(session):
+    """Whether PostgreSQL plans searches with the trigram index"""
+    plan = session.execute(text(
+        u"EXPLAIN SELECT geonameid FROM geonamename "
+        u"WHERE name % 'stockholm'")).fetchall()
+    return any(u'idx_geonamename_name_trgm' in row[0] for row in plan)
+
+
+def _percentile(values, percent):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * percent / 100))]
+
+
+def run_benchmark(session, geonames, limit=10, seed=0):
+    """Search for each of `geonames`, see `sample_geonames`
+
+    Returns the latencies in milliseconds (50th, 95th and 99th percentile
+    and max) and the shares of searches finding the geoname first
+    (`top1`) and among the `limit` results (`found`).
+    """
+    rng = random.Random(seed)
+    latencies = []
+    top1 = found = 0
+    for geonameid, name in geonames:
+        started = time.time()
+        results = search(session, misspell(normalize_name(name), rng),
+                         limit=limit)
+        latencies.append((time.time() - started) * 1000)
+        geonameids = [geoname.geonameid for geoname, _ in results]
+        top1 += geonameids[:1] == [geonameid]
+        found += geonameid in geonameids
+    count = len(latencies)
+    return {
+        'searches': count,
+        'p50_ms': _percentile(latencies, 50),
+        'p95_ms': _percentile(latencies, 95),
+        'p99_ms': _percentile(latencies, 99),
+        'max_ms': max(latencies),
+        'top1': top1 / count,
+        'found': found / count,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.
+                                     RawDescriptionHelpFormatter)
+    parser.add_argument('db_url', help='SQLAlchemy database URL')
+    parser.add_argument('--sample', type=int, default=1000,
+                        help='Number of searches')
+    parser.add_argument('--min-population', type=int, default=1000,
+                        help='Only search for geonames this populous, whose'
+                             ' names are the ones usually searched for')
+    parser.add_argument('--limit', type=int, default=10,
+                        help='Results per search')
+    args = parser.parse_args()
+
+    session = sessionmaker(
+        bind=create_engine(args.db_url, profile='query'))()
+    if not is_sqlite(session.bind) and not uses_trigram_index(session):
+        parser.exit(1, 'Searches would scan geonamename, is the '
+                       'idx_geonamename_name_trgm index missing?\n')
+    geonames = sample_geonames(session, args.sample, args.min_population)
+    if not geonames:
+        parser.exit(1, 'No geonames to search for\n')
+    # The first searches warm up the caches
+    run_benchmark(session, geonames[:10], args.limit)
+    stats = run_benchmark(session, geonames, args.limit)
+    print('{searches} searches: {p50_ms:.1f}ms median, {p95_ms:.1f}ms 95th '
+          'percentile, {p99_ms:.1f}ms 99th percentile, {max_ms:.1f}ms max'
+          .format(**stats))
+    print('Best match in {:.1%}, among the results in {:.1%}'.format(
+        stats['top1'], stats['found']))
+
+
+if __name__ == '__main__':
+    main()
@@ -12,20 +12,28 @@ be imported. To download different data one can pass in any of the following:
                       2.7GHz i7 and querying the geoname table takes over
                       a second no matter how small the result set is.
 
+Run `sqlageonames daemon --help` for keeping the imported data up to date
+with the daily modification and delete files.
 """
 from __future__ import print_function
 import argparse
+import json
 import os
+import shutil
 import sys
 from copy import deepcopy
+from datetime import datetime
+from multiprocessing.pool import ThreadPool
 from zipfile import ZipFile
-import requests
-from progressbar import ProgressBar, ETA, FileTransferSpeed, Percentage, Bar
-from sqlalchemy import engine, create_engine
+from sqlalchemy import engine
 from sqlalchemy.orm import scoped_session, sessionmaker
-from .. import filename_config, get_importer_instances, GeonameBase
+# The modules that only some subcommands and options need are imported
+# where they're used, so that the command starts quicker.
+from .. import (filename_config, get_importer_instances, Geoname,
+                GeonameBase, sqlite, state)
 from ..utils import get_password, normalize_path, mkdir_p
 from ..imports import _import_options_map
+from ..sinks import DatabaseSink
 
 
 class RawArgumentDefaultsHelpFormatter(argparse.ArgumentDefaultsHelpFormatter,
@@ -34,7 +42,8 @@ class RawArgumentDefaultsHelpFormatter(argparse.ArgumentDefaultsHelpFormatter,
     pass
 
 NOT_SET = object()
-DATABASE_CHOICES = ('postgresql', )
+DEFAULT_CHECKPOINT_INTERVAL = 100000
+DATABASE_CHOICES = ('postgresql', 'sqlite')
 DEFAULT_DOWNLOAD_DIR = normalize_path('~/.sqlageonames')
 DEFAULT_LANGUAGE_CODE = 'en'
 PRIMARY_GEONAME_FILENAMES = [name for name, opts in filename_config.items()
@@ -47,6 +56,9 @@ supported_filenames = _import_options_map.keys()
 
 
 def get_progress_bar(maxval):
+    # Imported here as they're only needed when downloading
+    from progressbar import (ProgressBar, ETA, FileTransferSpeed, Percentage,
+                             Bar)
     widgets = [Percentage(), ' ', Bar(), ' ', ETA(), ' ', FileTransferSpeed()]
     return ProgressBar(widgets=widgets, maxval=maxval)
 
@@ -55,10 +67,11 @@ def get_local_filepath(filename, download_dir=DEFAULT_DOWNLOAD_DIR):
     return os.path.join(download_dir, filename)
 
 
-def get_download_config(primary_filename, language_code=DEFAULT_LANGUAGE_CODE):
+def get_download_config(primary_filename, language_code=DEFAULT_LANGUAGE_CODE,
+                        optional_filenames=(), feature_languages=()):
     download_config = {k: v for k, v in deepcopy(filename_config).items()
                        if k in supported_filenames}
-    for filename, opts in download_config.items():
+    for filename, opts in list(download_config.items()):
         # Only download the selected primary primary_filename file
         if (
             filename in PRIMARY_GEONAME_FILENAMES and
@@ -66,15 +79,25 @@ def get_download_config(primary_filename, language_code=DEFAULT_LANGUAGE_CODE):
         ):
             del download_config[filename]
         # If a file is bound to a specific language code and is not the
-        # specified one then remove it.
-        if 'language_code' in opts and opts['language_code'] != language_code:
+        # specified one, nor one of the translations, then remove it.
+        if 'language_code' in opts and (
+            opts['language_code'] != language_code and
+            opts['language_code'] not in feature_languages
+        ):
+            del download_config[filename]
+        # Optional files are only downloaded when explicitly asked for
+        elif opts.get('optional') and filename not in optional_filenames:
+            del download_config[filename]
+        # Data that's part of the primary file already
+        elif opts.get('included_in') == primary_filename:
             del download_config[filename]
     return download_config
 
 
 def download(url, download_dir=DEFAULT_DOWNLOAD_DIR, use_cache=True,
-             chunk_size=1024):
-    _, _, download_filename = url.rpartition('/')
+             chunk_size=1024, download_filename=None, progress=True):
+    if download_filename is None:
+        _, _, download_filename = url.rpartition('/')
     local_filepath = get_local_filepath(download_filename, download_dir)
     if use_cache and os.path.exists(local_filepath):
         print(u'Using cached file {}'.format(local_filepath))
@@ -82,29 +105,49 @@ def download(url, download_dir=DEFAULT_DOWNLOAD_DIR, use_cache=True,
     else:
         print(u'Downloading {} to {}...'.format(download_filename,
                                                 local_filepath))
+    import requests
     req = requests.get(url, stream=True)
     req.raise_for_status()
-    content_length = int(req.headers['content-length'])
-    pbar = get_progress_bar(maxval=content_length)
-    pbar.start()
+    pbar = None
+    if progress:
+        content_length = int(req.headers['content-length'])
+        pbar = get_progress_bar(maxval=content_length)
+        pbar.start()
     mkdir_p(download_dir)  # Make sure path exists
     with open(local_filepath, 'wb') as fh:
         for chunk in req.iter_content(chunk_size=chunk_size):
-            if not chunk:
-                import ipdb
-                ipdb.set_trace()
             if chunk:  # Filter out keep-alive new chunks
                 fh.write(chunk)
                 fh.flush()
-            new_pbar_val = pbar.currval + chunk_size
-            if new_pbar_val <= pbar.maxval:
-                pbar.update(new_pbar_val)
-    pbar.finish()
+            if pbar is not None:
+                new_pbar_val = pbar.currval + chunk_size
+                if new_pbar_val <= pbar.maxval:
+                    pbar.update(new_pbar_val)
+    if pbar is not None:
+        pbar.finish()
     return local_filepath
 
 
+def download_concurrently(urls, download_dir=DEFAULT_DOWNLOAD_DIR,
+                          use_cache=True, num_threads=4):
+    """Download several small files at once, without progress bars"""
+    pool = ThreadPool(min(num_threads, len(urls)))
+    try:
+        return pool.map(
+            lambda url: download(url, download_dir, use_cache,
+                                 progress=False),
+            urls)
+    finally:
+        pool.close()
+
+
 def get_db_url(database_type, database, username,
                password=None, port=None, host=None):
+    if database_type == 'sqlite':
+        # SQLite is server-less. `database` is the path to the database file
+        # and there are no credentials to ask for.
+        return engine.url.URL(drivername='sqlite',
+                              database=normalize_path(database))
     dburl_kwargs = {
         'database': database,
         'host': host,
@@ -114,7 +157,7 @@ def get_db_url(database_type, database, username,
     if database_type == 'postgresql':
         dburl_kwargs['drivername'] = 'postgresql+psycopg2'
     else:
-        sys.exit('Only postgresql is supported at the moment')
+        sys.exit('Unsupported database type {}'.format(database_type))
 
     dburl = engine.url.URL(**dburl_kwargs)
 
@@ -127,28 +170,62 @@ def get_db_url(database_type, database, username,
     return dburl
 
 
-def unzip(zip_filepath, filename_to_extract, extract_dir=DEFAULT_DOWNLOAD_DIR):
-    """Unzip file from archive and return path to extracted file"""
+def unzip(zip_filepath, filename_to_extract, extract_dir=DEFAULT_DOWNLOAD_DIR,
+          target_filename=None):
+    """Unzip file from archive and return path to extracted file
+
+    The file is extracted as `target_filename` when given.
+    """
     zipfile = ZipFile(zip_filepath)
     assert filename_to_extract in zipfile.namelist()
     print(u'Unzipping {}...'.format(zip_filepath))
-    return zipfile.extract(member=filename_to_extract, path=extract_dir)
-
-
-def create_geoname_tables(db_session, recreate_tables=False):
+    if target_filename in (None, filename_to_extract):
+        return zipfile.extract(member=filename_to_extract, path=extract_dir)
+    target_filepath = os.path.join(extract_dir, target_filename)
+    with zipfile.open(filename_to_extract) as src:
+        with open(target_filepath, 'wb') as dst:
+            shutil.copyfileobj(src, dst, 1 << 20)
+    return target_filepath
+
+
+def create_geoname_tables(db_session, recreate_tables=False,
+                          partition_by=None):
+    from .. import partitioning, views
     if recreate_tables:
         GeonameBase.metadata.drop_all(bind=db_session.bind)
-    GeonameBase.metadata.create_all(bind=db_session.bind)
+    else:
+        for tablename in state.upgrade_bookkeeping_tables(db_session.bind):
+            print('Recreating {} of an older version'.format(tablename))
+    if partition_by is not None:
+        partitioning.create_tables(db_session.bind, partition_by)
+    else:
+        GeonameBase.metadata.create_all(bind=db_session.bind)
+    views.create_views(db_session.bind)
 
 
-def purge_geoname_tables(db_session):
+def purge_geoname_tables(db_session, tables=None):
+    """Delete all data from `tables`, defaulting to all geoname* tables
+
+    The import bookkeeping in geonamemetadata is kept for the tables that
+    aren't purged.
+    """
     for table in reversed(GeonameBase.metadata.sorted_tables):
+        if table in state.bookkeeping_tables:
+            continue
+        if tables is not None and table not in tables:
+            continue
         print('Purging data from {}...'.format(table.name))
-        db_session.bind.execute(table.delete())
+        # Within the session's transaction, which on SQLite holds a lock
+        # once it has read the import state (e.g. checkpoints to resume).
+        db_session.execute(table.delete())
+        state.invalidate_table(db_session, table.name)
 
 
-def get_db_session(db_url):
-    engine = create_engine(db_url)
+def get_db_session(db_url, engine_profile='import', db_settings=None):
+    from .. import engines
+    engine = engines.create_engine(db_url, engine_profile, db_settings)
+    if sqlite.is_sqlite(engine):
+        sqlite.enable_savepoints(engine)
     session_factory = sessionmaker(autocommit=False, autoflush=False)
     Session = scoped_session(session_factory)
     Session.configure(bind=engine)
@@ -163,47 +240,218 @@ def get_db_session(db_url):
         return db_session
 
 
-def run_importers(db_session, local_filepaths):
-    for importer in get_importer_instances(db_session, *local_filepaths):
-        print("Running importer for {}...".format(importer.filename))
-        importer.run()
+def run_importers(db_session, local_filepaths, purge=True, upsert=False,
+                  skip_unchanged=False, row_hashes=False, resume=False,
+                  checkpoint_interval=DEFAULT_CHECKPOINT_INTERVAL,
+                  rejects=False, partition_by=None, geohash=False,
+                  skip_columns=(), translation_filepaths=(),
+                  switch_primary=False, parse_cache=False):
+    # Switching the primary file upserts everything, but skips the
+    # geonames that are in the table already.
+    if switch_primary:
+        upsert = True
+        purge = False
+    if partition_by is not None:
+        from .. import partitioning
+        sink = partitioning.PartitionRoutingSink(db_session.bind,
+                                                 partition_by)
+    else:
+        sink = DatabaseSink(db_session.bind, upsert=upsert)
+    # Upserts are idempotent, and the keys collected for `delete_missing`
+    # don't survive a restart, so they're simply rerun instead of resumed.
+    if upsert:
+        checkpoint_interval = None
+        resume = False
+    importers = get_importer_instances(
+        db_session, *local_filepaths, sinks=[sink], row_hashes=row_hashes,
+        checkpoint_interval=checkpoint_interval, rejects=rejects,
+        geohash=geohash, skip_columns=skip_columns,
+        translation_filepaths=translation_filepaths, parse_cache=parse_cache)
+    geoname_importers = [i for i in importers if i.model is Geoname]
+    if switch_primary and geoname_importers:
+        existing = state.IdSet.from_column(db_session.bind,
+                                           Geoname.__table__.c.geonameid)
+        print("Skipping the {} geonames already imported...".format(
+            len(existing)))
+        # no-country.txt goes into the geoname table too
+        current = state.IdSet()
+        for importer in geoname_importers:
+            importer.skip_existing_keys(existing, current)
+    if skip_unchanged or resume:
+        changed = state.get_changed_importers(db_session, importers,
+                                              cascade=purge)
+        for importer in importers:
+            if importer not in changed:
+                print("Skipping {}, unchanged since the last import".format(
+                    importer.filename))
+        importers = changed
+    resumed = []
+    if resume:
+        for importer in importers:
+            checkpoint = state.get_checkpoint(db_session, importer)
+            # The rows imported so far would be purged if a dependency is
+            dependency_rerun = any(
+                other.model in importer.model_dependencies and
+                other not in resumed for other in importers)
+            if checkpoint is not None and not (purge and dependency_rerun):
+                print("Resuming {} from row {}...".format(
+                    importer.filename, checkpoint.row_count))
+                importer.resume(checkpoint)
+                resumed.append(importer)
+    if purge:
+        purge_geoname_tables(db_session, [i.table for i in importers
+                                          if i not in resumed])
+    # Don't keep the session's transaction open while the importers write
+    # through their own connections.
+    db_session.commit()
+    try:
+        for importer in importers:
+            print("Running importer for {}...".format(importer.filename))
+            importer.run()
+            stats = importer.stats
+            print("Stored {} rows in {:.1f}s, batch size {}-{} rows".format(
+                stats['rows'], stats['seconds'],
+                stats['smallest_batch_size'], stats['largest_batch_size']))
+            issues = importer.reader.issues
+            if issues:
+                print("{} in {}".format(issues.summary(), importer.filename))
+            if importer.rejects is not None and importer.rejects.count:
+                print("{} rows were rejected, see {}".format(
+                    importer.rejects.count, importer.rejects.filepath))
+            if not upsert:
+                state.record_import(db_session, importer)
+        if upsert:
+            for importer in reversed(importers):
+                print("Deleting rows no longer in {}...".format(
+                    importer.filename))
+                importer.delete_missing()
+            for importer in importers:
+                # Rows from any other file imported into the same table
+                # are gone now, unless the file only replaced its scope.
+                if not importer.scope:
+                    state.invalidate_table(
+                        db_session, importer.table.name,
+                        exclude_filenames=[other.filename
+                                           for other in importers
+                                           if other.table is importer.table])
+                state.record_import(db_session, importer)
+    finally:
+        sink.close()
+
+
+def run_dry_run(local_filepaths, geohash=False, skip_columns=(),
+                translation_filepaths=()):
+    """Read the files without a database and print reports, see `.dryrun`"""
+    from .. import dryrun
+    importers = get_importer_instances(
+        None, *local_filepaths, geohash=geohash, skip_columns=skip_columns,
+        translation_filepaths=translation_filepaths)
+    for importer in importers:
+        print("Reading {}...".format(importer.filename))
+        print(dryrun.format_report(dryrun.dry_run(importer)))
 
 
 def download_and_import(filename, database_type, database, username,
                         password=None, port=None, host='localhost',
                         use_cache=False, download_dir=DEFAULT_DOWNLOAD_DIR,
                         language_code=DEFAULT_LANGUAGE_CODE,
-                        keep_existing_data=False, recreate_tables=False):
+                        keep_existing_data=False, recreate_tables=False,
+                        upsert=False, skip_unchanged=False,
+                        row_hashes=False, resume=False,
+                        checkpoint_interval=DEFAULT_CHECKPOINT_INTERVAL,
+                        rejects=False, postal_codes=False, partition_by=None,
+                        geohash=False, skip_columns=(), feature_languages=(),
+                        country_shapes=False, search_names=False,
+                        alternate_names=False, switch_primary=False,
+                        dry_run=False, engine_profile='import',
+                        db_settings=None, user_tags=False, no_country=False,
+                        parse_cache=False):
     download_dir = normalize_path(download_dir)
-    db_url = get_db_url(database_type, database, username,
-                        password, port, host)
-    db_session = get_db_session(db_url)
-    download_config = get_download_config(filename, language_code)
-    local_filepaths = []
+    if not dry_run:
+        db_url = get_db_url(database_type, database, username,
+                            password, port, host)
+        db_session = get_db_session(db_url, engine_profile, db_settings)
+    optional_filenames = []
+    if postal_codes:
+        optional_filenames.append('postalCodes.txt')
+    if country_shapes:
+        optional_filenames.append('shapes_simplified_low.json')
+    if alternate_names:
+        optional_filenames.append('alternateNames.txt')
+    if user_tags:
+        optional_filenames.append('userTags.txt')
+    if no_country:
+        optional_filenames.append('no-country.txt')
+    if 'all' in feature_languages:
+        feature_languages = LANGUAGE_CHOICES
+    download_config = get_download_config(filename, language_code,
+                                          optional_filenames,
+                                          feature_languages)
+    # The translations are all imported, `language_code`'s file into
+    # geonamefeature as well. They're small, so fetch them in one go.
+    translation_config = dict(
+        (filename, opts) for filename, opts in download_config.items()
+        if 'language_code' in opts and feature_languages)
+    translation_filepaths = download_concurrently(
+        [opts['url'] for opts in translation_config.values()],
+        download_dir, use_cache) if translation_config else []
+    local_filepaths = [
+        path for path in translation_filepaths
+        if os.path.basename(path) == 'featureCodes_{}.txt'.format(
+            language_code)]
     for filename, opts in download_config.items():
-        local_filepath = download(opts['url'], download_dir, use_cache)
+        if filename in translation_config:
+            continue
+        local_filepath = download(
+            opts['url'], download_dir, use_cache,
+            download_filename=opts.get('download_filename'))
         if opts.get('unzip') is True:
-            local_filepath = unzip(local_filepath,
-                                   filename_to_extract=filename,
-                                   extract_dir=download_dir)
+            local_filepath = unzip(
+                local_filepath,
+                filename_to_extract=opts.get('zip_member', filename),
+                extract_dir=download_dir,
+                target_filename=filename,
+            )
         local_filepaths.append(local_filepath)
 
-    create_geoname_tables(db_session, recreate_tables=recreate_tables)
-    if not keep_existing_data:
-        purge_geoname_tables(db_session)
-    run_importers(db_session, local_filepaths)
-
-
-def main():
-    parser = argparse.ArgumentParser(
-        description=__doc__,
-        formatter_class=RawArgumentDefaultsHelpFormatter,
-    )
-    parser.add_argument('filename', choices=PRIMARY_GEONAME_FILENAMES,
-                        help='Main geoname file to download.')
+    if dry_run:
+        run_dry_run(local_filepaths, geohash=geohash,
+                    skip_columns=skip_columns,
+                    translation_filepaths=translation_filepaths)
+        return
+    create_geoname_tables(db_session, recreate_tables=recreate_tables,
+                          partition_by=partition_by)
+    run_importers(db_session, local_filepaths, partition_by=partition_by,
+                  geohash=geohash, skip_columns=skip_columns,
+                  translation_filepaths=translation_filepaths,
+                  purge=not keep_existing_data and not upsert,
+                  upsert=upsert, switch_primary=switch_primary,
+                  parse_cache=parse_cache,
+                  skip_unchanged=skip_unchanged,
+                  row_hashes=row_hashes, resume=resume,
+                  checkpoint_interval=checkpoint_interval, rejects=rejects)
+    from .. import views
+    print('Refreshing {}...'.format(views.DETAIL_VIEWNAME))
+    # Keep the old data readable while refreshing an existing database
+    views.refresh_views(db_session.bind,
+                        concurrently=upsert or switch_primary)
+    if search_names:
+        from .. import search
+        print('Building the name search table...')
+        search.build_name_table(db_session.bind)
+    if sqlite.is_sqlite(db_session.bind):
+        print('Building SQLite spatial and name indexes...')
+        sqlite.create_indexes(db_session.bind)
+        sqlite.finalize_database(db_session.bind)
+
+
+def add_database_arguments(parser, required=True):
+    from .. import engines
     parser.add_argument('-t', '--database-type', choices=DATABASE_CHOICES,
-                        help='Database type', required=True)
-    parser.add_argument('-d', '--database', help='Database name')
+                        help='Database type', required=required)
+    parser.add_argument('-d', '--database',
+                        help='Database name. Path to the database file for '
+                             'sqlite.')
     parser.add_argument('-u', '--username',
                         help='Database username')
     parser.add_argument('-p', '--password', default=None,
@@ -216,25 +464,255 @@ def main():
                         help='Database port.', default=None)
     parser.add_argument('-H', '--host',
                         help='Database host', default='localhost')
+    parser.add_argument('--engine-profile', default='import',
+                        choices=sorted(engines.ENGINE_PROFILES),
+                        help='Connection settings to use, see'
+                             ' sqlalchemy_geonames.engines')
+    parser.add_argument('--db-setting', dest='db_settings', default=[],
+                        action='append', metavar='NAME=VALUE',
+                        type=lambda value: tuple(value.split('=', 1)),
+                        help="PostgreSQL run-time parameter to set for every"
+                             " connection, overriding the profile's, e.g."
+                             " work_mem=1GB. Can be repeated.")
+
+
+def get_db_settings(parser, db_settings):
+    """The --db-setting NAME=VALUE pairs as a dict"""
+    for setting in db_settings:
+        if len(setting) != 2:
+            parser.error('--db-setting expects NAME=VALUE, got {}'.format(
+                setting[0]))
+    return dict(db_settings)
+
+
+def run_daemon(database_type, database, username, password=None, port=None,
+               host='localhost', source_dir=None,
+               download_dir=DEFAULT_DOWNLOAD_DIR, alternate_names=False,
+               search_names=False, since=None, interval=3600, once=False,
+               metrics_port=None, max_lag_days=2, engine_profile='import',
+               db_settings=None, geohash=False):
+    from .. import daemon, engines
+    db_url = get_db_url(database_type, database, username,
+                        password, port, host)
+    engine = engines.create_engine(db_url, engine_profile, db_settings)
+    if source_dir is not None:
+        source = daemon.DirectorySource(normalize_path(source_dir))
+    else:
+        download_dir = normalize_path(download_dir)
+        mkdir_p(download_dir)
+        source = daemon.HTTPSource(download_dir)
+    delta_daemon = daemon.DeltaDaemon(
+        engine, source, alternate_names=alternate_names,
+        search_names=search_names, since=since, max_lag_days=max_lag_days,
+        geohash=geohash)
+    if metrics_port is not None:
+        daemon.serve_metrics(delta_daemon, metrics_port)
+    delta_daemon.run(interval=interval, once=once)
+    if once:
+        print(json.dumps(delta_daemon.status(), indent=2, sort_keys=True))
+        if not delta_daemon.is_healthy:
+            sys.exit(1)
+
+
+def daemon_main(argv):
+    parser = argparse.ArgumentParser(
+        prog='sqlageonames daemon',
+        description='Keep the geonames up to date with the daily '
+                    'modification and delete files, see '
+                    'sqlalchemy_geonames.daemon.',
+        formatter_class=RawArgumentDefaultsHelpFormatter,
+    )
+    add_database_arguments(parser)
+    parser.add_argument('-S', '--source-dir',
+                        help="Read the delta files from this directory"
+                             " instead of downloading them from geonames.")
+    parser.add_argument('-D', '--download-dir', default=DEFAULT_DOWNLOAD_DIR,
+                        help='Where to download the delta files')
+    parser.add_argument('--alternate-names', action='store_const',
+                        default=False, const=True,
+                        help="Also apply the alternate name deltas to"
+                             " geonamealternatename.")
+    parser.add_argument('--search-names', action='store_const',
+                        default=False, const=True,
+                        help="Rebuild the name search table after applying"
+                             " deltas.")
+    parser.add_argument('--geohash', action='store_const',
+                        default=False, const=True,
+                        help="Compute the geohashes of the modified"
+                             " geonames, if the geonames were imported with"
+                             " --geohash.")
+    parser.add_argument('--since',
+                        type=lambda value: datetime.strptime(
+                            value, '%Y-%m-%d').date(),
+                        help="First day (YYYY-MM-DD) to apply, if no delta"
+                             " has been applied yet. Defaults to the day"
+                             " before the last import.")
+    parser.add_argument('-i', '--interval', type=int, default=3600,
+                        help='Seconds between polls for new deltas')
+    parser.add_argument('--once', action='store_const',
+                        default=False, const=True,
+                        help="Apply the available deltas, print the status"
+                             " and exit. Exits with 1 if unhealthy.")
+    parser.add_argument('--metrics-port', type=int,
+                        help="Serve the status on /health and Prometheus"
+                             " metrics on /metrics on this port.")
+    parser.add_argument('--max-lag-days', type=int, default=2,
+                        help="Report unhealthy when the data lags more days"
+                             " than this behind the latest deltas.")
+    args = parser.parse_args(argv)
+    args.db_settings = get_db_settings(parser, args.db_settings)
+    if args.no_password is True:
+        args.password = NOT_SET
+    del args.no_password
+    run_daemon(**vars(args))
+
+
+def main():
+    if sys.argv[1:2] == ['daemon']:
+        return daemon_main(sys.argv[2:])
+    from .. import partitioning
+    parser = argparse.ArgumentParser(
+        description=__doc__,
+        formatter_class=RawArgumentDefaultsHelpFormatter,
+    )
+    parser.add_argument('filename', choices=PRIMARY_GEONAME_FILENAMES,
+                        help='Main geoname file to download.')
+    add_database_arguments(parser, required=False)
     parser.add_argument('-c', '--use-cache',
                         help="Use previously downloaded files if they exist "
                              "in the download directory",
                         action='store_const', const=True, default=False)
     parser.add_argument('-D', '--download-dir', default=DEFAULT_DOWNLOAD_DIR,
                         help='Where to download the data files')
+    parser.add_argument('--parse-cache', action='store_const',
+                        default=False, const=True,
+                        help="Keep a pre-parsed copy of every file next to"
+                             " it in the download directory, and import"
+                             " from it while the file is unchanged. Makes"
+                             " repeated imports of the same files faster.")
     parser.add_argument('-l', '--language-code', default=DEFAULT_LANGUAGE_CODE,
                         choices=LANGUAGE_CHOICES, help='Feature data language')
     parser.add_argument('-k', '--keep-existing-data', action='store_const',
                         default=False, const=True,
                         help="Don't truncate geoname* tables before inserting."
-                             " No use in specifying this as an integrity error"
-                             " will be raised. This behavior will not be the"
-                             " default once incremental updates is supported.")
+                             " An integrity error will be raised for rows that"
+                             " already exist. See --upsert for updating"
+                             " existing data.")
+    parser.add_argument('-U', '--upsert', action='store_const',
+                        default=False, const=True,
+                        help="Update existing data in place instead of"
+                             " purging and reinserting it. Only rows that"
+                             " changed are written, and rows that are no"
+                             " longer in the files are deleted.")
+    parser.add_argument('--switch-primary', action='store_const',
+                        default=False, const=True,
+                        help="Switch to another primary file, e.g. from"
+                             " cities5000.txt to cities1000.txt, by only"
+                             " inserting the geonames that aren't imported"
+                             " yet and deleting those that aren't in the new"
+                             " file. Other files are upserted.")
+    parser.add_argument('-s', '--skip-unchanged', action='store_const',
+                        default=False, const=True,
+                        help="Don't import files that are identical to the"
+                             " ones imported last time.")
+    parser.add_argument('--row-hashes', action='store_const',
+                        default=False, const=True,
+                        help="Together with --upsert, keep a hash of every"
+                             " row next to the downloaded files and only"
+                             " write rows that have changed since the last"
+                             " import. Assumes the geoname* tables aren't"
+                             " modified by anything else.")
+    parser.add_argument('--resume', action='store_const',
+                        default=False, const=True,
+                        help="Resume a failed import from its last"
+                             " checkpoint. Files that were completely"
+                             " imported are skipped if unchanged.")
+    parser.add_argument('--checkpoint-interval', type=int,
+                        default=DEFAULT_CHECKPOINT_INTERVAL,
+                        help="Commit and save a checkpoint to resume from"
+                             " every this many rows. 0 disables"
+                             " checkpoints.")
+    parser.add_argument('--rejects', action='store_const',
+                        default=False, const=True,
+                        help="Write rows that fail to be parsed or inserted"
+                             " to <file>.rejects next to the downloaded file,"
+                             " instead of aborting the import.")
+    parser.add_argument('--postal-codes', action='store_const',
+                        default=False, const=True,
+                        help="Also import the postal code dataset (about"
+                             " 1.5M rows) into geonamepostalcode.")
+    parser.add_argument('--country-shapes', action='store_const',
+                        default=False, const=True,
+                        help="Also import the simplified country shapes into"
+                             " geonamecountryshape, for finding the country"
+                             " of a position.")
+    parser.add_argument('--alternate-names', action='store_const',
+                        default=False, const=True,
+                        help="Also import the alternate names (about 15M"
+                             " rows) into geonamealternatename.")
+    parser.add_argument('--user-tags', action='store_const',
+                        default=False, const=True,
+                        help="Also import the tags users have given"
+                             " geonames into geonameusertag.")
+    parser.add_argument('--no-country', action='store_const',
+                        default=False, const=True,
+                        help="Also import the geonames outside of any"
+                             " country, e.g. seas, into geoname. Already"
+                             " part of allCountries.txt.")
+    parser.add_argument('--search-names', action='store_const',
+                        default=False, const=True,
+                        help="Build the normalized name table and its"
+                             " trigram index, for fuzzy name searches."
+                             " Rebuilt as a whole after every import.")
+    parser.add_argument('--partition-by',
+                        choices=partitioning.PARTITION_COLUMNS,
+                        help="Create the geoname table partitioned by this"
+                             " column (postgresql only). Only affects newly"
+                             " created tables, see --recreate-tables.")
+    parser.add_argument('--geohash', action='store_const',
+                        default=False, const=True,
+                        help="Compute the geohash of every geoname, for grid"
+                             " based lookups and aggregation.")
+    parser.add_argument('--skip-columns', default=(),
+                        type=lambda value: value.split(','),
+                        help="Comma separated fields to leave out of the"
+                             " import, e.g. alternatenames,dem. They're"
+                             " left empty, and aren't even decoded.")
+    parser.add_argument('--feature-languages', default=(),
+                        type=lambda value: value.split(','),
+                        help="Comma separated languages (of {}) or 'all'."
+                             " Their feature names are imported into"
+                             " geonamefeaturetranslation.".format(
+                                 ', '.join(LANGUAGE_CHOICES)))
+    parser.add_argument('--dry-run', action='store_const',
+                        default=False, const=True,
+                        help="Only read the files, without a database, and"
+                             " report the rows per second of reading and"
+                             " each modifier and the malformed, padded,"
+                             " skipped and invalid rows.")
     parser.add_argument('-r', '--recreate-tables', action='store_const',
                         default=False, const=True,
                         help="Recreate geoname* tables.")
 
     args = parser.parse_args()
+    if args.database_type is None and not args.dry_run:
+        parser.error('the following arguments are required:'
+                     ' -t/--database-type')
+    if args.row_hashes and not args.upsert:
+        parser.error('--row-hashes requires --upsert')
+    if args.partition_by and args.database_type != 'postgresql':
+        parser.error('--partition-by requires postgresql')
+    if args.partition_by and args.upsert:
+        parser.error('--partition-by and --upsert can not be combined')
+    if args.partition_by and args.switch_primary:
+        parser.error('--partition-by and --switch-primary can not be'
+                     ' combined')
+    args.db_settings = get_db_settings(parser, args.db_settings)
+    unknown_languages = (set(args.feature_languages) -
+                         set(LANGUAGE_CHOICES) - set(['all']))
+    if unknown_languages:
+        parser.error('Unknown --feature-languages: {}'.format(
+            ', '.join(sorted(unknown_languages))))
     if args.no_password is True:
         args.password = NOT_SET
     del args.no_password
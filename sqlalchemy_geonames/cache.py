@@ -0,0 +1,183 @@
+"""In-memory lookups of the small reference tables
+
+Countries, timezones, features (and their translations) and admin1
+divisions are small and change
+rarely, so instead of loading them through relationships (a query per
+access) they can be read once into a `ReferenceCache` and resolved from
+there::
+
+    cache = get_reference_cache(engine)
+    country = cache.country_of(geoname)  # No query
+    print(country.country, cache.timezone_of(geoname).gmt_offset)
+    print(cache.feature_of(geoname, 'sv').name)  # In Swedish, if imported
+
+Records are immutable named tuples with the same attribute names as the
+models' columns. The cache reloads itself when its `ttl` has passed and the
+`geonamemetadata` records of the cached tables show a newer import.
+"""
+import threading
+import time
+import weakref
+from collections import namedtuple
+from sqlalchemy import func, select
+from .models import (GeonameAdmin1Code, GeonameCountry, GeonameFeature,
+                     GeonameFeatureTranslation, GeonameMetadata,
+                     GeonameTimezone)
+
+
+def _record_class(model):
+    table = model.__table__
+    name = model.__name__.replace('Geoname', '') + 'Record'
+    return namedtuple(name, [c.name for c in table.columns])
+
+
+CountryRecord = _record_class(GeonameCountry)
+TimezoneRecord = _record_class(GeonameTimezone)
+FeatureRecord = _record_class(GeonameFeature)
+FeatureTranslationRecord = _record_class(GeonameFeatureTranslation)
+Admin1CodeRecord = _record_class(GeonameAdmin1Code)
+
+# (name, model, record class) of the cached tables
+_cached_tables = (
+    ('countries', GeonameCountry, CountryRecord),
+    ('timezones', GeonameTimezone, TimezoneRecord),
+    ('features', GeonameFeature, FeatureRecord),
+    ('feature_translations', GeonameFeatureTranslation,
+     FeatureTranslationRecord),
+    ('admin1_codes', GeonameAdmin1Code, Admin1CodeRecord),
+)
+
+
+class ReferenceCache(object):
+    """Lookup maps of the reference tables, see module docstring
+
+    Lookups never touch the database. Only after `ttl` seconds a single
+    query checks whether the tables have been imported anew, in which case
+    they're reloaded. Lookups are safe to do from several threads.
+    """
+
+    def __init__(self, bind, ttl=300):
+        self.bind = bind
+        self.ttl = ttl
+        self.lock = threading.Lock()
+        self.maps = None
+        self.version = None
+        self.checked_at = None
+
+    def get_version(self):
+        """When the cached tables were last imported, per geonamemetadata"""
+        table = GeonameMetadata.__table__
+        tablenames = [model.__tablename__ for _, model, _ in _cached_tables]
+        query = (
+            select([func.max(table.c.last_updated), func.count()])
+            .where(table.c.tablename.in_(tablenames))
+        )
+        return tuple(self.bind.execute(query).first())
+
+    def load(self):
+        version = self.get_version()
+        maps = {}
+        for name, model, record_class in _cached_tables:
+            table = model.__table__
+            pk_names = [c.name for c in table.primary_key.columns]
+            records = (record_class(*row)
+                       for row in self.bind.execute(table.select()))
+            if len(pk_names) == 1:
+                maps[name] = dict((getattr(r, pk_names[0]), r)
+                                  for r in records)
+            else:
+                maps[name] = dict(
+                    (tuple(getattr(r, n) for n in pk_names), r)
+                    for r in records)
+        # Replaced in one go, so lookups see either the old or new maps
+        self.maps = maps
+        self.version = version
+        self.checked_at = time.time()
+
+    def invalidate(self):
+        """Reload on the next lookup"""
+        self.checked_at = None
+
+    def get_maps(self):
+        if self.checked_at is not None and (
+            time.time() - self.checked_at < self.ttl
+        ):
+            return self.maps
+        with self.lock:
+            # Another thread may have reloaded while we waited for the lock
+            if self.checked_at is None or (
+                time.time() - self.checked_at >= self.ttl
+            ):
+                if self.maps is None or self.get_version() != self.version:
+                    self.load()
+                else:
+                    self.checked_at = time.time()
+        return self.maps
+
+    def country(self, iso):
+        return self.get_maps()['countries'].get(iso)
+
+    def timezone(self, timezone_id):
+        return self.get_maps()['timezones'].get(timezone_id)
+
+    def feature(self, feature_code, language_code=None):
+        """The feature, named in `language_code` if there's a translation"""
+        maps = self.get_maps()
+        if language_code is not None:
+            translation = maps['feature_translations'].get(
+                (feature_code, language_code))
+            if translation is not None:
+                return translation
+        return maps['features'].get(feature_code)
+
+    def admin1(self, country_code, admin1_code):
+        code = u'{}.{}'.format(country_code, admin1_code)
+        return self.get_maps()['admin1_codes'].get(code)
+
+    def countries(self):
+        return list(self.get_maps()['countries'].values())
+
+    def timezones(self):
+        return list(self.get_maps()['timezones'].values())
+
+    def features(self, language_code=None):
+        maps = self.get_maps()
+        if language_code is None:
+            return list(maps['features'].values())
+        return [self.feature(code, language_code) for code in maps['features']]
+
+    def feature_languages(self):
+        """Codes of the languages that features have been translated to"""
+        return sorted(set(language_code for _, language_code
+                          in self.get_maps()['feature_translations']))
+
+    # Resolve the codes of a `Geoname` (or `GeonameDetail`, or anything else
+    # with the same attributes)
+
+    def country_of(self, geoname):
+        return self.country(geoname.country_code)
+
+    def timezone_of(self, geoname):
+        return self.timezone(geoname.timezone_id)
+
+    def feature_of(self, geoname, language_code=None):
+        return self.feature(geoname.feature_code, language_code)
+
+    def admin1_of(self, geoname):
+        return self.admin1(geoname.country_code, geoname.admin1_code)
+
+
+_caches = weakref.WeakKeyDictionary()
+_caches_lock = threading.Lock()
+
+
+def get_reference_cache(engine, ttl=300):
+    """The process wide `ReferenceCache` of `engine`
+
+    `ttl` only applies when the cache is created.
+    """
+    with _caches_lock:
+        cache = _caches.get(engine)
+        if cache is None:
+            cache = _caches[engine] = ReferenceCache(engine, ttl=ttl)
+        return cache
@@ -0,0 +1,420 @@
+"""Keeping the geonames up to date with the daily deltas
+
+Every day geonames publishes the changes of the previous day:
+modifications-YYYY-MM-DD.txt with the new and changed geonames (formatted as
+allCountries.txt), deletes-YYYY-MM-DD.txt with the deleted ones, and
+alternateNamesModifications-YYYY-MM-DD.txt and
+alternateNamesDeletes-YYYY-MM-DD.txt likewise for the alternate names. Only
+the latest files are kept, so a day that isn't applied in time means a full
+reimport. `DeltaDaemon` polls for them and applies them as they appear::
+
+    daemon = DeltaDaemon(engine, HTTPSource(download_dir))
+    serve_metrics(daemon, port=9100)
+    daemon.run(interval=3600)
+
+`sqlageonames daemon` does the same from the command line.
+
+The files of a day are applied in a single transaction, in batches of
+`batch_size` rows, and recorded in `GeonameMetadata` (one row per file) in
+the same transaction. Days are applied in order, from the day after the last
+applied one or, if none has been applied since the geoname table was last
+imported, from the day before that import. A day whose files are missing
+while those of the latest day are available has been missed. The daemon
+won't skip it, and reports itself unhealthy until the data has been brought
+up to date with a full import (`sqlageonames --upsert`).
+
+`DeltaDaemon.status` tells when the daemon last polled, up to which day the
+data is current and whether that's recent enough. `serve_metrics` serves it
+over HTTP, as JSON on /health (with status 503 when unhealthy) and in
+Prometheus' text format on /metrics.
+"""
+import calendar
+import json
+import os
+import re
+import threading
+import time
+from datetime import datetime, timedelta
+from sqlalchemy import select
+from . import imports, log, reader, search, sqlite, state, views
+from ._compat import utc
+from .files import (BASE_DOWNLOAD_URL, delta_filename_templates,
+                    filename_config)
+from .models import Geoname, GeonameAlternateName, GeonameMetadata
+from .sinks import get_upsert_statement
+
+logger = log.get_logger()
+
+# The deltas in the order they're applied, as (kind, import options) for
+# modifications and (kind, reader) for deletes
+_geoname_deltas = (
+    ('modifications', imports.GeonameImportOptions),
+    ('deletes', reader.GeonameDeletesReader),
+)
+_alternate_name_deltas = (
+    ('alternate_name_modifications',
+     imports.GeonameAlternateNameImportOptions),
+    ('alternate_name_deletes', reader.GeonameAlternateNameDeletesReader),
+)
+
+_modifications_filename_re = re.compile(
+    r'^modifications-(\d{4})-(\d{2})-(\d{2})\.txt$')
+
+
+def delta_filename(kind, day):
+    """Name of the `kind` delta file of `day`, see `delta_filename_templates`
+    """
+    return delta_filename_templates[kind].format(day.isoformat())
+
+
+def _delta_date(filename):
+    match = _modifications_filename_re.match(filename)
+    if match is None:
+        return None
+    return datetime(*map(int, match.groups())).date()
+
+
+class DirectorySource(object):
+    """Delta files that are put in a local directory by other means"""
+
+    def __init__(self, directory):
+        self.directory = directory
+
+    def exists(self, filename):
+        return os.path.exists(os.path.join(self.directory, filename))
+
+    def fetch(self, filename):
+        """Path to the file, or None if it isn't available (yet)"""
+        filepath = os.path.join(self.directory, filename)
+        return filepath if os.path.exists(filepath) else None
+
+
+class HTTPSource(object):
+    """Delta files downloaded from geonames into `download_dir`"""
+
+    def __init__(self, download_dir, base_url=BASE_DOWNLOAD_URL):
+        self.download_dir = download_dir
+        self.base_url = base_url
+
+    def exists(self, filename):
+        import requests
+        response = requests.head(self.base_url + filename)
+        return response.status_code == 200
+
+    def fetch(self, filename):
+        filepath = os.path.join(self.download_dir, filename)
+        if os.path.exists(filepath):
+            return filepath
+        import requests
+        response = requests.get(self.base_url + filename, stream=True)
+        if response.status_code == 404:
+            return None
+        response.raise_for_status()
+        # Written under another name first, so that an interrupted download
+        # isn't mistaken for the complete file later
+        tmp_filepath = filepath + '.tmp'
+        with open(tmp_filepath, 'wb') as fh:
+            for chunk in response.iter_content(chunk_size=1 << 16):
+                fh.write(chunk)
+        os.rename(tmp_filepath, filepath)
+        return filepath
+
+
+class DeltaDaemon(object):
+    """Applies the daily deltas to the database, see module docstring
+
+    The alternate name deltas are only applied with `alternate_names`.
+    With `geohash` the geohashes of the modified geonames are computed, as
+    when importing with it.
+    After days have been applied, the views and the other data derived from
+    the geonames (the SQLite indexes and, with `search_names`, the name
+    search table) are rebuilt. The daemon is healthy as long as the latest
+    applied day is at most `max_lag_days` behind the latest available one.
+    """
+
+    delete_chunk_size = 1000
+
+    def __init__(self, engine, source, alternate_names=False,
+                 search_names=False, since=None, batch_size=1000,
+                 max_lag_days=2, geohash=False):
+        self.engine = engine
+        self.source = source
+        self.deltas = _geoname_deltas
+        if alternate_names:
+            self.deltas += _alternate_name_deltas
+        self.search_names = search_names
+        self.geohash = geohash
+        # First day to apply when no delta has been applied yet
+        self.since = since
+        self.batch_size = batch_size
+        self.max_lag_days = max_lag_days
+        self.last_applied_date = None
+        self.gap_date = None
+        self.last_poll = None
+        self.last_error = None
+        self.applied_days = 0
+        self.poll_errors = 0
+
+    def today(self):
+        return datetime.now(utc).date()
+
+    def latest_date(self):
+        """The latest day whose deltas may have been published"""
+        return self.today() - timedelta(days=1)
+
+    def get_last_applied_date(self):
+        """The latest day applied since the geoname table's last import
+
+        If there's none, the day before the first day to apply: `since`
+        until the first day has been applied, the import's day otherwise.
+        None if the geoname table hasn't been imported.
+        """
+        table = GeonameMetadata.__table__
+        rows = self.engine.execute(
+            select([table.c.filename, table.c.last_updated])
+            .where(table.c.tablename == Geoname.__tablename__)).fetchall()
+        imported = [last_updated for filename, last_updated in rows
+                    if filename in filename_config]
+        last_imported = max(imported) if imported else None
+        deltas = [(_delta_date(filename), last_updated)
+                  for filename, last_updated in rows]
+        deltas = [(day, last_updated) for day, last_updated in deltas
+                  if day is not None]
+        # Deltas applied before the latest import, e.g. one that caught up
+        # after a missed day, are superseded by it
+        delta_dates = [day for day, last_updated in deltas
+                       if last_imported is None or
+                       last_updated >= last_imported]
+        if delta_dates:
+            return max(delta_dates)
+        if self.since is not None and not deltas:
+            return self.since - timedelta(days=1)
+        if last_imported is None:
+            return None
+        # The dumps hold the changes up to the day before they're made
+        return last_imported.date() - timedelta(days=2)
+
+    def fetch_day(self, day):
+        """{kind: filepath} of the day's deltas, None if any is missing"""
+        filepaths = {}
+        for kind, _ in self.deltas:
+            filepath = self.source.fetch(delta_filename(kind, day))
+            if filepath is None:
+                return None
+            filepaths[kind] = filepath
+        return filepaths
+
+    def catch_up(self):
+        """Apply the days not yet applied, in order. Returns their number"""
+        last_applied_date = self.get_last_applied_date()
+        if last_applied_date is None:
+            raise ValueError(u'Import a geonames file before applying the '
+                             u'daily deltas to it')
+        latest_date = self.latest_date()
+        day = last_applied_date + timedelta(days=1)
+        applied = 0
+        self.gap_date = None
+        while day <= latest_date:
+            filepaths = self.fetch_day(day)
+            if filepaths is None:
+                if day < latest_date and self.source.exists(
+                        delta_filename('modifications', latest_date)):
+                    self.gap_date = day
+                    logger.error(u'The deltas of {} are missing, reimport '
+                                 u'the geonames to catch up'.format(day))
+                break
+            self.apply_day(day, filepaths)
+            last_applied_date = day
+            applied += 1
+            day += timedelta(days=1)
+        self.last_applied_date = last_applied_date
+        self.applied_days += applied
+        return applied
+
+    def apply_day(self, day, filepaths):
+        """Apply the files of `fetch_day` in one transaction"""
+        logger.info(u'Applying the deltas of {}'.format(day))
+        with self.engine.connect() as connection, connection.begin():
+            for kind, options in self.deltas:
+                filepath = filepaths[kind]
+                if kind.endswith('deletes'):
+                    table, count = self.apply_deletes(connection, filepath,
+                                                      options)
+                else:
+                    table, count = self.apply_modifications(
+                        connection, filepath, options)
+                state.record_delta(connection, os.path.basename(filepath),
+                                   table.name, state.file_digest(filepath),
+                                   count)
+
+    def _batches(self, rows):
+        batch = []
+        for row in rows:
+            batch.append(row)
+            if len(batch) >= self.batch_size:
+                yield batch
+                batch = []
+        if batch:
+            yield batch
+
+    def apply_modifications(self, connection, filepath, options):
+        """Upsert the rows of the file, returns (table, row count)"""
+        table = options.model.__table__
+        dialect_name = self.engine.dialect.name
+        computed_values = dict(
+            (name, get_sql(dialect_name))
+            for name, get_sql in options.computed_columns.items())
+        modifiers = list(options.modifiers)
+        if self.geohash and 'geohash' in table.c:
+            modifiers.append(imports.set_geohash_modifier)
+        statement = None
+        count = 0
+        for rows in self._batches(options.file_class(filepath)):
+            for modifier in modifiers:
+                rows = [modifier(None, options.model, row) for row in rows]
+            if statement is None:
+                statement = get_upsert_statement(
+                    table, dialect_name, column_names=set(rows[0]),
+                    computed_values=computed_values)
+            connection.execute(statement, rows)
+            count += len(rows)
+        return table, count
+
+    def apply_deletes(self, connection, filepath, reader_class):
+        """Delete the rows listed in the file, returns (table, row count)"""
+        key_name = reader_class.field_definitions[0][0]
+        if reader_class is reader.GeonameDeletesReader:
+            table = Geoname.__table__
+        else:
+            table = GeonameAlternateName.__table__
+        keys = [row[key_name]
+                for row in reader_class(filepath, columns=(key_name,))]
+        for i in range(0, len(keys), self.delete_chunk_size):
+            chunk = keys[i:i + self.delete_chunk_size]
+            connection.execute(
+                table.delete().where(table.c[key_name].in_(chunk)))
+        return table, len(keys)
+
+    def refresh_derived_data(self):
+        """Rebuild what's derived from the geonames, see class docstring"""
+        views.refresh_views(self.engine, concurrently=True)
+        if self.search_names:
+            search.build_name_table(self.engine)
+        if sqlite.is_sqlite(self.engine):
+            sqlite.create_indexes(self.engine)
+
+    def poll(self):
+        """Apply the days that are available, returns their number
+
+        Errors are logged and counted rather than raised, the days are
+        retried on the next poll.
+        """
+        self.last_poll = datetime.now(utc)
+        try:
+            applied = self.catch_up()
+            if applied:
+                self.refresh_derived_data()
+        except Exception as exc:
+            self.poll_errors += 1
+            self.last_error = u'{}: {}'.format(exc.__class__.__name__, exc)
+            logger.exception(u'Applying the daily deltas failed')
+            return 0
+        self.last_error = None
+        return applied
+
+    def run(self, interval=3600, once=False):
+        """Poll every `interval` seconds, or just once"""
+        while True:
+            self.poll()
+            if once:
+                return
+            time.sleep(interval)
+
+    @property
+    def lag_days(self):
+        """Days that the data lags behind the latest available deltas"""
+        if self.last_applied_date is None:
+            return None
+        return (self.latest_date() - self.last_applied_date).days
+
+    @property
+    def is_healthy(self):
+        lag_days = self.lag_days
+        return (
+            self.last_error is None and self.gap_date is None and
+            lag_days is not None and lag_days <= self.max_lag_days
+        )
+
+    def status(self):
+        """Health and lag, as a JSON serializable dict"""
+        def isoformat(value):
+            return value.isoformat() if value is not None else None
+        return {
+            'healthy': self.is_healthy,
+            'last_applied_date': isoformat(self.last_applied_date),
+            'lag_days': self.lag_days,
+            'gap_date': isoformat(self.gap_date),
+            'last_poll': isoformat(self.last_poll),
+            'last_error': self.last_error,
+            'applied_days': self.applied_days,
+            'poll_errors': self.poll_errors,
+        }
+
+    def metrics(self):
+        """The status in Prometheus' text exposition format"""
+        lag_days = self.lag_days
+        last_poll = self.last_poll
+        values = [
+            ('healthy', 'gauge', int(self.is_healthy)),
+            ('lag_days', 'gauge', -1 if lag_days is None else lag_days),
+            ('last_poll_timestamp_seconds', 'gauge',
+             0 if last_poll is None else calendar.timegm(
+                 last_poll.utctimetuple())),
+            ('applied_days_total', 'counter', self.applied_days),
+            ('poll_errors_total', 'counter', self.poll_errors),
+        ]
+        lines = []
+        for name, metric_type, value in values:
+            name = 'geonames_delta_' + name
+            lines.append('# TYPE {} {}'.format(name, metric_type))
+            lines.append('{} {}'.format(name, value))
+        return '\n'.join(lines) + '\n'
+
+
+def serve_metrics(daemon, port, host=''):
+    """Serve the daemon's status in a background thread, see module docstring
+
+    Returns the server, `shutdown()` stops it.
+    """
+    try:
+        from http.server import BaseHTTPRequestHandler, HTTPServer
+    except ImportError:
+        from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path == '/health':
+                status = 200 if daemon.is_healthy else 503
+                body = json.dumps(daemon.status())
+                content_type = 'application/json'
+            elif self.path == '/metrics':
+                status = 200
+                body = daemon.metrics()
+                content_type = 'text/plain; version=0.0.4'
+            else:
+                status, body, content_type = 404, '', 'text/plain'
+            body = body.encode('utf-8')
+            self.send_response(status)
+            self.send_header('Content-Type', content_type)
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            logger.debug(format % args)
+
+    server = HTTPServer((host, port), Handler)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    return server
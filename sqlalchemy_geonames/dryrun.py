@@ -0,0 +1,104 @@
+"""Reading the geonames files without a database
+
+A dry run streams a file through its reader and the importer's modifiers,
+and reports how fast each stage is and which rows the reader had trouble
+with, see `reader.RowIssues`. It's a quick way to try out a new dump or a
+reader change, which is what `sqlageonames --dry-run` does::
+
+    for importer in get_importer_instances(None, *filepaths):
+        print(format_report(dry_run(importer)))
+
+Rows with values that can't be converted are counted as invalid instead of
+aborting the run. Nothing is written anywhere, and the computed columns,
+which the database computes, are left out.
+"""
+from __future__ import division
+import time
+from itertools import islice
+
+DEFAULT_BATCH_SIZE = 10000
+
+
+def _ignore_error(rownum, line, exc):
+    pass
+
+
+def _stage(name, row_count, seconds):
+    return {
+        'name': name,
+        'seconds': seconds,
+        'rows_per_second': row_count / seconds if seconds else None,
+    }
+
+
+def dry_run(importer, batch_size=DEFAULT_BATCH_SIZE):
+    """Read the file of `importer` and return a report of it
+
+    The report is a dict with the `filename`, the number of `rows` and
+    `bytes` read, the total `seconds`, the `stages` (reading, then each
+    modifier) with their `seconds` and `rows_per_second`, and the reader's
+    `issues`. The rows are processed `batch_size` at a time, each stage
+    timed as a whole.
+    """
+    reader = importer.file_class(importer.filepath, on_error=_ignore_error,
+                                 columns=importer.columns)
+    rows_iter = iter(reader)
+    read_seconds = 0.0
+    modifier_seconds = [0.0] * len(importer.modifiers)
+    row_count = 0
+    started = time.time()
+    while True:
+        stage_started = time.time()
+        rows = list(islice(rows_iter, batch_size))
+        if importer.scope:
+            for row in rows:
+                row.update(importer.scope)
+        read_seconds += time.time() - stage_started
+        if not rows:
+            break
+        for i, modifier in enumerate(importer.modifiers):
+            stage_started = time.time()
+            rows = [modifier(importer.session, importer.model, row)
+                    for row in rows]
+            modifier_seconds[i] += time.time() - stage_started
+        row_count += len(rows)
+    stages = [_stage('read', row_count, read_seconds)]
+    stages.extend(
+        _stage(getattr(modifier, '__name__', repr(modifier)), row_count,
+               seconds)
+        for modifier, seconds in zip(importer.modifiers, modifier_seconds))
+    return {
+        'filename': importer.filename,
+        'rows': row_count,
+        'bytes': reader.offset,
+        'seconds': time.time() - started,
+        'stages': stages,
+        'issues': reader.issues,
+    }
+
+
+def _format_rate(rows_per_second):
+    if rows_per_second is None:
+        return u'-'
+    return u'{:,.0f} rows/s'.format(rows_per_second)
+
+
+def format_report(report):
+    """`report` of `dry_run` as text, one line per stage and sample"""
+    seconds = report['seconds']
+    lines = [u'{}: {:,} rows ({:.1f}MB) in {:.1f}s, {}'.format(
+        report['filename'], report['rows'], report['bytes'] / 1e6, seconds,
+        _format_rate(report['rows'] / seconds if seconds else None))]
+    for stage in report['stages']:
+        lines.append(u'  {:<30} {:>18}'.format(
+            stage['name'], _format_rate(stage['rows_per_second'])))
+    issues = report['issues']
+    if not issues:
+        lines.append(u'  No malformed, padded, skipped or invalid rows')
+        return u'\n'.join(lines)
+    lines.append(u'  ' + issues.summary())
+    for kind in issues.kinds:
+        for rownum, line in issues.samples[kind]:
+            lines.append(u'    {} row #{}: {}'.format(
+                kind, rownum, line.replace(u'\t', u'\\t')))
+    return u'\n'.join(lines)
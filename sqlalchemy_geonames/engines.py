@@ -0,0 +1,116 @@
+"""Engines tuned for importing and for querying the geonames
+
+    engine = create_engine(db_url, profile='import')
+    engine = create_engine(db_url, profile='query',
+                           settings={'statement_timeout': '2s'}, pool_size=20)
+
+A profile in `ENGINE_PROFILES` combines options for
+`sqlalchemy.create_engine` with run-time parameters (settings) that every
+PostgreSQL connection is opened with:
+
+* import: psycopg2's `execute_values` for the batches of inserts and
+  upserts, so that a batch is sent as a few multi-row statements instead of
+  a statement per row. `synchronous_commit` is off, as an import that is
+  cut short is rerun or resumed anyway, and `work_mem` and
+  `maintenance_work_mem` are large for building the indexes, the detail view
+  and the name table. On SQLite the connections get
+  `sqlite.BULK_LOAD_PRAGMAS`.
+* query: a larger pool of connections that are checked before they're
+  used and recycled hourly, and a statement timeout so that a runaway query
+  doesn't hold on to a connection.
+* default: SQLAlchemy's defaults.
+
+`settings` and keyword arguments override those of the profile.
+`sqlageonames` uses the import profile unless given another one with
+`--engine-profile`, and `--db-setting` overrides single settings.
+"""
+from sqlalchemy import create_engine as sa_create_engine
+from sqlalchemy.engine.url import make_url
+from . import sqlite
+from ._compat import text_type
+
+ENGINE_PROFILES = {
+    'import': {
+        'postgresql_options': {
+            'executemany_mode': 'values',
+            # Rows per INSERT, the batches are up to about 8MB anyway
+            'executemany_values_page_size': 10000,
+            # Statements per round trip for updates and deletes
+            'executemany_batch_page_size': 500,
+        },
+        'settings': {
+            'synchronous_commit': 'off',
+            'work_mem': '256MB',
+            'maintenance_work_mem': '1GB',
+            'statement_timeout': '0',
+        },
+        'sqlite_bulk_load': True,
+    },
+    'query': {
+        'pool_options': {
+            'pool_size': 10,
+            'max_overflow': 20,
+            'pool_timeout': 30,
+            'pool_pre_ping': True,
+            'pool_recycle': 3600,
+        },
+        'settings': {
+            'statement_timeout': '30s',
+        },
+    },
+    'default': {},
+}
+
+
+def _settings_option(settings):
+    # libpq's `options` connection parameter, in which spaces and
+    # backslashes are escaped with backslashes
+    return u' '.join(
+        u'-c {}={}'.format(name, text_type(value).replace(u'\\', u'\\\\')
+                           .replace(u' ', u'\\ '))
+        for name, value in sorted(settings.items()))
+
+
+def get_engine_options(url, profile='default', settings=None, **options):
+    """The keyword arguments of `sqlalchemy.create_engine` for `profile`
+
+    See module docstring. Settings only apply to PostgreSQL.
+    """
+    try:
+        config = ENGINE_PROFILES[profile]
+    except KeyError:
+        raise ValueError(u'Unknown engine profile {}, expected one of {}'
+                         .format(profile, u', '.join(sorted(ENGINE_PROFILES))))
+    backend_name = make_url(url).get_backend_name()
+    engine_options = {}
+    if backend_name == 'postgresql':
+        engine_options.update(config.get('postgresql_options', {}))
+    # File based SQLite databases don't use a pool with a size
+    if backend_name != 'sqlite':
+        engine_options.update(config.get('pool_options', {}))
+    engine_options.update(options)
+    all_settings = dict(config.get('settings', {}))
+    all_settings.update(settings or {})
+    if backend_name == 'postgresql' and all_settings:
+        connect_args = dict(engine_options.get('connect_args', {}))
+        connect_args['options'] = u' '.join(
+            option for option in (connect_args.get('options'),
+                                  _settings_option(all_settings))
+            if option)
+        engine_options['connect_args'] = connect_args
+    return engine_options
+
+
+def create_engine(url, profile='default', settings=None, **options):
+    """`sqlalchemy.create_engine` with the options of `profile`
+
+    `settings` are PostgreSQL run-time parameters by name, and `options`
+    other keyword arguments of `sqlalchemy.create_engine`. Both override
+    the profile's.
+    """
+    engine = sa_create_engine(
+        url, **get_engine_options(url, profile, settings, **options))
+    if sqlite.is_sqlite(engine) and ENGINE_PROFILES[profile].get(
+            'sqlite_bulk_load'):
+        sqlite.configure_bulk_load(engine)
+    return engine
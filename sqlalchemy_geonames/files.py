@@ -1,4 +1,5 @@
 BASE_DOWNLOAD_URL = 'http://download.geonames.org/export/dump/'
+BASE_POSTAL_CODE_URL = 'http://download.geonames.org/export/zip/'
 
 
 def full_url(filename):
@@ -18,8 +19,10 @@ filename_config = {
         'is_primary': True,
     },
     'alternateNames.txt': {
-        'url': full_url('alternateNames.zip'),
+        'url': full_url('alternateNamesV2.zip'),
+        'zip_member': 'alternateNamesV2.txt',
         'unzip': True,
+        'optional': True,
     },
     'cities1000.txt': {
         'url': full_url('cities1000.zip'),
@@ -74,17 +77,43 @@ filename_config = {
     'iso-languagecodes.txt': {
         'url': full_url('iso-languagecodes.txt'),
     },
+    'no-country.txt': {
+        'url': full_url('no-country.zip'),
+        'unzip': True,
+        'optional': True,
+        # Its geonames are part of allCountries.txt
+        'included_in': 'allCountries.txt',
+    },
+    'postalCodes.txt': {
+        # Has the same name as the main dump's allCountries.zip, so it's
+        # saved and extracted under other names.
+        'url': BASE_POSTAL_CODE_URL + 'allCountries.zip',
+        'download_filename': 'postalCodes.zip',
+        'zip_member': 'allCountries.txt',
+        'unzip': True,
+        # Only downloaded when asked for
+        'optional': True,
+    },
+    'shapes_simplified_low.json': {
+        'url': full_url('shapes_simplified_low.json.zip'),
+        'unzip': True,
+        'optional': True,
+    },
     'timeZones.txt': {
         'url': full_url('timeZones.txt'),
     },
     'userTags.txt': {
         'url': full_url('userTags.zip'),
         'unzip': True,
+        'optional': True,
     },
 }
 
-# TODO: Support modification files
-# alternateNamesDeletes-2013-12-16.txt
-# alternateNamesModifications-2013-12-16.txt
-# deletes-2013-12-16.txt
-# modifications-2013-12-16.txt
+# The daily deltas, applied by `.daemon`. Formatted with the date of the
+# changes they hold. Geonames only keeps the ones of the previous day.
+delta_filename_templates = {
+    'modifications': 'modifications-{}.txt',
+    'deletes': 'deletes-{}.txt',
+    'alternate_name_modifications': 'alternateNamesModifications-{}.txt',
+    'alternate_name_deletes': 'alternateNamesDeletes-{}.txt',
+}
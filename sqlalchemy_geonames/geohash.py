@@ -0,0 +1,156 @@
+"""Geohashes for grid based lookups and aggregation
+
+A geohash identifies a cell in a grid over the globe. Every character added
+subdivides the cell into 32 smaller ones, so the geohash of a point at a
+lower precision is a prefix of the one at a higher precision. Storing the
+geohash of every geoname at `PRECISION` therefore makes all lower precisions
+available as well, and prefix lookups on an index on the column can be used
+to find the geonames within cells (`prefix_filter`) or to count them per
+cell (`cell_counts`).
+
+The column is only filled in when importing with `geohash=True`, see
+`get_importer_instances`.
+"""
+from sqlalchemy import func, or_
+from .models import Geoname
+from .sqlite import is_sqlite
+
+# About 4.8 x 4.8 meters at the equator
+PRECISION = 9
+
+_BASE32 = '0123456789bcdefghjkmnpqrstuvwxyz'
+_BASE32_INDEX = dict((c, i) for i, c in enumerate(_BASE32))
+
+
+def _bit_counts(precision):
+    """Number of (longitude, latitude) bits in a geohash of `precision`"""
+    bits = precision * 5
+    return (bits + 1) // 2, bits // 2
+
+
+def _spread(value):
+    # Moves bit n of a 32 bit integer to bit 2n
+    value = (value | (value << 16)) & 0x0000FFFF0000FFFF
+    value = (value | (value << 8)) & 0x00FF00FF00FF00FF
+    value = (value | (value << 4)) & 0x0F0F0F0F0F0F0F0F
+    value = (value | (value << 2)) & 0x3333333333333333
+    return (value | (value << 1)) & 0x5555555555555555
+
+
+def _quantize(value, minimum, maximum, bits):
+    cells = 1 << bits
+    index = int((value - minimum) / (maximum - minimum) * cells)
+    return min(max(index, 0), cells - 1)
+
+
+def _cell_geohash(lon_index, lat_index, precision):
+    lon_bits, lat_bits = _bit_counts(precision)
+    # Bits alternate between longitude and latitude, starting with the
+    # longitude, so with an odd number of bits the last one is a longitude
+    # bit too.
+    if lon_bits == lat_bits:
+        code = (_spread(lon_index) << 1) | _spread(lat_index)
+    else:
+        code = _spread(lon_index) | (_spread(lat_index) << 1)
+    return ''.join(_BASE32[(code >> shift) & 31]
+                   for shift in range(precision * 5 - 5, -1, -5))
+
+
+def encode(latitude, longitude, precision=PRECISION):
+    """The geohash of a position"""
+    lon_bits, lat_bits = _bit_counts(precision)
+    return _cell_geohash(_quantize(longitude, -180.0, 180.0, lon_bits),
+                         _quantize(latitude, -90.0, 90.0, lat_bits),
+                         precision)
+
+
+def decode_bbox(geohash):
+    """The (min_lat, min_lon, max_lat, max_lon) of a geohash's cell"""
+    lon_bits, lat_bits = _bit_counts(len(geohash))
+    code = 0
+    for char in geohash:
+        code = (code << 5) | _BASE32_INDEX[char]
+    lon_index = lat_index = 0
+    for bit in range(len(geohash) * 5 - 1, -1, -1):
+        # The last bit belongs to the longitude when there are more of them
+        is_lon = (bit % 2 == 0) if lon_bits > lat_bits else (bit % 2 == 1)
+        if is_lon:
+            lon_index = (lon_index << 1) | ((code >> bit) & 1)
+        else:
+            lat_index = (lat_index << 1) | ((code >> bit) & 1)
+    lat_size = 180.0 / (1 << lat_bits)
+    lon_size = 360.0 / (1 << lon_bits)
+    min_lat = -90.0 + lat_index * lat_size
+    min_lon = -180.0 + lon_index * lon_size
+    return min_lat, min_lon, min_lat + lat_size, min_lon + lon_size
+
+
+def covering_geohashes(min_lat, min_lon, max_lat, max_lon, max_cells=32):
+    """Geohashes of cells that together cover a bounding box
+
+    Uses the highest precision at which no more than `max_cells` cells are
+    needed, so the cells cover as little as possible outside the box.
+    """
+    geohashes = None
+    for precision in range(1, PRECISION + 1):
+        lon_bits, lat_bits = _bit_counts(precision)
+        lon_range = (_quantize(min_lon, -180.0, 180.0, lon_bits),
+                     _quantize(max_lon, -180.0, 180.0, lon_bits))
+        lat_range = (_quantize(min_lat, -90.0, 90.0, lat_bits),
+                     _quantize(max_lat, -90.0, 90.0, lat_bits))
+        num_cells = ((lon_range[1] - lon_range[0] + 1) *
+                     (lat_range[1] - lat_range[0] + 1))
+        if num_cells > max_cells and geohashes is not None:
+            break
+        geohashes = [_cell_geohash(lon_index, lat_index, precision)
+                     for lon_index in range(lon_range[0], lon_range[1] + 1)
+                     for lat_index in range(lat_range[0], lat_range[1] + 1)]
+    return geohashes
+
+
+def _prefix_condition(column, prefix, sqlite):
+    if sqlite:
+        # SQLite's LIKE is case insensitive and can't use the index
+        return (column >= prefix) & (column < prefix + u'~')
+    return column.startswith(prefix)
+
+
+def prefix_filter(bind, column, geohashes):
+    """Filter for rows whose geohash `column` is within any of `geohashes`"""
+    sqlite = is_sqlite(bind)
+    return or_(*[_prefix_condition(column, g, sqlite) for g in geohashes])
+
+
+def geonames_near_bbox(session, min_lat, min_lon, max_lat, max_lon,
+                       max_cells=32):
+    """Query for geonames in the geohash cells covering a bounding box
+
+    This is a prefilter, the cells extend outside of the box. Narrow the
+    result down further with an exact test if needed.
+    """
+    geohashes = covering_geohashes(min_lat, min_lon, max_lat, max_lon,
+                                   max_cells)
+    return session.query(Geoname).filter(
+        prefix_filter(session.bind, Geoname.geohash, geohashes))
+
+
+def cell_counts(session, precision, bbox=None):
+    """Number of geonames per geohash cell of `precision`, e.g. for map tiles
+
+    Returns a list of (geohash, count) tuples. Pass a (min_lat, min_lon,
+    max_lat, max_lon) `bbox` to only count the cells covering it.
+    """
+    cell = func.substr(Geoname.geohash, 1, precision).label('cell')
+    query = (
+        session.query(cell, func.count())
+        .filter(Geoname.geohash.isnot(None))
+        .group_by(cell)
+        .order_by(cell)
+    )
+    if bbox is not None:
+        # Cells at `precision` are within or equal to those covering the box
+        # at the same or a lower precision.
+        geohashes = [g[:precision] for g in covering_geohashes(*bbox)]
+        query = query.filter(
+            prefix_filter(session.bind, Geoname.geohash, set(geohashes)))
+    return query.all()
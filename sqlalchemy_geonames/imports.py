@@ -1,6 +1,17 @@
 from __future__ import print_function
-from . import reader, models, settings
-from ._compat import implements_to_string
+import io
+import json
+import re
+import time
+from sqlalchemy import Float, bindparam, text
+from . import reader, models
+from ._compat import implements_to_string, text_type
+from .batching import BatchSizer
+from .geohash import encode as encode_geohash
+from .shapes import geojson_bbox, shape_from_geojson
+from .sinks import DatabaseSink, _json_default
+from .state import ExistingKeys, RowHashes, file_digest
+from .utils import cached_property
 
 # See note in _compat for why decimal is imported
 from ._compat import decimal  # noqa
@@ -9,6 +20,8 @@ from ._compat import decimal  # noqa
 @implements_to_string
 class Importer(object):
 
+    # Size of the first batch of rows. The size of the following batches is
+    # adapted by `batch_sizer` to how fast the sinks store them.
     num_simoultaneous_inserts = 500
 
     def __str__(self):
@@ -16,18 +29,120 @@ class Importer(object):
                                          self.filename)
     __repr__ = __str__
 
-    def __init__(self, options, filepath, session):
+    def __init__(self, options, filepath, session, sinks=None,
+                 row_hashes=False, checkpoint_interval=None,
+                 reject_filepath=None, geohash=False, columns=None,
+                 parse_cache=False):
         self.filepath = filepath
         self.filename = _get_import_filename(filepath)
         self.session = session
-        self.engine = session.bind
+        # `session` may be None when only writing to non-database sinks
+        self.engine = session.bind if session is not None else None
+        # Sinks created here are closed by `run`. Sinks passed in are left
+        # for the caller to close.
+        self.owns_sinks = sinks is None
+        if sinks is None:
+            sinks = [DatabaseSink(self.engine)]
+        self.sinks = sinks
         self.stored_rows = []
+        self.batch_sizer = BatchSizer(
+            initial_size=self.num_simoultaneous_inserts)
+        # Byte offset in the file where the current batch started
+        self.batch_offset = 0
         self.options = options
         self.file_class = options.file_class
         self.model = options.model
         self.table = self.model.__table__
-        self.modifiers = options.modifiers
+        self.modifiers = list(options.modifiers)
+        if geohash and 'geohash' in self.table.c:
+            self.modifiers.append(set_geohash_modifier)
         self.model_dependencies = options.model_dependencies
+        # Values shared by all rows of the file, added to each of them
+        self.scope = options.get_scope(self.filename)
+        self.key_names = [c.name for c in self.table.primary_key.columns]
+        # Names of the fields to import, all if None. Others are left NULL
+        # when inserting, and untouched when upserting.
+        self.columns = None
+        if columns is not None:
+            self.columns = self.get_columns(columns)
+        # Read the file through `.parsecache`
+        self.parse_cache = parse_cache
+        self.row_count = 0
+        self.last_key = None
+        self.reader = None
+        # Save a checkpoint every `checkpoint_interval` rows, see `resume`
+        self.checkpoint_interval = checkpoint_interval
+        self.checkpoint_row_count = 0
+        # (byte offset, row number, row count) to resume from
+        self.resume_from = None
+        # Rows that fail to be parsed or stored are written here instead of
+        # aborting the import, when set.
+        self.rejects = None
+        if reject_filepath is not None:
+            self.rejects = RejectFile(reject_filepath)
+        # Only write rows that changed since the last import. Only makes
+        # sense together with an upserting sink. See also
+        # `skip_existing_keys`, which replaces it.
+        self.row_hashes = None
+        if row_hashes and self.has_natural_key:
+            self.row_hashes = RowHashes(
+                filepath,
+                key_names=self.key_names,
+                field_names=self.field_names,
+            )
+
+    def skip_existing_keys(self, existing, current=None):
+        """Only write the rows whose key isn't in the `IdSet` `existing`
+
+        Requires an upserting sink, whose `delete_missing` removes the
+        existing rows that weren't in the file, or in any of the files
+        sharing the `IdSet` `current`. See `state.ExistingKeys`.
+        """
+        if len(self.key_names) != 1:
+            raise ValueError(u'{} has no single key to skip rows by'.format(
+                self))
+        self.row_hashes = ExistingKeys(existing, self.key_names[0], current)
+
+    @property
+    def field_names(self):
+        """Names of the fields read from the file"""
+        field_names = [fd[0] for fd in self.file_class.field_definitions]
+        if self.columns is None:
+            return field_names
+        return [n for n in field_names if n in self.columns]
+
+    def get_columns(self, columns):
+        """`columns`, checked to include those the import can't do without"""
+        columns = set(columns)
+        field_names = [fd[0] for fd in self.file_class.field_definitions]
+        required = set(self.key_names) | set(self.options.required_columns)
+        for name in field_names:
+            column = self.table.c.get(name)
+            if column is not None and not column.nullable:
+                required.add(name)
+        skipped = sorted(required.intersection(field_names) - columns)
+        if skipped:
+            raise ValueError(u'{} requires the columns {}'.format(
+                self, u', '.join(skipped)))
+        return columns
+
+    @property
+    def has_natural_key(self):
+        """Whether the rows in the file contain the primary key"""
+        field_names = set(fd[0] for fd in self.file_class.field_definitions)
+        return set(self.key_names) <= field_names
+
+    def get_computed_values(self, dialect_name):
+        """SQL for the columns the database computes from the rows, by name
+
+        Pass them to the `values` of insert statements.
+        """
+        return dict((name, get_sql(dialect_name))
+                    for name, get_sql in self.options.computed_columns.items())
+
+    @cached_property
+    def content_hash(self):
+        return file_digest(self.filepath)
 
     def __lt__(self, other):
         """For sorting a list of importers in the order they should run"""
@@ -36,41 +151,194 @@ class Importer(object):
     def __gt__(self, other):
         return not self.__lt__(other)
 
+    @property
+    def stats(self):
+        """Row counts, throughput and the batch sizes chosen"""
+        stats = dict(self.batch_sizer.stats)
+        stats['row_count'] = self.row_count
+        return stats
+
     def store_rows(self):
         if not self.stored_rows:
             return
+        last_row = self.stored_rows[-1]
+        num_rows = len(self.stored_rows)
+        num_bytes = 0
+        if self.reader is not None:
+            num_bytes = self.reader.offset - self.batch_offset
+            self.batch_offset = self.reader.offset
+        started = time.time()
         try:
-            self.engine.execute(self.table.insert(), self.stored_rows)
-        except Exception as exc:
-            if settings.DEBUG:
-                print(exc)
-                import ipdb
-                ipdb.set_trace()
-            else:
-                raise
+            for sink in self.sinks:
+                sink.write_rows(self, self.stored_rows)
         finally:
             self.stored_rows = []
+        self.batch_sizer.record(num_rows, num_bytes, time.time() - started)
+        if self.has_natural_key:
+            self.last_key = u','.join(text_type(last_row[n])
+                                      for n in self.key_names)
 
-    def run(self):
-        for i, row in enumerate(self.file_class(self.filepath)):
-            for modifier in self.modifiers:
-                row = modifier(self.session, self.model, row)
-            self.stored_rows.append(row)
-            if i % self.num_simoultaneous_inserts == 0:
-                self.store_rows()
+    def checkpoint(self):
+        """Store pending rows and let the sinks save the progress so far"""
         self.store_rows()
+        for sink in self.sinks:
+            sink.checkpoint(self)
+        self.checkpoint_row_count = self.row_count
+
+    def resume(self, checkpoint):
+        """Continue from a `GeonameImportCheckpoint` on the next `run`"""
+        self.resume_from = (checkpoint.byte_offset, checkpoint.rownum,
+                            checkpoint.row_count)
+
+    def get_reader(self):
+        offset = rownum = 0
+        if self.resume_from is not None:
+            offset, rownum, self.row_count = self.resume_from
+            self.checkpoint_row_count = self.row_count
+        on_error = self.rejects.write_line if self.rejects else None
+        return self.file_class(self.filepath, offset=offset, rownum=rownum,
+                               on_error=on_error, columns=self.columns,
+                               parse_cache=self.parse_cache)
+
+    def run(self):
+        self.reader = self.get_reader()
+        self.batch_offset = self.reader.offset
+        for sink in self.sinks:
+            sink.begin(self)
+        try:
+            for row in self.reader:
+                self.row_count += 1
+                if self.scope:
+                    row.update(self.scope)
+                if (
+                    self.row_hashes is not None and
+                    self.row_hashes.is_unchanged(row)
+                ):
+                    continue
+                for modifier in self.modifiers:
+                    row = modifier(self.session, self.model, row)
+                self.stored_rows.append(row)
+                if self.batch_sizer.is_full(
+                    len(self.stored_rows),
+                    self.reader.offset - self.batch_offset,
+                ):
+                    self.store_rows()
+                    if (
+                        self.checkpoint_interval and
+                        self.row_count - self.checkpoint_row_count >=
+                        self.checkpoint_interval
+                    ):
+                        self.checkpoint()
+            self.store_rows()
+        except Exception:
+            for sink in self.sinks:
+                sink.abort(self)
+            raise
+        else:
+            for sink in self.sinks:
+                sink.finish(self)
+        finally:
+            if self.owns_sinks:
+                for sink in self.sinks:
+                    sink.close()
+            if self.rejects is not None:
+                self.rejects.close()
+
+    def delete_missing(self):
+        """Remove rows that weren't in the file from sinks supporting it
+
+        Also saves the row hashes, if enabled, as the import is complete
+        first after this.
+        """
+        for sink in self.sinks:
+            sink.delete_missing(self)
+        if self.row_hashes is not None:
+            self.row_hashes.save()
+
+
+class RejectFile(object):
+    """Rows that couldn't be imported, written as newline delimited JSON
+
+    Each line holds the error and either the parsed `row` or, for rows that
+    couldn't be parsed, the raw `line` and its `rownum`. The file is
+    appended to, so rejects are kept when an import is resumed.
+    """
+
+    def __init__(self, filepath):
+        self.filepath = filepath
+        self.count = 0
+        self.fh = None
+
+    def write(self, exc, **data):
+        if self.fh is None:
+            self.fh = io.open(self.filepath, 'a', encoding='utf-8')
+        data['error'] = u'{}: {}'.format(exc.__class__.__name__, exc)
+        self.fh.write(text_type(json.dumps(data, default=_json_default,
+                                           ensure_ascii=False)) + u'\n')
+        self.count += 1
+
+    def write_line(self, rownum, line, exc):
+        self.write(exc, rownum=rownum, line=line.rstrip(u'\n'))
+
+    def write_row(self, row, exc):
+        self.write(exc, row=row)
+
+    def close(self):
+        if self.fh is not None:
+            self.fh.close()
+            self.fh = None
+
+
+def set_optional_geopoint_modifier(session, model, row):
+    # WKT points are (x y), i.e. (longitude latitude)
+    if row['latitude'] is None or row['longitude'] is None:
+        row['point'] = None
+    else:
+        row['point'] = u"POINT({0} {1})".format(row['longitude'],
+                                                row['latitude'])
+    return row
+
+
+def point_from_coordinates(dialect_name):
+    """SQL building a point from the rows' `longitude` and `latitude`
+
+    The database makes the point itself from the plain numbers, instead of
+    parsing a WKT string formatted for every row. NULL if either coordinate
+    is. Only for tables without `longitude` and `latitude` columns, whose
+    names are reserved for their values in insert statements.
+    """
+    coordinates = (bindparam('longitude', type_=Float),
+                   bindparam('latitude', type_=Float))
+    if dialect_name == 'sqlite':
+        # Stored as WKT text, see `.sqlite`
+        return text(u"'POINT(' || CAST(:longitude AS TEXT) || ' ' || "
+                    u"CAST(:latitude AS TEXT) || ')'").bindparams(*coordinates)
+    return text(u'ST_SetSRID(ST_MakePoint(:longitude, :latitude), 4326)'
+                ).bindparams(*coordinates)
+
+
+def set_geohash_modifier(session, model, row):
+    if row['latitude'] is None or row['longitude'] is None:
+        row['geohash'] = None
+    else:
+        row['geohash'] = encode_geohash(float(row['latitude']),
+                                        float(row['longitude']))
+    return row
 
 
-def set_geopoint_modifier(session, model, row):
-    row['point'] = u"POINT({0} {1})".format(row['latitude'],
-                                            row['longitude'])
+def set_bbox_modifier(session, model, row):
+    bbox = geojson_bbox(json.loads(row['geojson']))
+    (row['min_latitude'], row['min_longitude'],
+     row['max_latitude'], row['max_longitude']) = bbox
     return row
 
 
 def clear_empty_fks_modifier(session, model, row):
     # Ensure empty foreign key fields is NULL instead of passing in empty
-    # strings etc.
-    for colname in ('feature_code', 'timezone_id', 'country_code'):
+    # strings etc. The same goes for feature_class, which may be used to
+    # partition the table by.
+    for colname in ('feature_class', 'feature_code', 'timezone_id',
+                    'country_code'):
         if not row.get(colname):
             row[colname] = None
     return row
@@ -80,6 +348,17 @@ def _get_import_filename(filepath):
     return filepath.rpartition('/')[2]
 
 
+_feature_codes_filename_re = re.compile(r'^featureCodes_(\w+)\.txt$')
+
+
+def get_language_code(filename):
+    """The language of a featureCodes_XX.txt file, i.e. XX"""
+    match = _feature_codes_filename_re.match(filename)
+    if match is None:
+        raise ValueError(u'{} is not a feature codes file'.format(filename))
+    return match.group(1)
+
+
 @implements_to_string
 class ImportOptions(object):
 
@@ -92,12 +371,27 @@ class ImportOptions(object):
     def file_class(self):
         raise NotImplemented('`file_class` must be specified')
 
+    @classmethod
+    def get_scope(cls, filename):
+        """Values that `filename` implies for all of its rows, by field name
+
+        The rows of the file replace only those with the same values when
+        upserting.
+        """
+        return {}
+
     @property
     def model(self):
         raise NotImplemented('`model` must be specified')
 
     model_dependencies = []
     modifiers = []
+    # Fields the modifiers and computed columns need, which can't be left
+    # out of the import
+    required_columns = ()
+    # Columns that the database computes from the fields, see
+    # `Importer.get_computed_values`
+    computed_columns = {}
 
 
 class GeonameFeatureImportOptions(ImportOptions):
@@ -105,6 +399,15 @@ class GeonameFeatureImportOptions(ImportOptions):
     model = models.GeonameFeature
 
 
+class GeonameFeatureTranslationImportOptions(ImportOptions):
+    file_class = reader.GeonameFeatureReader
+    model = models.GeonameFeatureTranslation
+
+    @classmethod
+    def get_scope(cls, filename):
+        return {'language_code': get_language_code(filename)}
+
+
 class GeonameTimezoneImportOptions(ImportOptions):
     file_class = reader.GeonameTimezoneReader
     model = models.GeonameTimezone
@@ -118,14 +421,41 @@ class GeonameCountryImportOptions(ImportOptions):
 class GeonameImportOptions(ImportOptions):
     file_class = reader.GeonameReader
     model = models.Geoname
-    modifiers = [set_geopoint_modifier, clear_empty_fks_modifier]
+    modifiers = [clear_empty_fks_modifier]
+    required_columns = ('latitude', 'longitude')
+    computed_columns = {'point': point_from_coordinates}
     model_dependencies = [models.GeonameFeature, models.GeonameTimezone,
                           models.GeonameCountry]
 
 
-# class GeonameLanguageImportOptions(ImportOptions):
-#     file_class = reader.GeonameIsoLanguageCodesReader
-#     model = models.GeonameLanguageCode
+class GeonameCountryShapeImportOptions(ImportOptions):
+    file_class = reader.GeonameShapeReader
+    model = models.GeonameCountryShape
+    modifiers = [set_bbox_modifier]
+    required_columns = ('geojson',)
+    computed_columns = {'shape': shape_from_geojson}
+
+
+class GeonameAdmin1CodeImportOptions(ImportOptions):
+    file_class = reader.GeonameAdminCodeReader
+    model = models.GeonameAdmin1Code
+
+
+class GeonameAdmin2CodeImportOptions(ImportOptions):
+    file_class = reader.GeonameAdminCodeReader
+    model = models.GeonameAdmin2Code
+
+
+class GeonamePostalCodeImportOptions(ImportOptions):
+    file_class = reader.GeonamePostalCodeReader
+    model = models.GeonamePostalCode
+    modifiers = [set_optional_geopoint_modifier]
+    required_columns = ('latitude', 'longitude')
+
+
+class GeonameLanguageImportOptions(ImportOptions):
+    file_class = reader.GeonameIsoLanguageCodesReader
+    model = models.GeonameLanguageCode
 
 
 # class GeonameHierarchyImportOptions(ImportOptions):
@@ -133,17 +463,19 @@ class GeonameImportOptions(ImportOptions):
 #     model = models.GeonameReader
 
 
-# class GeonameUserTagImportOptions(ImportOptions):
-#     file_class = reader.GeonameUserTagsReader
-#     model = models.GeonameUserTag
+class GeonameUserTagImportOptions(ImportOptions):
+    file_class = reader.GeonameUserTagsReader
+    model = models.GeonameUserTag
 
 
-# class GeonameAlternateNameImportOptions(ImportOptions):
-#     file_class = reader.GeonameAlternateNamesReader
-#     model = models.GeonameAlternateName
+class GeonameAlternateNameImportOptions(ImportOptions):
+    file_class = reader.GeonameAlternateNamesReader
+    model = models.GeonameAlternateName
 
 
 _import_options_map = {
+    'admin1CodesASCII.txt': GeonameAdmin1CodeImportOptions,
+    'admin2Codes.txt': GeonameAdmin2CodeImportOptions,
     'featureCodes_bg.txt': GeonameFeatureImportOptions,
     'featureCodes_en.txt': GeonameFeatureImportOptions,
     'featureCodes_nb.txt': GeonameFeatureImportOptions,
@@ -157,25 +489,65 @@ _import_options_map = {
     'cities1000.txt': GeonameImportOptions,
     'cities5000.txt': GeonameImportOptions,
     'cities15000.txt': GeonameImportOptions,
-    # 'iso-languagecodes.txt': GeonameLanguageImportOptions,
-    # 'userTags.txt': GeonameUserTagImportOptions,
+    # Geonames outside of any country, e.g. seas. Merged into the table of
+    # the cities files, allCountries.txt includes them already.
+    'no-country.txt': GeonameImportOptions,
+    'postalCodes.txt': GeonamePostalCodeImportOptions,
+    'shapes_simplified_low.json': GeonameCountryShapeImportOptions,
+    'alternateNames.txt': GeonameAlternateNameImportOptions,
+    'iso-languagecodes.txt': GeonameLanguageImportOptions,
+    'userTags.txt': GeonameUserTagImportOptions,
     # 'hierarchy.txt': GeonameHierarchyImportOptions,
-    # 'alternateNames.txt': GeonameAlternateNameImportOptions,
 }
 
 
-def get_importer_instances(db_session, *filepaths):
+def get_importer_instances(db_session, *filepaths, **kwargs):
     """Creates importer instances from `filepaths` and sorts them by their
     dependencies.
+
+    Pass a list of `sinks` (see `sqlalchemy_geonames.sinks`) to write the
+    imported rows somewhere other than, or in addition to, the database.
+    The other keyword arguments, `row_hashes`, `checkpoint_interval`,
+    `rejects` (which writes rejects to `<filepath>.rejects`) and `geohash`
+    (which fills in the geohash of tables having such a column) are passed
+    on to each `Importer`, as is `parse_cache`, which reads the files through
+    `.parsecache`. Fields named in `skip_columns` aren't read from any of
+    the files, see `Importer.columns`.
+
+    The featureCodes_XX.txt files in `translation_filepaths` are imported
+    into `GeonameFeatureTranslation`, all in the same run.
     """
+    sinks = kwargs.pop('sinks', None)
+    row_hashes = kwargs.pop('row_hashes', False)
+    checkpoint_interval = kwargs.pop('checkpoint_interval', None)
+    rejects = kwargs.pop('rejects', False)
+    geohash = kwargs.pop('geohash', False)
+    parse_cache = kwargs.pop('parse_cache', False)
+    skip_columns = set(kwargs.pop('skip_columns', ()))
+    translation_filepaths = kwargs.pop('translation_filepaths', ())
     importer_instances = []
     errmsg = u'No importer defined for filename "{}"'
+    import_options = []
     for filepath in filepaths:
         filename = _get_import_filename(filepath)
         try:
-            importer_options = _import_options_map[filename]
+            import_options.append((_import_options_map[filename], filepath))
         except KeyError:
             raise Exception(errmsg.format(filename))
-        importer_instance = Importer(importer_options, filepath, db_session)
+    for filepath in translation_filepaths:
+        import_options.append((GeonameFeatureTranslationImportOptions,
+                               filepath))
+    for importer_options, filepath in import_options:
+        columns = None
+        field_names = [fd[0]
+                       for fd in importer_options.file_class.field_definitions]
+        if skip_columns.intersection(field_names):
+            columns = [n for n in field_names if n not in skip_columns]
+        importer_instance = Importer(
+            importer_options, filepath, db_session, sinks=sinks,
+            row_hashes=row_hashes, checkpoint_interval=checkpoint_interval,
+            reject_filepath=(filepath + '.rejects') if rejects else None,
+            geohash=geohash, columns=columns, parse_cache=parse_cache,
+        )
         importer_instances.append(importer_instance)
     return sorted(importer_instances)
@@ -1,5 +1,6 @@
-from sqlalchemy import (Column, ForeignKey, Integer, String, Text, BigInteger,
-                        DateTime, Numeric)
+from sqlalchemy import (Boolean, Column, ForeignKey, Integer, String, Text,
+                        BigInteger, DateTime, Float, Index, Numeric, DDL,
+                        UniqueConstraint, event)
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import relationship
 from geoalchemy2 import Geography
@@ -10,9 +11,51 @@ GeonameBase = declarative_base()
 
 
 class GeonameMetadata(GeonameBase):
+    """Keeps track of the files that have been imported, see `.state`"""
     __tablename__ = 'geonamemetadata'
+    __table_args__ = (UniqueConstraint('filename', 'tablename'),)
+    __repr__ = simple_repr('filename', 'last_updated')
+
     id = Column(Integer, primary_key=True)
-    # TODO: Use this to keep track of data to download
+
+    # Name of the imported file, e.g. cities1000.txt
+    filename = Column(String(255), nullable=False)
+
+    # Name of the table that the file was imported into. A file may be
+    # imported into several tables, like featureCodes_en.txt.
+    tablename = Column(String(255), nullable=False)
+
+    # Hex digest of the file's content (sha256)
+    content_hash = Column(String(64), nullable=False)
+
+    row_count = Column(Integer, nullable=False)
+
+    # When the file was last imported
+    last_updated = Column(DateTime(timezone=True), nullable=False)
+
+
+class GeonameImportCheckpoint(GeonameBase):
+    """Progress of an unfinished import, so that it can be resumed"""
+    __tablename__ = 'geonameimportcheckpoint'
+    __repr__ = simple_repr('filename', 'row_count')
+
+    filename = Column(String(255), primary_key=True)
+    tablename = Column(String(255), primary_key=True)
+
+    # Hex digest of the file's content (sha256). A checkpoint is only valid
+    # for the exact same file.
+    content_hash = Column(String(64), nullable=False)
+
+    # Where in the file to continue reading
+    byte_offset = Column(BigInteger, nullable=False)
+    rownum = Column(Integer, nullable=False)
+
+    # Number of rows imported so far
+    row_count = Column(Integer, nullable=False)
+
+    # Primary key of the last imported row
+    last_key = Column(String(255))
+
     last_updated = Column(DateTime(timezone=True), nullable=False)
 
 
@@ -55,6 +98,32 @@ class GeonameTimezone(GeonameBase):
     raw_offset = Column(Numeric(3, 1), nullable=False)
 
 
+class GeonameAdmin1Code(GeonameBase):
+    """Names of first order administrative divisions (admin1CodesASCII.txt)"""
+    __tablename__ = 'geonameadmin1code'
+    __repr__ = simple_repr('name')
+
+    # <country code>.<admin1 code>, e.g. US.CA
+    code = Column(String(30), primary_key=True)
+
+    name = Column(String(200), nullable=False)
+    asciiname = Column(String(200), nullable=False)
+    geonameid = Column(Integer)
+
+
+class GeonameAdmin2Code(GeonameBase):
+    """Names of second order administrative divisions (admin2Codes.txt)"""
+    __tablename__ = 'geonameadmin2code'
+    __repr__ = simple_repr('name')
+
+    # <country code>.<admin1 code>.<admin2 code>, e.g. US.CA.037
+    code = Column(String(110), primary_key=True)
+
+    name = Column(String(200), nullable=False)
+    asciiname = Column(String(200), nullable=False)
+    geonameid = Column(Integer)
+
+
 class GeonameFeature(GeonameBase):
     __tablename__ = 'geonamefeature'
     __repr__ = simple_repr('name')
@@ -69,6 +138,25 @@ class GeonameFeature(GeonameBase):
     description = Column(Text, nullable=False)
 
 
+class GeonameFeatureTranslation(GeonameBase):
+    """A feature's name and description in one language
+
+    Imported from every featureCodes_XX.txt, while `GeonameFeature` holds
+    those of a single language.
+    """
+    __tablename__ = 'geonamefeaturetranslation'
+    __repr__ = simple_repr('name')
+
+    feature_code = Column(String(10), primary_key=True)
+
+    # The XX of featureCodes_XX.txt, e.g. sv
+    language_code = Column(String(7), primary_key=True)
+
+    feature_class = Column(String(1), nullable=False)
+    name = Column(String(200), nullable=False)
+    description = Column(Text, nullable=False)
+
+
 class Geoname(GeonameBase):
     __tablename__ = 'geoname'
     __repr__ = simple_repr('name')
@@ -83,7 +171,7 @@ class Geoname(GeonameBase):
     asciiname = Column(String(200), nullable=False)
 
     # alternatenames, comma separated varchar(5000)
-    alternatenames = Column(Text, nullable=False)
+    alternatenames = Column(Text)
 
     # latitude in decimal degrees (wgs84)
     # latitude = Column(Numeric(10, 7), nullable=False)
@@ -93,7 +181,18 @@ class Geoname(GeonameBase):
 
     # Custom. A point made from `latitude` and `longitude`.
     # SRID #4326 = WGS84
-    point = Column(Geography(geometry_type='POINT', srid=4326), nullable=False)
+    # Stored as WKT text on SQLite, which lacks a geography type. Spatial
+    # lookups go through an R*Tree table there instead, see `.sqlite`.
+    point = Column(Geography(geometry_type='POINT', srid=4326,
+                             spatial_index=False).with_variant(Text, 'sqlite'),
+                   nullable=False)
+
+    # Custom. Geohash of `point`, see `.geohash`. Only set when imported
+    # with `geohash=True`.
+    geohash = Column(String(12))
+
+    # see http://www.geonames.org/export/codes.html, char(1)
+    feature_class = Column(String(1))
 
     feature_code = Column(String(10), ForeignKey(GeonameFeature.feature_code))
     feature = relationship(GeonameFeature)
@@ -129,8 +228,263 @@ class Geoname(GeonameBase):
     # digital elevation model, srtm3 or gtopo30, average elevation
     # of 3''x3'' (ca 90mx90m) or 30''x30'' (ca 900mx900m) area in
     # meters, integer. srtm processed by cgiar/ciat.
-    dem = Column(Integer, nullable=False)
+    dem = Column(Integer)
 
     # (Renamed from timezone)
     timezone_id = Column(String(40), ForeignKey(GeonameTimezone.timezone_id))
-    timezone = relationship(GeonameFeature)
+    timezone = relationship(GeonameTimezone)
+
+
+# Geohash prefix lookups, see the postal code index below
+Index('ix_geoname_geohash', Geoname.geohash,
+      postgresql_ops={'geohash': 'text_pattern_ops'})
+
+
+class GeonamePostalCode(GeonameBase):
+    """A postal code from the postal code dump (export/zip/allCountries.zip)
+
+    The same postal code may occur several times within a country, once for
+    every place it covers, so rows are identified by a surrogate key.
+    """
+    __tablename__ = 'geonamepostalcode'
+    __repr__ = simple_repr('country_code', 'postal_code', 'place_name')
+
+    id = Column(Integer, primary_key=True)
+
+    # ISO-3166 2-letter country code, 2 characters. Not a foreign key as
+    # the dump contains some territories missing from countryInfo.txt.
+    country_code = Column(String(2), nullable=False)
+
+    # varchar(20)
+    postal_code = Column(String(20), nullable=False)
+
+    # varchar(180)
+    place_name = Column(String(180), nullable=False)
+
+    # 1. order subdivision (state) varchar(100)
+    admin1_name = Column(String(100), nullable=False)
+
+    # 1. order subdivision (state) varchar(20)
+    admin1_code = Column(String(20), nullable=False)
+
+    # 2. order subdivision (county/province) varchar(100)
+    admin2_name = Column(String(100), nullable=False)
+
+    # 2. order subdivision (county/province) varchar(20)
+    admin2_code = Column(String(20), nullable=False)
+
+    # 3. order subdivision (community) varchar(100)
+    admin3_name = Column(String(100), nullable=False)
+
+    # 3. order subdivision (community) varchar(20)
+    admin3_code = Column(String(20), nullable=False)
+
+    # Estimated wgs84 latitude and longitude. Kept alongside `point` for
+    # nearest lookups on SQLite, see `.postalcodes`.
+    latitude = Column(Float)
+    longitude = Column(Float)
+
+    # Custom. A point made from `latitude` and `longitude`, NULL when the
+    # position is unknown. Stored as WKT text on SQLite.
+    point = Column(Geography(geometry_type='POINT', srid=4326,
+                             spatial_index=False).with_variant(Text, 'sqlite'))
+
+    # accuracy of lat/lng from 1=estimated, 4=geonameid, 6=centroid of
+    # addresses or shape
+    accuracy = Column(Integer)
+
+
+class GeonameAlternateName(GeonameBase):
+    """A name of a geoname in some language, from alternateNames.txt"""
+    __tablename__ = 'geonamealternatename'
+    __repr__ = simple_repr('geonameid', 'isolanguage', 'alternate_name')
+
+    alternatenameid = Column(Integer, primary_key=True)
+
+    # Not a foreign key, as the daily deltas of the geonames and of their
+    # alternate names are applied separately, see `.daemon`
+    geonameid = Column(Integer, nullable=False, index=True)
+
+    # iso 639 language code 2- or 3-characters, or a pseudo code like
+    # 'post' (postal codes), 'link' (a website) or 'iata', varchar(7)
+    isolanguage = Column(String(7), nullable=False)
+
+    # varchar(400)
+    alternate_name = Column(String(400), nullable=False)
+
+    # The official or preferred name in the language
+    is_preferred_name = Column(Boolean, nullable=False)
+
+    # A short name, like 'California' for 'State of California'
+    is_short_name = Column(Boolean, nullable=False)
+
+    # A colloquial or slang term, like 'Big Apple' for 'New York'
+    is_colloquial = Column(Boolean, nullable=False)
+
+    # A name used in the past, like 'Bombay' for 'Mumbai'
+    is_historic = Column(Boolean, nullable=False)
+
+    # When the name was used, free text. Only in alternateNamesV2.txt and
+    # the daily deltas.
+    period_from = Column(String(20))
+    period_to = Column(String(20))
+
+
+class GeonameLanguageCode(GeonameBase):
+    """A language from iso-languagecodes.txt, e.g. to name the languages of
+    `GeonameAlternateName.isolanguage` and `GeonameCountry.languages`"""
+    __tablename__ = 'geonamelanguagecode'
+    __repr__ = simple_repr('iso_639_3', 'language_name')
+
+    # ISO 639-3 code, 3 characters
+    iso_639_3 = Column(String(3), primary_key=True)
+
+    # ISO 639-2 code(s), e.g. 'fre / fra' where the bibliographic and
+    # terminology codes differ
+    iso_639_2 = Column(String(20), nullable=False)
+
+    # ISO 639-1 code, 2 characters, for the languages that have one
+    iso_639_1 = Column(String(2), nullable=False, index=True)
+
+    language_name = Column(String(200), nullable=False)
+
+
+class GeonameUserTag(GeonameBase):
+    """A tag that a geonames user has given a geoname, from userTags.txt
+
+    Rows are identified by a surrogate key, as nothing keeps a geoname from
+    being given the same tag twice. See `.usertags` for finding the
+    geonames with a tag.
+    """
+    __tablename__ = 'geonameusertag'
+    __repr__ = simple_repr('geonameid', 'tag')
+
+    id = Column(Integer, primary_key=True)
+
+    # Not a foreign key, the tags are of geonames all over the world, and
+    # only some of them are imported with the cities files
+    geonameid = Column(Integer, nullable=False, index=True)
+
+    tag = Column(Text, nullable=False)
+
+
+# Finds the geonames with a tag from the index alone
+Index('ix_geonameusertag_tag_geonameid', GeonameUserTag.tag,
+      GeonameUserTag.geonameid)
+
+
+class GeonameCountryShape(GeonameBase):
+    """The (simplified) borders of a country, see `.shapes`
+
+    From shapes_simplified_low.json, linked to its country through the
+    country's `geonameid`.
+    """
+    __tablename__ = 'geonamecountryshape'
+    __repr__ = simple_repr('geonameid')
+
+    geonameid = Column(Integer, primary_key=True)
+    country = relationship(
+        GeonameCountry, uselist=False, viewonly=True,
+        primaryjoin='GeonameCountryShape.geonameid == '
+                    'foreign(GeonameCountry.geonameid)')
+
+    # A polygon or multipolygon. Stored as GeoJSON text on SQLite.
+    shape = Column(Geography(geometry_type='GEOMETRY', srid=4326,
+                             spatial_index=False).with_variant(Text, 'sqlite'),
+                   nullable=False)
+
+    # Custom. Bounding box of `shape`, to narrow down the shapes to test
+    # where there's no spatial index.
+    min_latitude = Column(Float, nullable=False)
+    min_longitude = Column(Float, nullable=False)
+    max_latitude = Column(Float, nullable=False)
+    max_longitude = Column(Float, nullable=False)
+
+
+class GeonameName(GeonameBase):
+    """A normalized name of a geoname, for fuzzy name search, see `.search`
+
+    One row for each distinct name, ascii name and alternate name of every
+    geoname after normalization (lower case, without accents and
+    punctuation). The columns that searches filter and rank by are copied
+    from the geoname, so that a search only reads this table. Built from
+    the geoname table by `.search.build_name_table`.
+    """
+    __tablename__ = 'geonamename'
+    __table_args__ = (UniqueConstraint('geonameid', 'name'),)
+    __repr__ = simple_repr('geonameid', 'name')
+
+    # A key of its own, as the SQLite trigram index refers to rows by an
+    # integer that mustn't change when the database is vacuumed
+    id = Column(Integer, primary_key=True)
+
+    # Not a foreign key, the table is rebuilt from geoname as a whole
+    geonameid = Column(Integer, nullable=False)
+
+    # Normalized, see `.search.normalize_name`
+    name = Column(String(200), nullable=False)
+
+    # Whether the name only occurs among the alternate names
+    is_alternate = Column(Boolean, nullable=False)
+
+    # Copied from the geoname
+    feature_class = Column(String(1))
+    country_code = Column(String(2))
+    admin1_code = Column(String(20))
+    population = Column(BigInteger, nullable=False)
+
+
+# Exact name lookups
+Index('ix_geonamename_name', GeonameName.name)
+
+
+# Prefix lookups within a country. On PostgreSQL `text_pattern_ops` lets
+# `LIKE 'prefix%'` use the index regardless of the database's collation.
+Index('ix_geonamepostalcode_country_code_postal_code',
+      GeonamePostalCode.country_code,
+      GeonamePostalCode.postal_code,
+      postgresql_ops={'postal_code': 'text_pattern_ops'})
+
+Index('ix_geonamepostalcode_latitude', GeonamePostalCode.latitude)
+
+
+# geoalchemy2 doesn't detect the geography type behind the SQLite variant, so
+# create the spatial indexes ourselves.
+event.listen(
+    Geoname.__table__, 'after_create',
+    DDL('CREATE INDEX idx_geoname_point ON geoname USING GIST (point)')
+    .execute_if(dialect='postgresql'),
+)
+event.listen(
+    GeonamePostalCode.__table__, 'after_create',
+    DDL('CREATE INDEX idx_geonamepostalcode_point ON geonamepostalcode '
+        'USING GIST (point)')
+    .execute_if(dialect='postgresql'),
+)
+event.listen(
+    GeonameCountryShape.__table__, 'after_create',
+    DDL('CREATE INDEX idx_geonamecountryshape_shape ON geonamecountryshape '
+        'USING GIST (shape)')
+    .execute_if(dialect='postgresql'),
+)
+
+# Trigram index for similarity searches (`%`), from the pg_trgm extension
+event.listen(
+    GeonameName.__table__, 'before_create',
+    DDL('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+    .execute_if(dialect='postgresql'),
+)
+event.listen(
+    GeonameName.__table__, 'after_create',
+    DDL('CREATE INDEX idx_geonamename_name_trgm ON geonamename '
+        'USING GIN (name gin_trgm_ops)')
+    .execute_if(dialect='postgresql'),
+)
+
+
+@event.listens_for(GeonameBase.metadata, 'before_drop')
+def _drop_views_before_tables(target, connection, **kw):
+    # The geonamedetail materialized view depends on the tables. Registered
+    # here, as the views module may not have been imported.
+    from .views import drop_views
+    drop_views(connection)
@@ -0,0 +1,185 @@
+"""Pre-parsed copies of the geonames files
+
+Decoding the cells of a file and converting them is most of the CPU time
+of an import. With the parse cache enabled the rows are saved in their
+parsed form next to the file the first time it's read, and later reads of
+the same file load them from there instead::
+
+    reader = GeonameReader(filepath, parse_cache=True)
+
+The cache file, `<filepath>.<key>.parsed`, is a pickle stream of a header
+followed by column chunks: the values of each field of `chunk_size` rows
+as a list, along with the byte offset and row number after each row, so
+that reading can be resumed from the middle as usual. Unpickling a chunk
+makes the values of thousands of rows in one go. It ends with the reader's
+`RowIssues`.
+
+The key is a digest of the file's size and modification time, the reader
+class, its field definitions and the columns read, so a new download or a
+changed reader gets a cache of its own without reading the file. The header
+holds the digest of the file's content, computed when the cache is written,
+so that a file that was only touched, e.g. downloaded again unchanged, keeps
+its cache. Only the latest cache of a file is kept. Readers with an
+`on_error` handler, i.e. imports writing rejects, always read the file
+itself so that its rejects are reported every time.
+"""
+import hashlib
+import os
+import pickle
+import sys
+from itertools import repeat
+
+# Bumped whenever the layout of the cache files changes
+CACHE_FORMAT_VERSION = 2
+
+DEFAULT_CHUNK_SIZE = 10000
+
+suffix = '.parsed'
+
+
+def _type_name(type_def):
+    return '{}.{}'.format(getattr(type_def, '__module__', ''),
+                          getattr(type_def, '__name__', repr(type_def)))
+
+
+def reader_digest(reader):
+    """Digest of how `reader` parses its file"""
+    # Pickles of one major Python version can't always be read by another
+    return hashlib.sha256(repr((
+        CACHE_FORMAT_VERSION, sys.version_info[0],
+        reader.__class__.__module__, reader.__class__.__name__,
+        [(key, _type_name(type_def))
+         for _, key, type_def in reader.selected_fields],
+    )).encode('utf-8')).hexdigest()
+
+
+def content_digest(filepath, chunk_size=1 << 20):
+    digest = hashlib.sha256()
+    with open(filepath, 'rb') as fh:
+        for chunk in iter(lambda: fh.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def cache_key(reader):
+    """Digest of the file's size and modification time and of `reader`"""
+    stat = os.stat(reader.filepath)
+    mtime = getattr(stat, 'st_mtime_ns', stat.st_mtime)
+    return hashlib.sha256(repr((
+        reader_digest(reader), stat.st_size, mtime,
+    )).encode('utf-8')).hexdigest()[:16]
+
+
+def get_cache_path(reader):
+    return '{}.{}{}'.format(reader.filepath, cache_key(reader), suffix)
+
+
+def iter_rows(reader, chunk_size=DEFAULT_CHUNK_SIZE):
+    """The rows of `reader`, from its cache if there is one
+
+    Reading the whole file creates the cache. Called by `reader.__iter__`
+    when its `parse_cache` is enabled.
+    """
+    path = get_cache_path(reader)
+    if os.path.exists(path):
+        return _read_cache(reader, path)
+    if reader.offset != 0:
+        return reader.read_rows()
+    header = (reader_digest(reader), content_digest(reader.filepath))
+    if _reuse_cache(reader.filepath, header, path):
+        return _read_cache(reader, path)
+    return _write_cache(reader, path, header, chunk_size)
+
+
+def _cache_paths(filepath):
+    directory, filename = os.path.split(filepath)
+    for name in os.listdir(directory or '.'):
+        if name.startswith(filename + '.') and name.endswith(suffix):
+            yield os.path.join(directory, name)
+
+
+def _reuse_cache(filepath, header, path):
+    """Rename a cache of the same content and reader to `path`"""
+    for other_path in _cache_paths(filepath):
+        try:
+            with open(other_path, 'rb') as fh:
+                other_header = pickle.load(fh)
+        except Exception:
+            # Of another format version, or damaged
+            continue
+        if other_header == header:
+            os.rename(other_path, path)
+            return True
+    return False
+
+
+def _read_cache(reader, path):
+    start_offset = reader.offset
+    with open(path, 'rb') as fh:
+        pickle.load(fh)
+        field_names = pickle.load(fh)
+        while True:
+            chunk = pickle.load(fh)
+            if chunk is None:
+                break
+            offsets, rownums, columns = chunk
+            if offsets[-1] <= start_offset:
+                continue
+            rows = map(dict, map(zip, repeat(field_names), zip(*columns)))
+            for offset, rownum, row in zip(offsets, rownums, rows):
+                if offset <= start_offset:
+                    continue
+                reader.offset = offset
+                reader.rownum = rownum
+                yield row
+        # Past the comments and skipped rows at the end, if any
+        reader.offset, reader.rownum, counts, samples = pickle.load(fh)
+    reader.issues.counts.update(counts)
+    reader.issues.samples.update(samples)
+
+
+def _write_chunk(fh, offsets, rownums, columns):
+    if offsets:
+        pickle.dump((offsets, rownums, columns), fh,
+                    pickle.HIGHEST_PROTOCOL)
+
+
+def _write_cache(reader, path, header, chunk_size):
+    field_names = reader.selected_field_names
+    tmp_path = path + '.tmp'
+    fh = open(tmp_path, 'wb')
+    try:
+        # (reader digest, content digest), see `_reuse_cache`
+        pickle.dump(header, fh, pickle.HIGHEST_PROTOCOL)
+        pickle.dump(field_names, fh, pickle.HIGHEST_PROTOCOL)
+        offsets, rownums = [], []
+        columns = tuple([] for _ in field_names)
+        for row in reader.read_rows():
+            # Before yielding, as the importer modifies the rows
+            for column, name in zip(columns, field_names):
+                column.append(row[name])
+            offsets.append(reader.offset)
+            rownums.append(reader.rownum)
+            yield row
+            if len(offsets) >= chunk_size:
+                _write_chunk(fh, offsets, rownums, columns)
+                offsets, rownums = [], []
+                columns = tuple([] for _ in field_names)
+        _write_chunk(fh, offsets, rownums, columns)
+        pickle.dump(None, fh, pickle.HIGHEST_PROTOCOL)
+        pickle.dump((reader.offset, reader.rownum, reader.issues.counts,
+                     reader.issues.samples), fh, pickle.HIGHEST_PROTOCOL)
+    except BaseException:
+        # Including GeneratorExit, when the rows weren't all read
+        fh.close()
+        os.remove(tmp_path)
+        raise
+    fh.close()
+    remove_caches(reader.filepath)
+    os.rename(tmp_path, path)
+
+
+def remove_caches(filepath):
+    """Remove the parse caches of `filepath`"""
+    for path in list(_cache_paths(filepath)):
+        os.remove(path)
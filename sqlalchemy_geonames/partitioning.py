@@ -0,0 +1,244 @@
+"""List partitioning of the geoname table on PostgreSQL
+
+With the geoname table partitioned by `country_code` or `feature_class`,
+queries filtering on that column only have to look at the matching
+partitions. The partitioned table replaces the regular one when creating
+the tables::
+
+    create_tables(engine, partition_by='country_code')
+    sink = PartitionRoutingSink(engine, partition_by='country_code')
+    for importer in get_importer_instances(session, *filepaths,
+                                           sinks=[sink]):
+        importer.run()
+
+Partitions are created as rows for them show up. Rows without a value go
+to a default partition.
+
+Every partition has its own primary key on `geonameid`. PostgreSQL requires
+unique constraints on a partitioned table to include the partition column,
+which may be NULL here, so uniqueness across partitions relies on the data
+dumps. For the same reason upserts aren't supported, refresh single
+partitions with `PartitionSwapSink` instead.
+
+Requires PostgreSQL 11 or later.
+"""
+import re
+from sqlalchemy import Column, MetaData, Table, text
+from sqlalchemy.schema import CreateTable
+from .models import GeonameBase, Geoname
+from .sinks import DatabaseSink, get_insert_statement
+
+PARTITION_COLUMNS = ('country_code', 'feature_class')
+
+DEFAULT_PARTITION = 'default'
+
+geoname_table = Geoname.__table__
+
+_partition_value_re = re.compile(r'^[A-Za-z0-9]+$')
+
+
+def _check_partition_column(partition_by):
+    if partition_by not in PARTITION_COLUMNS:
+        raise ValueError('Can only partition by one of {}, not {}'.format(
+            ', '.join(PARTITION_COLUMNS), partition_by))
+
+
+def get_partition_name(value):
+    """Name of the partition holding rows whose partition column is `value`
+
+    `None` (and the empty string) map to the default partition.
+    """
+    if not value:
+        return '{}_{}'.format(geoname_table.name, DEFAULT_PARTITION)
+    # Values end up in DDL, where they can't be passed as parameters
+    if not _partition_value_re.match(value):
+        raise ValueError('Invalid partition value {!r}'.format(value))
+    return '{}_{}'.format(geoname_table.name, value.lower())
+
+
+def _partition_bound(value):
+    if not value:
+        return 'DEFAULT'
+    return "FOR VALUES IN ('{}')".format(value)
+
+
+def _copy_columns(table):
+    # Plain copies, without primary key and foreign key constraints
+    return [Column(c.name, c.type, nullable=c.nullable)
+            for c in table.columns]
+
+
+def _index_ddl(tablename, named=True):
+    """CREATE INDEX statements matching the geoname table's indexes
+
+    Partitions get unnamed indexes, PostgreSQL then picks names that don't
+    clash with those of the partition they'll replace.
+    """
+    statements = []
+    indexes = []
+    for index in geoname_table.indexes:
+        ops = index.dialect_options['postgresql']['ops'] or {}
+        columns = ', '.join(' '.join(filter(None, (c.name, ops.get(c.name))))
+                            for c in index.columns)
+        indexes.append((index.name, columns, ''))
+    indexes.append(('idx_geoname_point', 'point', 'USING GIST '))
+    for name, columns, using in indexes:
+        statements.append('CREATE INDEX {}ON {} {}({})'.format(
+            name + ' ' if named else '', tablename, using, columns))
+    return statements
+
+
+def get_partitioned_table(partition_by):
+    """A copy of the geoname table, partitioned by `partition_by`"""
+    _check_partition_column(partition_by)
+    return Table(geoname_table.name, MetaData(),
+                 *_copy_columns(geoname_table),
+                 postgresql_partition_by='LIST ({})'.format(partition_by))
+
+
+def create_partitioned_table(bind, partition_by):
+    """Create the geoname table partitioned by `partition_by`"""
+    bind.execute(CreateTable(get_partitioned_table(partition_by)))
+    for fk in geoname_table.foreign_keys:
+        bind.execute(
+            'ALTER TABLE {} ADD FOREIGN KEY ({}) REFERENCES {} ({})'.format(
+                geoname_table.name, fk.parent.name, fk.column.table.name,
+                fk.column.name))
+    # Indexes on a partitioned table are created on every partition
+    for statement in _index_ddl(geoname_table.name):
+        bind.execute(statement)
+
+
+def create_tables(bind, partition_by):
+    """Like `GeonameBase.metadata.create_all`, with geoname partitioned
+
+    Existing tables are left alone.
+    """
+    tables = GeonameBase.metadata.sorted_tables
+    position = tables.index(geoname_table)
+    GeonameBase.metadata.create_all(bind=bind, tables=tables[:position])
+    if not bind.dialect.has_table(bind, geoname_table.name):
+        create_partitioned_table(bind, partition_by)
+    GeonameBase.metadata.create_all(bind=bind, tables=tables[position + 1:])
+
+
+def partition_exists(bind, name):
+    return bind.execute(text('SELECT to_regclass(:name)'),
+                        name=name).scalar() is not None
+
+
+class PartitionRoutingSink(DatabaseSink):
+    """Inserts geoname rows directly into their partitions
+
+    Skips PostgreSQL's per-row routing through the parent table, and creates
+    missing partitions along the way. Other tables are written to as usual.
+    """
+
+    def __init__(self, engine, partition_by):
+        _check_partition_column(partition_by)
+        super(PartitionRoutingSink, self).__init__(engine)
+        self.partition_by = partition_by
+        self.partitions = {}
+
+    def get_partition(self, value):
+        """The partition for `value`, created unless it exists"""
+        value = value or None
+        partition = self.partitions.get(value)
+        if partition is None:
+            name = get_partition_name(value)
+            self.connection.execute(
+                'CREATE TABLE IF NOT EXISTS {} PARTITION OF {} '
+                '(PRIMARY KEY (geonameid)) {}'.format(
+                    name, geoname_table.name, _partition_bound(value)))
+            partition = Table(name, MetaData(), *_copy_columns(geoname_table))
+            self.partitions[value] = partition
+        return partition
+
+    def abort(self, importer):
+        # Partitions created in the rolled back transaction are gone
+        self.partitions.clear()
+        super(PartitionRoutingSink, self).abort(importer)
+
+    def _write_rows(self, importer, rows):
+        if importer.table is not geoname_table:
+            return super(PartitionRoutingSink, self)._write_rows(importer,
+                                                                 rows)
+        rows_by_value = {}
+        for row in rows:
+            rows_by_value.setdefault(row[self.partition_by], []).append(row)
+        for value, partition_rows in rows_by_value.items():
+            self.connection.execute(
+                get_insert_statement(importer, self.get_partition(value)),
+                partition_rows)
+
+
+class PartitionSwapSink(DatabaseSink):
+    """Replaces a single partition with freshly imported rows
+
+    Rows are loaded into a new table, indexed and then swapped in for the
+    existing partition in the import's final transaction, so readers see
+    either the old or the new partition. Rows belonging to other partitions
+    are ignored, which makes it possible to refresh a country from either
+    its own dump (e.g. SE.txt) or allCountries.txt::
+
+        sink = PartitionSwapSink(engine, 'country_code', 'SE')
+        Importer(GeonameImportOptions, 'SE.txt', session, sinks=[sink]).run()
+
+    """
+
+    def __init__(self, engine, partition_by, value):
+        _check_partition_column(partition_by)
+        super(PartitionSwapSink, self).__init__(engine)
+        self.partition_by = partition_by
+        self.value = value or None
+        self.partition_name = get_partition_name(self.value)
+        self.staging_table = Table(self.partition_name + '_new', MetaData(),
+                                   *_copy_columns(geoname_table))
+        self.skipped_count = 0
+
+    def begin(self, importer):
+        if importer.table is not geoname_table:
+            raise ValueError('{} can only import into {}'.format(
+                self.__class__.__name__, geoname_table.name))
+        connection = self.connect()
+        self.transaction = connection.begin()
+        connection.execute('DROP TABLE IF EXISTS {}'.format(
+            self.staging_table.name))
+        connection.execute(CreateTable(self.staging_table))
+        self.statement = get_insert_statement(importer, self.staging_table)
+
+    def _write_rows(self, importer, rows):
+        key = self.partition_by
+        partition_rows = [r for r in rows if (r[key] or None) == self.value]
+        self.skipped_count += len(rows) - len(partition_rows)
+        if partition_rows:
+            self.connection.execute(self.statement, partition_rows)
+
+    def finish(self, importer):
+        execute = self.connection.execute
+        staging_name = self.staging_table.name
+        # Indexes are built once all rows are in, and match the ones on the
+        # partitioned table so that attaching doesn't create new ones.
+        execute('ALTER TABLE {} ADD PRIMARY KEY (geonameid)'
+                .format(staging_name))
+        for statement in _index_ddl(staging_name, named=False):
+            execute(statement)
+        if self.value is not None:
+            # Lets PostgreSQL skip scanning the table when attaching it
+            execute("ALTER TABLE {0} ADD CONSTRAINT {0}_bound CHECK "
+                    "({1} IS NOT NULL AND {1} = '{2}')".format(
+                        staging_name, self.partition_by, self.value))
+        if partition_exists(self.connection, self.partition_name):
+            execute('ALTER TABLE {} DETACH PARTITION {}'.format(
+                geoname_table.name, self.partition_name))
+            execute('DROP TABLE {}'.format(self.partition_name))
+        execute('ALTER TABLE {} ATTACH PARTITION {} {}'.format(
+            geoname_table.name, staging_name, _partition_bound(self.value)))
+        if self.value is not None:
+            execute('ALTER TABLE {0} DROP CONSTRAINT {0}_bound'
+                    .format(staging_name))
+        execute('ALTER TABLE {} RENAME TO {}'.format(staging_name,
+                                                     self.partition_name))
+        execute('ALTER INDEX {}_pkey RENAME TO {}_pkey'.format(
+            staging_name, self.partition_name))
+        super(PartitionSwapSink, self).finish(importer)
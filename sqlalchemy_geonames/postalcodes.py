@@ -0,0 +1,96 @@
+"""Postal code lookups"""
+import math
+from sqlalchemy import and_, func, or_
+from .models import GeonamePostalCode
+from .reverse import _unit_vector
+from .sqlite import is_sqlite
+
+# Radii (in degrees of arc) of the windows searched by
+# `nearest_postal_codes` on SQLite, which has no spatial index for postal
+# codes.
+_SQLITE_SEARCH_WINDOWS = (0.1, 0.5, 2, 10, 45, 180)
+
+
+def _chord(vector, other):
+    return math.sqrt(sum((a - b) ** 2 for a, b in zip(vector, other)))
+
+
+def _window_filter(model, latitude, longitude, window):
+    """Bounding box of the positions within `window` degrees of arc
+
+    Wider in longitude towards the poles, covering every longitude when the
+    window reaches a pole, and split in two at the antimeridian.
+    """
+    conditions = [model.latitude.between(latitude - window,
+                                         latitude + window)]
+    sin_window = math.sin(math.radians(min(window, 90)))
+    cos_lat = math.cos(math.radians(latitude))
+    if window >= 90 or sin_window >= cos_lat:
+        return and_(*conditions)
+    half_width = math.degrees(math.asin(sin_window / cos_lat))
+    west, east = longitude - half_width, longitude + half_width
+    if west < -180:
+        conditions.append(or_(model.longitude >= west + 360,
+                              model.longitude <= east))
+    elif east > 180:
+        conditions.append(or_(model.longitude >= west,
+                              model.longitude <= east - 360))
+    else:
+        conditions.append(model.longitude.between(west, east))
+    return and_(*conditions)
+
+
+def postal_codes_with_prefix(session, country_code, prefix):
+    """Query for the postal codes in a country starting with `prefix`"""
+    query = session.query(GeonamePostalCode).filter(
+        GeonamePostalCode.country_code == country_code)
+    column = GeonamePostalCode.postal_code
+    if is_sqlite(session.bind):
+        # SQLite's LIKE is case insensitive and can't use the index, a
+        # range can. Postal codes never contain U+FFFF.
+        query = query.filter(column >= prefix,
+                             column < prefix + u'\uffff')
+    else:
+        query = query.filter(column.startswith(prefix, autoescape=True))
+    return query.order_by(column)
+
+
+def nearest_postal_codes(session, latitude, longitude, country_code=None,
+                         limit=1):
+    """The `limit` postal codes closest to a position, closest first
+
+    Uses a KNN search on the GiST index on PostgreSQL. On SQLite an
+    increasingly wide window around the position is searched through the
+    latitude index until enough postal codes are found, and the candidates
+    are ordered by their great circle distance.
+    """
+    model = GeonamePostalCode
+    query = session.query(model)
+    if country_code is not None:
+        query = query.filter(model.country_code == country_code)
+    if not is_sqlite(session.bind):
+        origin = func.ST_GeogFromText(
+            u'SRID=4326;POINT({} {})'.format(longitude, latitude))
+        query = query.filter(model.point.isnot(None))
+        return query.order_by(model.point.distance_centroid(origin)).limit(
+            limit).all()
+    origin = _unit_vector(latitude, longitude)
+    candidates = query.with_entities(model.id, model.latitude,
+                                     model.longitude)
+    for window in _SQLITE_SEARCH_WINDOWS:
+        # Straight line distances through the sphere order like great
+        # circle distances
+        nearest = sorted(
+            (_chord(origin, _unit_vector(lat, lon)), id_)
+            for id_, lat, lon in candidates.filter(
+                _window_filter(model, latitude, longitude, window)))
+        # Postal codes outside the window may still be closer than the
+        # ones found in the corners of its bounding box, unless they're all
+        # within `window`.
+        max_chord = 2 * math.sin(math.radians(min(window, 180)) / 2)
+        nearest = nearest[:limit]
+        if len(nearest) == limit and nearest[-1][0] <= max_chord:
+            break
+    by_id = dict((r.id, r) for r in query.filter(
+        model.id.in_([id_ for _, id_ in nearest])))
+    return [by_id[id_] for _, id_ in nearest]
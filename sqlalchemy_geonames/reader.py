@@ -1,13 +1,17 @@
 """Classes for reading geonames text data dumps"""
-import codecs
 from datetime import date
-from . import log
+from . import log, parsecache
 from ._compat import text_type, Decimal
-from .utils import cached_property, try_int
+from .utils import cached_property, try_float, try_int
 
 logger = log.get_logger()
 
 
+def flag(val):
+    """Boolean of the 1 or empty columns, like isPreferredName"""
+    return val == u'1'
+
+
 def fastdate(val):
     """Fast parsing of date object from string values
     Requires format YYYY-MM-DD.
@@ -28,9 +32,10 @@ class GeonameReader(object):
     # Character(s) to split each row at
     delimiter = '\t'
 
-    # Hook to pre-process a row before it's split by `delimiter`
-    def row_preprocess(self, row_str):
-        return row_str
+    # Hook to pre-process a row before it's split by `delimiter`. Rows are
+    # passed undecoded, as bytes.
+    def row_preprocess(self, row_bytes):
+        return row_bytes
 
     # Some of Geonames' files don't have equal amounts of
     # delimiters. (Noticed this for featureCodes_en.txt). Pad
@@ -68,51 +73,179 @@ class GeonameReader(object):
     def type_definitions(self):
         return tuple(fd[1] for fd in self.field_definitions)
 
-    def __init__(self, filepath):
+    # Size of the reads from the file. Rows are only split into lines and
+    # cells as bytes, so large reads keep the per-row overhead down.
+    buffer_size = 1024 * 1024
+
+    def __init__(self, filepath, offset=0, rownum=0, on_error=None,
+                 columns=None, parse_cache=False):
         self.filepath = filepath
+        # Names of the fields to read, all if None. The cells of other
+        # fields are never decoded nor converted, which saves both time and
+        # memory for large and unused ones like `alternatenames`.
+        if columns is not None:
+            unknown = set(columns) - set(self.field_names)
+            if unknown:
+                raise ValueError(u'Unknown columns for {}: {}'.format(
+                    self.__class__.__name__, u', '.join(sorted(unknown))))
+        self.columns = columns
+        # Byte offset of the next row to read. Updated while iterating, so
+        # that reading can be resumed from the last yielded row.
+        self.offset = offset
+        # Row number of the row at `offset`
+        self.rownum = rownum
+        # Called as `on_error(rownum, line, exc)` for rows whose values
+        # can't be converted. The row is skipped if set, else the
+        # exception is raised.
+        self.on_error = on_error
+        # Rows that didn't have the expected cells, see `RowIssues`
+        self.issues = RowIssues(filepath)
+        # Read the rows from a pre-parsed copy of the file, made on the
+        # first read, see `.parsecache`
+        self.parse_cache = parse_cache
+
+    @cached_property
+    def selected_fields(self):
+        """(cell index, name, type definition) of the fields to read"""
+        return tuple(
+            (i, key, type_def)
+            for i, (key, type_def) in enumerate(self.field_definitions)
+            if self.columns is None or key in self.columns
+        )
+
+    @cached_property
+    def selected_field_names(self):
+        return tuple(key for _, key, _ in self.selected_fields)
 
     def __iter__(self):
+        if self.parse_cache and self.on_error is None:
+            return parsecache.iter_rows(self)
+        return self.read_rows()
+
+    def read_rows(self):
+        """The rows of the file itself, parsed"""
         diffmsg = (u"Row #{0} in {1} contained {2} cell values instead"
                    u" of the expected {3}.")
-        skipmsg = u"Row #{0} in {1} skipped as some values were missing"
+        skipmsg = u" The row was skipped as some values were missing."
+        padmsg = u" The missing values were left empty."
         len_type_definitions = len(self.type_definitions)
-
-        with codecs.open(self.filepath, encoding='utf-8') as fh:
-            for rownum, row in enumerate(fh):
+        selected_fields = self.selected_fields
+        delimiter = self.delimiter.encode('utf-8')
+        comment_character = self.comment_character.encode('utf-8')
+        issues = self.issues
+
+        with open(self.filepath, 'rb', self.buffer_size) as fh:
+            fh.seek(self.offset)
+            for line in fh:
+                rownum = self.rownum
+                self.rownum += 1
+                self.offset += len(line)
                 if rownum < self.start_row:
                     continue
-                if row.startswith(self.comment_character):
+                if line.startswith(comment_character):
                     continue
-                row = self.row_preprocess(row)
-                cell_values = row.rstrip('\n').split(self.delimiter)
+                row = self.row_preprocess(line)
+                cell_values = row.rstrip(b'\n').split(delimiter)
 
                 # Warn on missing values. An index error will be raised later
                 # on too many cell values. The same goes for too few cell
                 # values, unless `append_on_missing` is enabled.
                 cell_count_diff = len_type_definitions - len(cell_values)
                 if cell_count_diff != 0:
-                    logger.warning(diffmsg.format(rownum, self.filepath,
-                                   len(cell_values),
-                                   len_type_definitions))
+                    message = diffmsg.format(rownum, self.filepath,
+                                             len(cell_values),
+                                             len_type_definitions)
                     if self.skip_on_missing and cell_count_diff > 0:
-                        logger.warning(skipmsg.format(rownum, self.filepath))
+                        issues.record('skipped', rownum, line,
+                                      message + skipmsg)
                         continue
                     if self.append_on_missing and cell_count_diff > 0:
-                        cell_values += [''] * cell_count_diff
+                        issues.record('padded', rownum, line,
+                                      message + padmsg)
+                        cell_values += [b''] * cell_count_diff
+                    else:
+                        issues.record('malformed', rownum, line, message)
 
                 # NOTE 2: Using OrderedDict is about 280% slower so avoid at
                 #         all costs. 280% is a lot when working with ~8.5M
                 #         rows!
                 dct = dict()
-                for i, (key, type_def) in enumerate(self.field_definitions):
+                for i, key, type_def in selected_fields:
                     try:
-                        dct[key] = type_def(cell_values[i])
+                        dct[key] = type_def(cell_values[i].decode('utf-8'))
                     except Exception as exc:
-                        logger.error(u'Got {0} for key "{1}" with value '
-                                     u'"{2}".'.format(exc.__class__.__name__,
-                                                      key, cell_values[i]))
-                        raise
-                yield dct
+                        if self.on_error is None:
+                            logger.error(u'Got {0} for key "{1}" with value '
+                                         u'"{2}".'.format(
+                                             exc.__class__.__name__, key,
+                                             cell_values[i].decode(
+                                                 'utf-8', 'replace')))
+                            raise
+                        issues.record('invalid', rownum, line, None)
+                        self.on_error(rownum, line.decode('utf-8', 'replace'),
+                                      exc)
+                        dct = None
+                        break
+                if dct is not None:
+                    yield dct
+        issues.log_summary()
+
+
+class RowIssues(object):
+    """Rows of a file that didn't have the expected cells, by kind
+
+    * malformed: too many cells, or too few to be padded or skipped
+    * padded: too few cells, padded with empty values
+      (`append_on_missing`)
+    * skipped: too few cells, left out (`skip_on_missing`)
+    * invalid: values that couldn't be converted, passed to `on_error`
+
+    Only the first `max_warnings` rows are logged, the others are counted,
+    and a summary is logged once the whole file has been read. Logging a
+    warning for every row of a dirty file would slow the import down
+    considerably. The first `max_samples` (row number, line) of each kind
+    are kept in `samples`.
+    """
+    kinds = ('malformed', 'padded', 'skipped', 'invalid')
+    max_warnings = 10
+    max_samples = 3
+    # Sampled lines are cut at this many characters
+    max_sample_length = 200
+
+    def __init__(self, filepath):
+        self.filepath = filepath
+        self.counts = dict((kind, 0) for kind in self.kinds)
+        self.samples = dict((kind, []) for kind in self.kinds)
+        self.logged = 0
+
+    def __len__(self):
+        return sum(self.counts.values())
+
+    def record(self, kind, rownum, line, message):
+        """Count a row of `kind`, logging `message` unless too many were"""
+        self.counts[kind] += 1
+        samples = self.samples[kind]
+        if len(samples) < self.max_samples:
+            line = line.decode('utf-8', 'replace').rstrip(u'\n')
+            samples.append((rownum, line[:self.max_sample_length]))
+        if message is None:
+            return
+        if self.logged < self.max_warnings:
+            logger.warning(message)
+        elif self.logged == self.max_warnings:
+            logger.warning(u'Further rows in {} with missing or extra values'
+                           u' are only counted.'.format(self.filepath))
+        self.logged += 1
+
+    def summary(self):
+        """The counts, e.g. "3 malformed, 120 padded rows" """
+        counts = [u'{} {}'.format(self.counts[kind], kind)
+                  for kind in self.kinds if self.counts[kind]]
+        return u'{} rows'.format(u', '.join(counts)) if counts else u''
+
+    def log_summary(self):
+        if self.logged > self.max_warnings:
+            logger.warning(u'{}: {}'.format(self.filepath, self.summary()))
 
 
 class GeonameReader(GeonameReader):
@@ -121,8 +254,8 @@ class GeonameReader(GeonameReader):
         ('name', text_type),
         ('asciiname', text_type),
         ('alternatenames', text_type),
-        ('latitude', Decimal),
-        ('longitude', Decimal),
+        ('latitude', float),
+        ('longitude', float),
         ('feature_class', text_type),
         ('feature_code', text_type),
         ('country_code', text_type),
@@ -142,11 +275,11 @@ class GeonameReader(GeonameReader):
 class GeonameFeatureReader(GeonameReader):
     skip_on_missing = True
 
-    def row_preprocess(self, row_str):
+    def row_preprocess(self, row_bytes):
         # feature_class and feature_code is joined with a dot in
         # these files. Replace the dot with a tab so they can be seen
         # as two different fields.
-        return row_str.replace('.', '\t', 1)
+        return row_bytes.replace(b'.', b'\t', 1)
 
     field_definitions = (
         ('feature_class', text_type),
@@ -193,9 +326,107 @@ class GeonameCountryInfoReader(GeonameReader):
     )
 
 
+class GeonameAdminCodeReader(GeonameReader):
+    """Reads admin1CodesASCII.txt and admin2Codes.txt"""
+    field_definitions = (
+        ('code', text_type),
+        ('name', text_type),
+        ('asciiname', text_type),
+        ('geonameid', try_int),
+    )
+
+
+class GeonamePostalCodeReader(GeonameReader):
+    field_definitions = (
+        ('country_code', text_type),
+        ('postal_code', text_type),
+        ('place_name', text_type),
+        ('admin1_name', text_type),
+        ('admin1_code', text_type),
+        ('admin2_name', text_type),
+        ('admin2_code', text_type),
+        ('admin3_name', text_type),
+        ('admin3_code', text_type),
+        ('latitude', try_float),
+        ('longitude', try_float),
+        ('accuracy', try_int),
+    )
+
+
+class GeonameShapeReader(GeonameReader):
+    """Reads shapes_simplified_low.json, which despite its name is tab
+    separated with a GeoJSON geometry per row"""
+    # First row contains headers
+    start_row = 1
+
+    field_definitions = (
+        ('geonameid', int),
+        ('geojson', text_type),
+    )
+
+
+class GeonameIsoLanguageCodesReader(GeonameReader):
+    """Reads iso-languagecodes.txt"""
+    # First row contains headers
+    start_row = 1
+
+    field_definitions = (
+        ('iso_639_3', text_type),
+        ('iso_639_2', text_type),
+        ('iso_639_1', text_type),
+        ('language_name', text_type),
+    )
+
+
+class GeonameUserTagsReader(GeonameReader):
+    """Reads userTags.txt"""
+    field_definitions = (
+        ('geonameid', int),
+        ('tag', text_type),
+    )
+
+
 class GeonameHierarchyReader(GeonameReader):
     pass  # TODO: Write
 
 
 class GeonameAlternateNamesReader(GeonameReader):
-    pass  # TODO: Write
+    """Reads alternateNames.txt, alternateNamesV2.txt and the daily
+    alternateNamesModifications-YYYY-MM-DD.txt"""
+    # Only the V2 format has the period columns
+    append_on_missing = True
+
+    field_definitions = (
+        ('alternatenameid', int),
+        ('geonameid', int),
+        ('isolanguage', text_type),
+        ('alternate_name', text_type),
+        ('is_preferred_name', flag),
+        ('is_short_name', flag),
+        ('is_colloquial', flag),
+        ('is_historic', flag),
+        ('period_from', text_type),
+        ('period_to', text_type),
+    )
+
+
+class GeonameDeletesReader(GeonameReader):
+    """Reads the daily deletes-YYYY-MM-DD.txt"""
+    append_on_missing = True
+
+    field_definitions = (
+        ('geonameid', int),
+        ('name', text_type),
+        ('comment', text_type),
+    )
+
+
+class GeonameAlternateNameDeletesReader(GeonameReader):
+    """Reads the daily alternateNamesDeletes-YYYY-MM-DD.txt"""
+    append_on_missing = True
+
+    field_definitions = (
+        ('alternatenameid', int),
+        ('geonameid', int),
+        ('comment', text_type),
+    )
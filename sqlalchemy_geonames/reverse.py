@@ -0,0 +1,282 @@
+"""Reverse geocoding of many positions at once
+
+`reverse_geocode` finds the nearest populated place of every position in a
+pair of latitude and longitude sequences::
+
+    result = reverse_geocode(engine, latitudes, longitudes)
+    for geonameid, distance in zip(result['geonameid'], result['distance']):
+        ...
+
+Results are columnar: a dict of lists, each with one value per position in
+the same order. Positions without a place (within `max_distance`) get None
+in every column.
+
+On PostgreSQL every chunk of positions is resolved by a single query, which
+joins the positions (passed as arrays) laterally with a KNN search on the
+point index. Chunks are queried concurrently. Elsewhere, and whenever the
+same places are queried over and over, load them into a `PlaceIndex` once
+and query that instead.
+"""
+import math
+from multiprocessing.pool import ThreadPool
+from sqlalchemy import Float, cast, func, literal_column, select, text
+from sqlalchemy.engine import Engine
+from geoalchemy2 import Geometry
+from .models import Geoname
+from .sqlite import _point_x_sql, _point_y_sql, is_sqlite
+
+# Mean earth radius in meters
+EARTH_RADIUS = 6371008.8
+
+RESULT_COLUMNS = ('geonameid', 'name', 'country_code', 'distance')
+
+_NEAREST_SQL = u"""
+SELECT g.geonameid, g.name, g.country_code, g.distance
+FROM (
+    SELECT i, CAST(ST_SetSRID(ST_MakePoint(longitude, latitude), 4326)
+                   AS geography) AS origin
+    FROM unnest(CAST(:latitudes AS float8[]), CAST(:longitudes AS float8[]))
+         WITH ORDINALITY AS u(latitude, longitude, i)
+) AS p
+LEFT JOIN LATERAL (
+    SELECT geonameid, name, country_code,
+           ST_Distance(point, p.origin) AS distance
+    FROM geoname
+    WHERE {conditions}
+    ORDER BY point <-> p.origin
+    LIMIT 1
+) AS g ON true
+ORDER BY p.i
+"""
+
+
+def _empty_result():
+    return dict((name, []) for name in RESULT_COLUMNS)
+
+
+def _chunks(latitudes, longitudes, chunk_size):
+    for i in range(0, len(latitudes), chunk_size):
+        yield (list(latitudes[i:i + chunk_size]),
+               list(longitudes[i:i + chunk_size]))
+
+
+def _nearest_statement(feature_class, min_population, max_distance):
+    conditions = [u'true']
+    params = {}
+    if feature_class is not None:
+        conditions.append(u'feature_class = :feature_class')
+        params['feature_class'] = feature_class
+    if min_population:
+        conditions.append(u'population >= :min_population')
+        params['min_population'] = min_population
+    if max_distance is not None:
+        conditions.append(u'ST_DWithin(point, p.origin, :max_distance)')
+        params['max_distance'] = max_distance
+    sql = _NEAREST_SQL.format(conditions=u' AND '.join(conditions))
+    return text(sql), params
+
+
+def reverse_geocode(bind, latitudes, longitudes, feature_class='P',
+                    min_population=0, max_distance=None, chunk_size=5000,
+                    num_threads=4):
+    """The nearest place of each position, see module docstring
+
+    Places are geonames of `feature_class` (populated places by default,
+    None for any) with at least `min_population` inhabitants, and no more
+    than `max_distance` meters away if given. Distances are in meters.
+
+    With an engine as `bind`, up to `num_threads` chunks of `chunk_size`
+    positions are queried at the same time, each through its own
+    connection. On databases other than PostgreSQL the places are loaded
+    into a `PlaceIndex` first.
+    """
+    if len(latitudes) != len(longitudes):
+        raise ValueError('Got {} latitudes but {} longitudes'.format(
+            len(latitudes), len(longitudes)))
+    if bind.dialect.name != 'postgresql':
+        index = PlaceIndex.from_database(bind, feature_class, min_population)
+        return index.nearest(latitudes, longitudes, max_distance)
+    statement, params = _nearest_statement(feature_class, min_population,
+                                           max_distance)
+
+    def query(chunk):
+        chunk_params = dict(params, latitudes=chunk[0], longitudes=chunk[1])
+        return bind.execute(statement, chunk_params).fetchall()
+
+    chunks = _chunks(latitudes, longitudes, chunk_size)
+    # A connection can't be shared between threads, an engine can
+    if num_threads > 1 and isinstance(bind, Engine):
+        pool = ThreadPool(num_threads)
+        try:
+            results = pool.imap(query, chunks)
+            return _columns(row for rows in results for row in rows)
+        finally:
+            pool.close()
+    return _columns(row for chunk in chunks for row in query(chunk))
+
+
+def _columns(rows):
+    result = _empty_result()
+    columns = [result[name] for name in RESULT_COLUMNS]
+    for row in rows:
+        for column, value in zip(columns, row):
+            column.append(value)
+    return result
+
+
+def _unit_vector(latitude, longitude):
+    lat = math.radians(latitude)
+    lon = math.radians(longitude)
+    cos_lat = math.cos(lat)
+    return (cos_lat * math.cos(lon), cos_lat * math.sin(lon), math.sin(lat))
+
+
+def _chord_to_meters(chord):
+    return 2 * EARTH_RADIUS * math.asin(min(chord / 2, 1.0))
+
+
+def _meters_to_chord(meters):
+    return 2 * math.sin(min(meters / EARTH_RADIUS, math.pi) / 2)
+
+
+class PlaceIndex(object):
+    """Places held in memory for nearest neighbour lookups
+
+    Positions are mapped to points on the unit sphere, where the straight
+    line (chord) distance orders places the same as the great circle
+    distance, and the points are put in a k-d tree. That's scipy's
+    `cKDTree` if scipy is installed, which is much faster, and a tree in
+    plain Python otherwise. Distances are great circle distances in meters
+    on a spherical earth.
+    """
+
+    # Largest number of places in the plain Python tree's leaves
+    leaf_size = 8
+
+    def __init__(self, geonameids, names, country_codes, latitudes,
+                 longitudes):
+        self.geonameids = list(geonameids)
+        self.names = list(names)
+        self.country_codes = list(country_codes)
+        vectors = [_unit_vector(lat, lon)
+                   for lat, lon in zip(latitudes, longitudes)]
+        self.tree = None
+        try:
+            from scipy.spatial import cKDTree
+        except ImportError:
+            # Indexes of the places in tree order, and their vectors
+            self.order = list(range(len(vectors)))
+            self.axes = {}
+            self._build(vectors, 0, len(vectors))
+            self.vectors = [vectors[i] for i in self.order]
+        else:
+            if vectors:
+                self.tree = cKDTree(vectors)
+            self.order = self.vectors = None
+
+    def __len__(self):
+        return len(self.geonameids)
+
+    @classmethod
+    def from_database(cls, bind, feature_class='P', min_population=0):
+        """Load the geonames that `reverse_geocode` would consider"""
+        table = Geoname.__table__
+        if is_sqlite(bind):
+            longitude = literal_column(_point_x_sql, Float)
+            latitude = literal_column(_point_y_sql, Float)
+        else:
+            point = cast(table.c.point, Geometry)
+            longitude, latitude = func.ST_X(point), func.ST_Y(point)
+        query = select([table.c.geonameid, table.c.name,
+                        table.c.country_code, latitude, longitude])
+        if feature_class is not None:
+            query = query.where(table.c.feature_class == feature_class)
+        if min_population:
+            query = query.where(table.c.population >= min_population)
+        rows = bind.execute(query).fetchall()
+        columns = list(zip(*rows)) or [()] * 5
+        return cls(*columns)
+
+    def _build(self, vectors, lo, hi):
+        # Each node is the median of `order[lo:hi]`, along the axis with
+        # the largest spread, with the smaller ones before it.
+        stack = [(lo, hi)]
+        order = self.order
+        while stack:
+            lo, hi = stack.pop()
+            if hi - lo <= self.leaf_size:
+                continue
+            spreads = []
+            for axis in range(3):
+                values = [vectors[i][axis] for i in order[lo:hi]]
+                spreads.append(max(values) - min(values))
+            axis = spreads.index(max(spreads))
+            order[lo:hi] = sorted(order[lo:hi],
+                                  key=lambda i: vectors[i][axis])
+            mid = (lo + hi) // 2
+            self.axes[mid] = axis
+            stack.append((lo, mid))
+            stack.append((mid + 1, hi))
+
+    def _tree_nearest(self, vector, max_chord):
+        x, y, z = vector
+        vectors = self.vectors
+        best = None
+        best_distance = float('inf') if max_chord is None else max_chord ** 2
+        # (lo, hi, lower bound of the squared distance to the node's places)
+        stack = [(0, len(vectors), 0.0)]
+        while stack:
+            lo, hi, bound = stack.pop()
+            if bound > best_distance:
+                continue
+            if hi - lo <= self.leaf_size:
+                candidates = range(lo, hi)
+            else:
+                mid = (lo + hi) // 2
+                axis = self.axes[mid]
+                diff = vector[axis] - vectors[mid][axis]
+                below, above = (lo, mid), (mid + 1, hi)
+                near, far = (below, above) if diff < 0 else (above, below)
+                stack.append(far + (max(bound, diff * diff),))
+                stack.append(near + (bound,))
+                candidates = (mid,)
+            for i in candidates:
+                vx, vy, vz = vectors[i]
+                distance = (x - vx) ** 2 + (y - vy) ** 2 + (z - vz) ** 2
+                if distance <= best_distance:
+                    best, best_distance = i, distance
+        if best is None:
+            return None, None
+        return self.order[best], math.sqrt(best_distance)
+
+    def nearest(self, latitudes, longitudes, max_distance=None):
+        """The nearest place of each position, as `reverse_geocode`"""
+        if len(latitudes) != len(longitudes):
+            raise ValueError('Got {} latitudes but {} longitudes'.format(
+                len(latitudes), len(longitudes)))
+        max_chord = None
+        if max_distance is not None:
+            max_chord = _meters_to_chord(max_distance)
+        vectors = [_unit_vector(lat, lon)
+                   for lat, lon in zip(latitudes, longitudes)]
+        if self.tree is not None:
+            chords, indexes = self.tree.query(
+                vectors, distance_upper_bound=(
+                    max_chord if max_chord is not None else float('inf')),
+                workers=-1)
+            matches = [(int(i), c) if i < len(self) else (None, None)
+                       for i, c in zip(indexes, chords)]
+        elif self.vectors:
+            matches = [self._tree_nearest(v, max_chord) for v in vectors]
+        else:
+            matches = [(None, None)] * len(vectors)
+        result = _empty_result()
+        for i, chord in matches:
+            found = i is not None
+            result['geonameid'].append(self.geonameids[i] if found else None)
+            result['name'].append(self.names[i] if found else None)
+            result['country_code'].append(
+                self.country_codes[i] if found else None)
+            result['distance'].append(
+                _chord_to_meters(chord) if found else None)
+        return result
@@ -0,0 +1,313 @@
+"""Fuzzy, ranked search of geonames by name
+
+Searches the names, ascii names and alternate names of the geonames, and
+tolerates misspellings, missing accents and differences in punctuation::
+
+    build_name_table(engine)  # Once, after importing
+    for geoname, score in search(session, 'goteborg', country_code='SE'):
+        ...
+
+`build_name_table` fills `GeonameName` with the normalized names of every
+geoname (see `normalize_name`), which `sqlageonames --search-names` does
+after importing. Candidates are found through a trigram index on the names,
+a GIN index from the pg_trgm extension on PostgreSQL and an FTS5 trigram
+table on SQLite, so a search never scans the whole table. They're ranked by
+
+* the trigram similarity of the name to the searched text, as pg_trgm's
+  `similarity`,
+* a bonus for names matching exactly, and a penalty for alternate names,
+* `FEATURE_CLASS_WEIGHTS`, favouring administrative areas and populated
+  places over e.g. streams and hotels,
+* and the population, on a logarithmic scale.
+
+On PostgreSQL the ranking is done by the database. On SQLite the
+`candidate_limit` candidates that share the most trigrams with the text are
+ranked in Python.
+"""
+from __future__ import division
+import math
+import re
+import unicodedata
+from sqlalchemy import (Column, Float, Integer, MetaData, Table, Text, and_,
+                        case, cast, desc, func, literal_column, select, text)
+from ._compat import text_type
+from .models import Geoname, GeonameName
+from .sqlite import is_sqlite
+from .stream import iter_row_batches, stream_select
+
+# Added to the score of names that are exactly the searched text
+EXACT_MATCH_BONUS = 1.0
+
+# Subtracted from the score of names that are only alternate names
+ALTERNATE_NAME_PENALTY = 0.1
+
+# Added to the score of geonames of these feature classes, by class
+FEATURE_CLASS_WEIGHTS = {
+    'A': 0.3,  # Countries, states, regions
+    'P': 0.2,  # Cities, villages
+}
+
+# Times the base 10 logarithm of the population, added to the score
+POPULATION_WEIGHT = 0.05
+
+# Names less similar to the searched text than this are left out. The
+# default of pg_trgm's `%` operator.
+DEFAULT_MIN_SIMILARITY = 0.3
+
+TRIGRAM_TABLENAME = 'geonamename_trigram'
+
+# Maximum length of `GeonameName.name`
+_max_name_length = GeonameName.__table__.c.name.type.length
+
+# Letters that don't decompose into a base letter and accents
+_transliterations = {
+    u'ß': u'ss',  # Sharp s
+    u'æ': u'ae',
+    u'ð': u'd',  # Eth
+    u'ø': u'o',
+    u'þ': u'th',  # Thorn
+    u'đ': u'd',  # D with stroke
+    u'ı': u'i',  # Dotless i
+    u'ł': u'l',  # L with stroke
+    u'œ': u'oe',
+}
+_transliteration_table = dict((ord(k), v)
+                              for k, v in _transliterations.items())
+
+_non_alphanumeric_re = re.compile(r'[\W_]+', re.UNICODE)
+
+# The SQLite trigram index. Like the other virtual tables it's kept out of
+# `GeonameBase.metadata`, see `.sqlite`.
+_metadata = MetaData()
+
+trigram_table = Table(
+    TRIGRAM_TABLENAME, _metadata,
+    Column('rowid', Integer, primary_key=True),
+    Column('name', Text),
+)
+
+
+def normalize_name(name):
+    """`name` in lower case, without accents and punctuation
+
+    Words are separated by single spaces. The names in `GeonameName` and
+    the searched texts are both normalized, so that e.g. "Göteborg",
+    "goteborg" and "GOTEBORG" are the same name.
+    """
+    name = unicodedata.normalize('NFKD', text_type(name).lower())
+    name = u''.join(c for c in name if not unicodedata.combining(c))
+    name = name.translate(_transliteration_table)
+    return _non_alphanumeric_re.sub(u' ', name).strip()
+
+
+def trigrams(name):
+    """The trigrams of a normalized name, the way pg_trgm makes them
+
+    Every word is padded with two spaces in front and one behind.
+    """
+    result = set()
+    for word in name.split():
+        padded = u'  ' + word + u' '
+        for i in range(len(padded) - 2):
+            result.add(padded[i:i + 3])
+    return result
+
+
+def similarity(name, other):
+    """Share of trigrams the two normalized names have in common, 0 to 1"""
+    name_trigrams, other_trigrams = trigrams(name), trigrams(other)
+    if not name_trigrams or not other_trigrams:
+        return 0.0
+    return (len(name_trigrams & other_trigrams) /
+            len(name_trigrams | other_trigrams))
+
+
+def rank(name_similarity, is_exact, is_alternate, feature_class,
+         population):
+    """The score of a name, see module docstring"""
+    score = name_similarity + FEATURE_CLASS_WEIGHTS.get(feature_class, 0.0)
+    if is_exact:
+        score += EXACT_MATCH_BONUS
+    if is_alternate:
+        score -= ALTERNATE_NAME_PENALTY
+    return score + POPULATION_WEIGHT * math.log10((population or 0) + 1)
+
+
+def _name_rows(geoname_rows):
+    for row in geoname_rows:
+        names = {}
+        for name in (row.name, row.asciiname):
+            name = normalize_name(name)[:_max_name_length]
+            if name:
+                names[name] = False
+        for name in (row.alternatenames or u'').split(u','):
+            name = normalize_name(name)[:_max_name_length]
+            if name and name not in names:
+                names[name] = True
+        for name, is_alternate in names.items():
+            yield {
+                'geonameid': row.geonameid,
+                'name': name,
+                'is_alternate': is_alternate,
+                'feature_class': row.feature_class,
+                'country_code': row.country_code,
+                'admin1_code': row.admin1_code,
+                'population': row.population,
+            }
+
+
+def build_name_table(bind, batch_size=5000):
+    """(Re)fill `GeonameName` from the geoname table
+
+    The geonames are streamed, see `.stream`, so memory use stays flat,
+    and the whole table is replaced in a single transaction. Also
+    (re)builds the trigram index on SQLite. Returns the number of names.
+    """
+    table = GeonameName.__table__
+    columns = ['geonameid', 'name', 'asciiname', 'alternatenames',
+               'feature_class', 'country_code', 'admin1_code', 'population']
+    count = 0
+    with bind.connect() as connection, connection.begin():
+        connection.execute(table.delete())
+        for rows in iter_row_batches(
+            connection, stream_select(Geoname, columns), batch_size,
+        ):
+            name_rows = list(_name_rows(rows))
+            if name_rows:
+                connection.execute(table.insert(), name_rows)
+                count += len(name_rows)
+        if is_sqlite(bind):
+            create_trigram_index(connection)
+    return count
+
+
+def create_trigram_index(bind):
+    """(Re)build the FTS5 trigram index over the SQLite name table
+
+    An external content table, like the name index in `.sqlite`. Requires
+    SQLite 3.34 or later.
+    """
+    bind.execute('DROP TABLE IF EXISTS {}'.format(TRIGRAM_TABLENAME))
+    bind.execute(
+        "CREATE VIRTUAL TABLE {} USING fts5(name, content='geonamename', "
+        "content_rowid='id', tokenize='trigram')".format(TRIGRAM_TABLENAME)
+    )
+    bind.execute("INSERT INTO {0}({0}) VALUES ('rebuild')"
+                 .format(TRIGRAM_TABLENAME))
+
+
+def _filters(table, country_code, admin1_code, feature_class):
+    filters = []
+    if country_code is not None:
+        filters.append(table.c.country_code == country_code)
+    if admin1_code is not None:
+        filters.append(table.c.admin1_code == admin1_code)
+    if feature_class is not None:
+        filters.append(table.c.feature_class == feature_class)
+    return filters
+
+
+def _search_postgresql(bind, query, filters, limit, min_similarity):
+    table = GeonameName.__table__
+    name_similarity = func.similarity(table.c.name, query)
+    score = (
+        name_similarity +
+        case([(table.c.name == query, EXACT_MATCH_BONUS)], else_=0.0) -
+        case([(table.c.is_alternate, ALTERNATE_NAME_PENALTY)], else_=0.0) +
+        case([(table.c.feature_class == feature_class, weight)
+              for feature_class, weight in FEATURE_CLASS_WEIGHTS.items()],
+             else_=0.0) +
+        POPULATION_WEIGHT * func.log(cast(table.c.population + 1, Float))
+    )
+    # `%` has to be escaped for drivers with format style parameters
+    operator = u'%%' if bind.dialect.paramstyle in (
+        'format', 'pyformat') else u'%'
+    statement = (
+        select([table.c.geonameid, func.max(score).label('score')])
+        .where(and_(table.c.name.op(operator)(query), *filters))
+        .group_by(table.c.geonameid)
+        .order_by(desc('score'))
+        .limit(limit)
+    )
+    # The index only finds names at least as similar as `%`'s threshold,
+    # which lasts until the end of the transaction with is_local.
+    bind.execute(
+        text(u"SELECT set_config('pg_trgm.similarity_threshold', :value, "
+             u"true)"),
+        value=text_type(min_similarity))
+    return [(row.geonameid, row.score)
+            for row in bind.execute(statement)]
+
+
+def _fts_query(query):
+    # All trigrams within the words and across the spaces between them,
+    # as the trigram tokenizer indexes them
+    terms = set(query[i:i + 3] for i in range(len(query) - 2))
+    return u' OR '.join(u'"{}"'.format(term.replace(u'"', u'""'))
+                        for term in sorted(terms))
+
+
+def _search_sqlite(bind, query, filters, limit, min_similarity,
+                   candidate_limit):
+    table = GeonameName.__table__
+    statement = select([
+        table.c.geonameid, table.c.name, table.c.is_alternate,
+        table.c.feature_class, table.c.population,
+    ])
+    if len(query) < 3:
+        # Too short for trigrams, find names starting with it instead
+        statement = statement.where(and_(
+            table.c.name >= query, table.c.name < query + u'\uffff'))
+    else:
+        match = literal_column(TRIGRAM_TABLENAME).op('MATCH')(
+            _fts_query(query))
+        statement = (
+            statement
+            .select_from(table.join(trigram_table,
+                                    trigram_table.c.rowid == table.c.id))
+            .where(match)
+            .order_by(literal_column('{}.rank'.format(TRIGRAM_TABLENAME)))
+        )
+    statement = statement.where(and_(*filters)).limit(candidate_limit)
+    scores = {}
+    for row in bind.execute(statement):
+        name_similarity = similarity(query, row.name)
+        if name_similarity < min_similarity:
+            continue
+        score = rank(name_similarity, row.name == query, row.is_alternate,
+                     row.feature_class, row.population)
+        if score > scores.get(row.geonameid, float('-inf')):
+            scores[row.geonameid] = score
+    return sorted(scores.items(), key=lambda item: -item[1])[:limit]
+
+
+def search(session, text, country_code=None, admin1_code=None,
+           feature_class=None, limit=10,
+           min_similarity=DEFAULT_MIN_SIMILARITY, candidate_limit=1000):
+    """Geonames with a name like `text`, as (geoname, score), best first
+
+    Optionally only geonames in a country, and within it an admin1
+    division, or of a feature class. Requires `build_name_table` to have
+    been run. `candidate_limit` only applies to SQLite, see module
+    docstring.
+    """
+    query = normalize_name(text)
+    if not query:
+        return []
+    filters = _filters(GeonameName.__table__, country_code, admin1_code,
+                       feature_class)
+    bind = session.connection()
+    if is_sqlite(bind):
+        scores = _search_sqlite(bind, query, filters, limit, min_similarity,
+                                candidate_limit)
+    else:
+        scores = _search_postgresql(bind, query, filters, limit,
+                                    min_similarity)
+    if not scores:
+        return []
+    geonames = dict(
+        (geoname.geonameid, geoname) for geoname in
+        session.query(Geoname).filter(
+            Geoname.geonameid.in_([geonameid for geonameid, _ in scores])))
+    return [(geonames[geonameid], score) for geonameid, score in scores
+            if geonameid in geonames]
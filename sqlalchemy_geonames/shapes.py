@@ -0,0 +1,185 @@
+"""Which country a position is in, from the country shapes
+
+Requires shapes_simplified_low.json to have been imported (`sqlageonames
+--country-shapes`). The shapes are simplified, so positions within a few
+kilometers of a border or coast may be attributed to the wrong country or
+to none at all.
+
+`country_for_point` asks the database, using the spatial index on
+PostgreSQL. For many lookups load the shapes into a `CountryShapeIndex`
+once, which narrows the shapes down by their bounding boxes in memory::
+
+    index = CountryShapeIndex.from_database(engine)
+    index.country_code(59.33, 18.07)  # u'SE'
+
+"""
+import json
+import math
+from sqlalchemy import func, select, text
+from .models import GeonameCountry, GeonameCountryShape
+from .sqlite import is_sqlite
+
+
+def iter_positions(geometry):
+    """All (longitude, latitude) pairs of a GeoJSON (multi)polygon"""
+    for polygon in _polygons(geometry):
+        for ring in polygon:
+            for position in ring:
+                yield position
+
+
+def _polygons(geometry):
+    if geometry['type'] == 'Polygon':
+        return [geometry['coordinates']]
+    if geometry['type'] == 'MultiPolygon':
+        return geometry['coordinates']
+    raise ValueError(u'Unsupported geometry type {}'.format(
+        geometry['type']))
+
+
+def geojson_bbox(geometry):
+    """(min_lat, min_lon, max_lat, max_lon) of a GeoJSON (multi)polygon"""
+    positions = list(iter_positions(geometry))
+    longitudes = [p[0] for p in positions]
+    latitudes = [p[1] for p in positions]
+    return min(latitudes), min(longitudes), max(latitudes), max(longitudes)
+
+
+def shape_from_geojson(dialect_name):
+    """SQL building `GeonameCountryShape.shape` from the rows' `geojson`"""
+    if dialect_name == 'sqlite':
+        # Stored as is
+        return text(u':geojson')
+    return text(u'ST_SetSRID(ST_GeomFromGeoJSON(:geojson), 4326)')
+
+
+def country_for_point(session, latitude, longitude):
+    """The `GeonameCountry` whose shape contains a position, or None"""
+    query = (
+        session.query(GeonameCountry)
+        .join(GeonameCountryShape,
+              GeonameCountryShape.geonameid == GeonameCountry.geonameid)
+    )
+    if is_sqlite(session.bind):
+        candidates = query.filter(
+            GeonameCountryShape.min_latitude <= latitude,
+            GeonameCountryShape.max_latitude >= latitude,
+            GeonameCountryShape.min_longitude <= longitude,
+            GeonameCountryShape.max_longitude >= longitude,
+        ).add_columns(GeonameCountryShape.shape)
+        for country, shape in candidates:
+            if _contains(json.loads(shape), longitude, latitude):
+                return country
+        return None
+    position = func.ST_GeogFromText(
+        u'SRID=4326;POINT({} {})'.format(longitude, latitude))
+    return query.filter(
+        func.ST_Intersects(GeonameCountryShape.shape, position)).first()
+
+
+def _ring_contains(ring, x, y):
+    # Ray casting: count the edges crossed by a ray from (x, y) to the east
+    inside = False
+    x1, y1 = ring[-1][:2]
+    for position in ring:
+        x2, y2 = position[:2]
+        if (y1 > y) != (y2 > y):
+            if x < (x2 - x1) * (y - y1) / (y2 - y1) + x1:
+                inside = not inside
+        x1, y1 = x2, y2
+    return inside
+
+
+def _contains(geometry, x, y):
+    for polygon in _polygons(geometry):
+        exterior, holes = polygon[0], polygon[1:]
+        if _ring_contains(exterior, x, y) and not any(
+                _ring_contains(hole, x, y) for hole in holes):
+            return True
+    return False
+
+
+class CountryShapeIndex(object):
+    """Country shapes held in memory for point in polygon lookups
+
+    Shapes are bucketed by the `cell_size` degrees cells that their
+    bounding boxes overlap, so a lookup only tests the few shapes whose
+    bounding boxes contain the position. The test itself uses shapely's
+    prepared geometries if shapely is installed, and ray casting in plain
+    Python otherwise.
+    """
+
+    def __init__(self, shapes, cell_size=1.0):
+        """`shapes` is a sequence of (country code, GeoJSON geometry)"""
+        self.cell_size = cell_size
+        self.country_codes = []
+        self.geometries = []
+        self.bboxes = []
+        self.cells = {}
+        try:
+            from shapely.geometry import Point, shape
+            from shapely.prepared import prep
+        except ImportError:
+            self.point = None
+        else:
+            self.point = Point
+        for i, (country_code, geometry) in enumerate(shapes):
+            bbox = geojson_bbox(geometry)
+            self.country_codes.append(country_code)
+            self.bboxes.append(bbox)
+            if self.point is not None:
+                self.geometries.append(prep(shape(geometry)))
+            else:
+                self.geometries.append(geometry)
+            min_x, min_y = self._cell(bbox[0], bbox[1])
+            max_x, max_y = self._cell(bbox[2], bbox[3])
+            for x in range(min_x, max_x + 1):
+                for y in range(min_y, max_y + 1):
+                    self.cells.setdefault((x, y), []).append(i)
+
+    def __len__(self):
+        return len(self.country_codes)
+
+    @classmethod
+    def from_database(cls, bind, **kwargs):
+        """Load the shapes of all countries"""
+        shapes = GeonameCountryShape.__table__
+        countries = GeonameCountry.__table__
+        shape = shapes.c.shape
+        if not is_sqlite(bind):
+            shape = func.ST_AsGeoJSON(shape)
+        rows = bind.execute(
+            select([countries.c.iso, shape]).select_from(
+                shapes.join(countries,
+                            shapes.c.geonameid == countries.c.geonameid))
+        )
+        return cls([(iso, json.loads(geojson)) for iso, geojson in rows],
+                   **kwargs)
+
+    def _cell(self, latitude, longitude):
+        return (int(math.floor(latitude / self.cell_size)),
+                int(math.floor(longitude / self.cell_size)))
+
+    def country_code(self, latitude, longitude):
+        """The code of the country containing a position, or None"""
+        candidates = self.cells.get(self._cell(latitude, longitude), ())
+        point = None
+        for i in candidates:
+            min_lat, min_lon, max_lat, max_lon = self.bboxes[i]
+            if not (min_lat <= latitude <= max_lat and
+                    min_lon <= longitude <= max_lon):
+                continue
+            geometry = self.geometries[i]
+            if self.point is not None:
+                if point is None:
+                    point = self.point(longitude, latitude)
+                if geometry.contains(point):
+                    return self.country_codes[i]
+            elif _contains(geometry, longitude, latitude):
+                return self.country_codes[i]
+        return None
+
+    def country_codes_for(self, latitudes, longitudes):
+        """`country_code` of many positions, as a list"""
+        return [self.country_code(lat, lon)
+                for lat, lon in zip(latitudes, longitudes)]
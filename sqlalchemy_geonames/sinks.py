@@ -0,0 +1,501 @@
+"""Destinations for the rows produced by an `Importer`
+
+A sink receives the same cleaned batches of rows that would otherwise only be
+inserted into the database, so a single pass over a geonames dump can feed
+several outputs at once::
+
+    sinks = [DatabaseSink(session.bind),
+             ParquetSink('/data/geonames', partition_by='country_code'),
+             NDJSONSink('/data/etl')]
+    for importer in get_importer_instances(session, *filepaths, sinks=sinks):
+        importer.run()
+
+"""
+import io
+import json
+import os
+from datetime import date
+from itertools import islice
+from sqlalchemy import (Column, MetaData, Table, and_, bindparam, exists,
+                        or_, text, tuple_)
+from sqlalchemy.exc import StatementError
+from . import state
+from ._compat import text_type, Decimal
+from .reader import fastdate
+from .utils import mkdir_p, try_float, try_int
+
+# Directory name used for rows whose partition value is empty. Same as the
+# one Hive (and thereby pyarrow's hive partitioning) uses.
+NULL_PARTITION = '__HIVE_DEFAULT_PARTITION__'
+
+
+class Sink(object):
+    """Base class for importer sinks
+
+    An importer calls `begin` before its first batch, `write_rows` for each
+    batch of modified rows and `finish` when its file has been exhausted.
+    `abort` is called instead of `finish` if the import fails. A sink
+    instance may be shared by several importers, and should be closed with
+    `close` once they're all done.
+    """
+
+    def begin(self, importer):
+        pass
+
+    def write_rows(self, importer, rows):
+        raise NotImplementedError('`write_rows` must be implemented')
+
+    def finish(self, importer):
+        pass
+
+    def abort(self, importer):
+        self.finish(importer)
+
+    def checkpoint(self, importer):
+        """Make everything written so far durable
+
+        Called periodically when the importer has a `checkpoint_interval`.
+        """
+        pass
+
+    def delete_missing(self, importer):
+        """Remove data that wasn't part of the importer's latest run
+
+        Called after all importers have finished, in reverse dependency
+        order so that referencing rows are removed first.
+        """
+        pass
+
+    def close(self):
+        pass
+
+
+def get_insert_statement(importer, table=None):
+    """An insert statement into `table`, the importer's table by default
+
+    The database computes the importer's computed columns itself.
+    """
+    if table is None:
+        table = importer.table
+    return table.insert().values(
+        **importer.get_computed_values(importer.engine.dialect.name))
+
+
+def get_upsert_statement(table, dialect_name, column_names=None,
+                         computed_values=None):
+    """Build an insert statement that updates rows on primary key conflicts
+
+    Rows whose values are unchanged are left untouched, which spares the
+    database from writing new row versions and updating indexes for them.
+    Only `column_names`, defaulting to all columns, and the columns in
+    `computed_values` (SQL by column name) are written.
+    """
+    computed_values = computed_values or {}
+    columns = [c for c in table.columns
+               if column_names is None or c.name in column_names or
+               c.name in computed_values]
+    pk_names = [c.name for c in table.primary_key.columns]
+    update_names = [c.name for c in columns if c.name not in pk_names]
+    if dialect_name == 'postgresql':
+        from sqlalchemy.dialects.postgresql import insert
+        stmt = insert(table).values(**computed_values)
+        return stmt.on_conflict_do_update(
+            index_elements=pk_names,
+            set_=dict((n, stmt.excluded[n]) for n in update_names),
+            where=or_(*[table.c[n].is_distinct_from(stmt.excluded[n])
+                        for n in update_names]),
+        )
+    elif dialect_name == 'sqlite':
+        # SQLAlchemy has no construct for SQLite's upsert syntax (3.24+)
+        names = [c.name for c in columns]
+        sql = (
+            u'INSERT INTO {table} ({columns}) VALUES ({values}) '
+            u'ON CONFLICT ({pk}) DO UPDATE SET {set} WHERE {where}'
+        ).format(
+            table=table.name,
+            columns=u', '.join(names),
+            values=u', '.join(text_type(computed_values[n])
+                              if n in computed_values else u':' + n
+                              for n in names),
+            pk=u', '.join(pk_names),
+            set=u', '.join(u'{0} = excluded.{0}'.format(n)
+                           for n in update_names),
+            where=u' OR '.join(u'{0}.{1} IS NOT excluded.{1}'
+                               .format(table.name, n) for n in update_names),
+        )
+        # The bind parameters of computed values are left untyped
+        return text(sql).bindparams(*[bindparam(c.name, type_=c.type)
+                                      for c in columns
+                                      if c.name not in computed_values])
+    raise ValueError('Upserts are not supported for {}'.format(dialect_name))
+
+
+class DatabaseSink(Sink):
+    """Inserts rows into the importer's table (the default sink)
+
+    Each file is imported in a single transaction, using an insert statement
+    that is compiled once and then reused for every executemany batch.
+
+    With `upsert` enabled existing rows are updated in place instead, and the
+    primary keys of all written rows are collected in a temporary table so
+    that rows which have disappeared from the source file can be removed
+    with `delete_missing`. Importers with row hashes enabled only pass on
+    changed rows and already know which keys have been removed, so no
+    temporary table is needed for them.
+
+    Importers with a `checkpoint_interval` get their progress saved in the
+    same transaction as the rows, after which the transaction is committed.
+    When the importer has a reject file each batch is written within a
+    savepoint, and if the batch fails its rows are retried one by one with
+    the failing ones written to the reject file.
+    """
+
+    delete_chunk_size = 1000
+
+    def __init__(self, engine, upsert=False):
+        self.engine = engine
+        self.upsert = upsert
+        self.connection = None
+        self.transaction = None
+        self.statement = None
+        # Temporary tables with seen primary keys, keyed by table name
+        self.seen_tables = {}
+
+    def connect(self):
+        # Temporary tables only live as long as the connection, so the same
+        # one is kept until the sink is closed.
+        if self.connection is None:
+            self.connection = self.engine.connect().execution_options(
+                compiled_cache={})
+        return self.connection
+
+    def begin(self, importer):
+        connection = self.connect()
+        self.transaction = connection.begin()
+        if self.upsert and importer.has_natural_key:
+            # Built from the first batch, see `_write_rows`
+            self.statement = None
+            # Files imported into the same table share the seen table,
+            # so that `delete_missing` keeps the rows of all of them.
+            if (
+                importer.row_hashes is None and
+                importer.table.name not in self.seen_tables
+            ):
+                self.create_seen_table(importer.table)
+        elif self.upsert:
+            # Rows without a key of their own can't be matched up with the
+            # existing ones, so the table's content (within the importer's
+            # scope) is replaced instead. Readers keep seeing the old rows
+            # until the import commits.
+            table = importer.table
+            delete = table.delete()
+            for name, value in importer.scope.items():
+                delete = delete.where(table.c[name] == value)
+            connection.execute(delete)
+            self.statement = get_insert_statement(importer)
+        else:
+            self.statement = get_insert_statement(importer)
+
+    def create_seen_table(self, table):
+        seen_table = Table(
+            'tmp_seen_' + table.name, MetaData(),
+            *[Column(c.name, c.type, primary_key=True)
+              for c in table.primary_key.columns],
+            prefixes=['TEMPORARY']
+        )
+        seen_table.drop(self.connection, checkfirst=True)
+        seen_table.create(self.connection)
+        self.seen_tables[table.name] = seen_table
+
+    def write_rows(self, importer, rows):
+        if importer.rejects is None:
+            self._write_rows(importer, rows)
+            return
+        savepoint = self.connection.begin_nested()
+        try:
+            self._write_rows(importer, rows)
+        except StatementError:
+            savepoint.rollback()
+        else:
+            savepoint.commit()
+            return
+        for row in rows:
+            savepoint = self.connection.begin_nested()
+            try:
+                self._write_rows(importer, [row])
+            except StatementError as exc:
+                savepoint.rollback()
+                importer.rejects.write_row(row, exc)
+            else:
+                savepoint.commit()
+
+    def _write_rows(self, importer, rows):
+        if self.statement is None:
+            # Columns that the importer doesn't produce (like an optional
+            # geohash) are left alone when updating rows.
+            dialect_name = self.engine.dialect.name
+            self.statement = get_upsert_statement(
+                importer.table, dialect_name, column_names=set(rows[0]),
+                computed_values=importer.get_computed_values(dialect_name))
+        self.connection.execute(self.statement, rows)
+        seen_table = self.seen_tables.get(importer.table.name)
+        if seen_table is not None:
+            pk_names = seen_table.c.keys()
+            self.connection.execute(
+                seen_table.insert(),
+                [dict((n, row[n]) for n in pk_names) for row in rows],
+            )
+
+    def checkpoint(self, importer):
+        state.save_checkpoint(self.connection, importer)
+        self.transaction.commit()
+        self.transaction = self.connection.begin()
+
+    def finish(self, importer):
+        if importer.checkpoint_interval:
+            state.delete_checkpoint(self.connection, importer)
+        self.transaction.commit()
+        self.transaction = None
+
+    def abort(self, importer):
+        self.transaction.rollback()
+        self.transaction = None
+        self.seen_tables.pop(importer.table.name, None)
+
+    def delete_missing(self, importer):
+        if not self.upsert:
+            return
+        if importer.row_hashes is not None:
+            self.delete_keys(importer.table,
+                             importer.row_hashes.deleted_keys())
+            return
+        table = importer.table
+        seen_table = self.seen_tables.pop(table.name, None)
+        if seen_table is None:
+            return
+        pk_match = and_(*[seen_table.c[c.name] == c
+                          for c in table.primary_key.columns])
+        with self.connection.begin():
+            self.connection.execute(
+                table.delete().where(~exists().where(pk_match)))
+            seen_table.drop(self.connection)
+
+    def delete_keys(self, table, keys):
+        pk_columns = list(table.primary_key.columns)
+        if len(pk_columns) == 1:
+            pk_expr = pk_columns[0]
+        else:
+            pk_expr = tuple_(*pk_columns)
+        # `keys` may be an iterator over many keys, so it's only consumed
+        # a chunk at a time
+        keys = iter(keys)
+        with self.connect().begin():
+            while True:
+                chunk = list(islice(keys, self.delete_chunk_size))
+                if not chunk:
+                    break
+                self.connection.execute(
+                    table.delete().where(pk_expr.in_(chunk)))
+
+    def close(self):
+        if self.connection is not None:
+            self.connection.close()
+            self.connection = None
+
+
+def _partition_value(row, partition_by):
+    value = row.get(partition_by)
+    return NULL_PARTITION if value in (None, '') else text_type(value)
+
+
+class _FileSink(Sink):
+    """Common handling of output paths for the file based sinks
+
+    Unpartitioned output ends up in `<directory>/<table><extension>` and
+    partitioned output in
+    `<directory>/<table>/<partition_by>=<value>/part-0<extension>`. Each
+    further importer of the same table, e.g. of another featureCodes file,
+    gets the next part number: `<table>-1<extension>` or `part-1<extension>`.
+    """
+
+    extension = None
+
+    def __init__(self, directory, partition_by=None, columns=None):
+        self.directory = directory
+        self.partition_by = partition_by
+        self.columns = columns
+        self.part_numbers = {}
+
+    def begin(self, importer):
+        tablename = importer.table.name
+        self.part_numbers.setdefault(tablename, -1)
+        self.part_numbers[tablename] += 1
+
+    def get_filepath(self, importer, partition=None):
+        tablename = importer.table.name
+        part_number = self.part_numbers.get(tablename, 0)
+        if self.partition_by is None:
+            mkdir_p(self.directory)
+            if part_number:
+                tablename = u'{}-{}'.format(tablename, part_number)
+            return os.path.join(self.directory, tablename + self.extension)
+        partition_dir = os.path.join(
+            self.directory, tablename,
+            u'{}={}'.format(self.partition_by, partition))
+        mkdir_p(partition_dir)
+        return os.path.join(partition_dir,
+                            u'part-{}{}'.format(part_number, self.extension))
+
+    def group_rows(self, rows):
+        """Split `rows` into lists keyed by their partition value"""
+        if self.partition_by is None:
+            return {None: rows}
+        groups = {}
+        for row in rows:
+            value = _partition_value(row, self.partition_by)
+            groups.setdefault(value, []).append(row)
+        return groups
+
+
+def _json_default(value):
+    if isinstance(value, Decimal):
+        return float(value)
+    if isinstance(value, date):
+        return value.isoformat()
+    raise TypeError('{!r} is not JSON serializable'.format(value))
+
+
+class NDJSONSink(_FileSink):
+    """Writes rows as newline delimited JSON"""
+
+    extension = '.ndjson'
+
+    def __init__(self, *args, **kwargs):
+        super(NDJSONSink, self).__init__(*args, **kwargs)
+        self.filehandles = {}
+
+    def write_rows(self, importer, rows):
+        for partition, partition_rows in self.group_rows(rows).items():
+            fh = self.filehandles.get(partition)
+            if fh is None:
+                filepath = self.get_filepath(importer, partition)
+                fh = io.open(filepath, 'w', encoding='utf-8')
+                self.filehandles[partition] = fh
+            lines = []
+            for row in partition_rows:
+                if self.columns is not None:
+                    row = dict((k, row.get(k)) for k in self.columns)
+                lines.append(text_type(json.dumps(row, default=_json_default,
+                                                  ensure_ascii=False)))
+            fh.write(u'\n'.join(lines) + u'\n')
+
+    def finish(self, importer):
+        for fh in self.filehandles.values():
+            fh.close()
+        self.filehandles = {}
+
+
+class ParquetSink(_FileSink):
+    """Writes rows as (optionally hive partitioned) Parquet files
+
+    Rows are buffered column-wise per partition and written as one row group
+    each time `row_group_size` rows have been collected. As is customary for
+    hive partitioning the `partition_by` column is only encoded in the
+    directory name. Requires `pyarrow`.
+    """
+
+    extension = '.parquet'
+
+    def __init__(self, directory, partition_by=None, columns=None,
+                 row_group_size=65536):
+        try:
+            import pyarrow
+            import pyarrow.parquet
+        except ImportError:
+            raise ImportError('ParquetSink requires pyarrow. Install it with '
+                              '`pip install sqlalchemy-geonames[parquet]`.')
+        self.pa = pyarrow
+        self.pq = pyarrow.parquet
+        super(ParquetSink, self).__init__(directory, partition_by, columns)
+        self.row_group_size = row_group_size
+        self.schema = None
+        self.buffers = {}
+        self.writers = {}
+
+    @property
+    def arrow_types(self):
+        pa = self.pa
+        return {
+            int: pa.int64(),
+            try_int: pa.int64(),
+            Decimal: pa.float64(),
+            float: pa.float64(),
+            try_float: pa.float64(),
+            fastdate: pa.date32(),
+        }
+
+    def build_schema(self, importer, row):
+        """Derive the Parquet schema from the importer's field definitions
+
+        Columns that aren't defined by the reader (e.g. those added by
+        modifiers) are stored as strings.
+        """
+        field_definitions = importer.file_class.field_definitions
+        type_map = dict(field_definitions)
+        arrow_types = self.arrow_types
+        names = self.columns
+        if names is None:
+            names = [fd[0] for fd in field_definitions if fd[0] in row]
+            names += sorted(k for k in row if k not in type_map)
+        names = [n for n in names if n != self.partition_by]
+        fields = [(name, arrow_types.get(type_map.get(name), self.pa.string()))
+                  for name in names]
+        return self.pa.schema(fields)
+
+    def begin(self, importer):
+        super(ParquetSink, self).begin(importer)
+        self.schema = None
+        self.buffers = {}
+        self.writers = {}
+
+    def write_rows(self, importer, rows):
+        if not rows:
+            return
+        if self.schema is None:
+            self.schema = self.build_schema(importer, rows[0])
+        names = self.schema.names
+        for partition, partition_rows in self.group_rows(rows).items():
+            buf = self.buffers.get(partition)
+            if buf is None:
+                buf = self.buffers[partition] = dict((n, []) for n in names)
+            for name in names:
+                buf[name].extend(row.get(name) for row in partition_rows)
+            if len(buf[names[0]]) >= self.row_group_size:
+                self.flush(importer, partition)
+
+    def flush(self, importer, partition):
+        buf = self.buffers.pop(partition, None)
+        if not buf or not buf[self.schema.names[0]]:
+            return
+        arrays = []
+        for field in self.schema:
+            values = buf[field.name]
+            if field.type == self.pa.float64():
+                values = [None if v is None else float(v) for v in values]
+            elif field.type == self.pa.string():
+                values = [None if v is None else text_type(v) for v in values]
+            arrays.append(self.pa.array(values, type=field.type))
+        table = self.pa.Table.from_arrays(arrays, schema=self.schema)
+        writer = self.writers.get(partition)
+        if writer is None:
+            filepath = self.get_filepath(importer, partition)
+            writer = self.pq.ParquetWriter(filepath, self.schema)
+            self.writers[partition] = writer
+        writer.write_table(table)
+
+    def finish(self, importer):
+        for partition in list(self.buffers):
+            self.flush(importer, partition)
+        for writer in self.writers.values():
+            writer.close()
+        self.writers = {}
@@ -0,0 +1,186 @@
+"""SQLite backend support
+
+Makes it possible to build a self-contained geonames database file without
+PostgreSQL/PostGIS. `Geoname.point` is stored as WKT text on SQLite, so
+spatial lookups instead go through an R*Tree virtual table and name lookups
+through an FTS5 index. Both are built in one go after the data has been
+loaded::
+
+    engine = create_engine('sqlite:///geonames.db')
+    configure_bulk_load(engine)
+    ... run the importers ...
+    create_indexes(engine)
+    finalize_database(engine)
+
+The resulting file can then be opened read-only with `get_readonly_engine`.
+"""
+from sqlalchemy import (Column, Float, Integer, MetaData, Table, Text,
+                        create_engine, event, literal_column)
+from ._compat import pathname2url
+from .models import Geoname
+
+# Trades durability for speed while loading. A crashed load has to be
+# redone anyway, so there's no point in paying for a rollback journal.
+BULK_LOAD_PRAGMAS = (
+    ('journal_mode', 'MEMORY'),
+    ('synchronous', 'OFF'),
+    ('temp_store', 'MEMORY'),
+    ('cache_size', '-262144'),  # In KiB, i.e. 256 MiB
+)
+
+RTREE_TABLENAME = 'geoname_rtree'
+FTS_TABLENAME = 'geoname_fts'
+
+# These virtual tables are created by `create_indexes` and are kept out of
+# `GeonameBase.metadata` so that `create_all` doesn't try to create them.
+_metadata = MetaData()
+
+rtree_table = Table(
+    RTREE_TABLENAME, _metadata,
+    Column('geonameid', Integer, primary_key=True),
+    Column('min_x', Float),
+    Column('max_x', Float),
+    Column('min_y', Float),
+    Column('max_y', Float),
+)
+
+fts_table = Table(
+    FTS_TABLENAME, _metadata,
+    Column('rowid', Integer, primary_key=True),
+    Column('name', Text),
+    Column('asciiname', Text),
+    Column('alternatenames', Text),
+)
+
+# Extracts x and y from the `POINT(x y)` WKT string stored in geoname.point
+_point_x_sql = "CAST(substr(point, 7, instr(point, ' ') - 7) AS REAL)"
+_point_y_sql = ("CAST(substr(point, instr(point, ' ') + 1, "
+                "length(point) - instr(point, ' ') - 1) AS REAL)")
+
+
+def is_sqlite(bind):
+    return bind.dialect.name == 'sqlite'
+
+
+def _set_bulk_load_pragmas(dbapi_connection, connection_record):
+    cursor = dbapi_connection.cursor()
+    for name, value in BULK_LOAD_PRAGMAS:
+        cursor.execute('PRAGMA {} = {}'.format(name, value))
+    cursor.close()
+
+
+def configure_bulk_load(engine):
+    """Apply `BULK_LOAD_PRAGMAS` to every new connection made by `engine`"""
+    event.listen(engine, 'connect', _set_bulk_load_pragmas)
+
+
+def _disable_pysqlite_transactions(dbapi_connection, connection_record):
+    dbapi_connection.isolation_level = None
+
+
+def _begin(connection):
+    connection.execute('BEGIN')
+
+
+def enable_savepoints(engine):
+    """Let SQLAlchemy rather than pysqlite control transactions
+
+    pysqlite only begins transactions implicitly before DML statements,
+    which breaks savepoints (used when importing with a reject file). This
+    is the workaround recommended by SQLAlchemy's documentation.
+    """
+    event.listen(engine, 'connect', _disable_pysqlite_transactions)
+    event.listen(engine, 'begin', _begin)
+
+
+def create_spatial_index(bind):
+    """(Re)build the R*Tree index from the points in the geoname table"""
+    bind.execute('DROP TABLE IF EXISTS {}'.format(RTREE_TABLENAME))
+    bind.execute('CREATE VIRTUAL TABLE {} USING rtree'
+                 '(geonameid, min_x, max_x, min_y, max_y)'
+                 .format(RTREE_TABLENAME))
+    bind.execute(
+        'INSERT INTO {0} SELECT geonameid, x, x, y, y FROM '
+        '(SELECT geonameid, {1} AS x, {2} AS y FROM geoname)'
+        .format(RTREE_TABLENAME, _point_x_sql, _point_y_sql)
+    )
+
+
+def create_name_index(bind):
+    """(Re)build the FTS5 index over the geoname names
+
+    The index is an external content table, so the names aren't stored
+    twice.
+    """
+    bind.execute('DROP TABLE IF EXISTS {}'.format(FTS_TABLENAME))
+    bind.execute(
+        "CREATE VIRTUAL TABLE {} USING fts5(name, asciiname, alternatenames, "
+        "content='geoname', content_rowid='geonameid', "
+        "tokenize='unicode61 remove_diacritics 1')".format(FTS_TABLENAME)
+    )
+    bind.execute("INSERT INTO {0}({0}) VALUES ('rebuild')"
+                 .format(FTS_TABLENAME))
+
+
+def create_indexes(bind):
+    create_spatial_index(bind)
+    create_name_index(bind)
+
+
+def finalize_database(bind):
+    """Prepare a freshly loaded database file for read-only use
+
+    Gathers statistics for the query planner, merges the FTS index segments
+    and compacts the file.
+    """
+    bind.execute("INSERT INTO {0}({0}) VALUES ('optimize')"
+                 .format(FTS_TABLENAME))
+    bind.execute('ANALYZE')
+    bind.execute('PRAGMA journal_mode = DELETE')
+    bind.execute('VACUUM')
+
+
+def get_readonly_engine(filepath):
+    """Open a finalized database file read-only
+
+    `immutable=1` tells SQLite that the file won't change, which skips all
+    locking and change detection.
+    """
+    # A URI, in which e.g. ? and # in the path have to be escaped
+    url = 'sqlite:///file:{}?mode=ro&immutable=1&uri=true'.format(
+        pathname2url(filepath))
+    return create_engine(url)
+
+
+def geonames_in_bbox(session, min_lon, min_lat, max_lon, max_lat):
+    """Query for geonames within a bounding box, using the R*Tree index"""
+    ids = (
+        rtree_table.select()
+        .with_only_columns([rtree_table.c.geonameid])
+        .where(rtree_table.c.min_x >= min_lon)
+        .where(rtree_table.c.max_x <= max_lon)
+        .where(rtree_table.c.min_y >= min_lat)
+        .where(rtree_table.c.max_y <= max_lat)
+    )
+    return session.query(Geoname).filter(Geoname.geonameid.in_(ids))
+
+
+def _fts_phrase(text, prefix):
+    phrase = u'"{}"'.format(text.replace(u'"', u'""'))
+    return phrase + u'*' if prefix else phrase
+
+
+def search_names(session, text, prefix=True):
+    """Query for geonames whose names match `text`, best matches first
+
+    `text` is matched as a phrase against `name`, `asciiname` and
+    `alternatenames`. With `prefix` enabled the last word may be incomplete.
+    """
+    match = literal_column(FTS_TABLENAME).op('MATCH')(
+        _fts_phrase(text, prefix))
+    return (
+        session.query(Geoname)
+        .join(fts_table, fts_table.c.rowid == Geoname.geonameid)
+        .filter(match)
+        .order_by(literal_column('{}.rank'.format(FTS_TABLENAME)))
+    )
@@ -0,0 +1,320 @@
+"""Bookkeeping of imported files, used to skip importing unchanged data
+
+For every imported file a `GeonameMetadata` row records the hash of its
+content and how many rows it contained. An importer whose file hashes to the
+same value as last time has nothing new to contribute and can be skipped.
+
+Imports that are in progress periodically save a `GeonameImportCheckpoint`,
+so that they can be resumed from there should they fail.
+
+`RowHashes` goes one step further for files that have changed, by keeping
+a digest per row in a sidecar file so that only rows that actually differ
+need to be written. `ExistingKeys` does the same for switching to another
+primary geonames file, by only writing the rows that aren't in the table
+yet.
+"""
+import hashlib
+import os
+import pickle
+from datetime import datetime
+from sqlalchemy import inspect, select
+from ._compat import utc
+from .models import GeonameMetadata, GeonameImportCheckpoint
+from .stream import iter_row_batches
+
+# Tables with import bookkeeping, as opposed to geonames data
+bookkeeping_tables = (GeonameMetadata.__table__,
+                      GeonameImportCheckpoint.__table__)
+
+
+def upgrade_bookkeeping_tables(bind):
+    """Drop the bookkeeping tables created by older versions
+
+    Their columns have changed, and since they only hold bookkeeping they
+    can simply be recreated by `create_all`. The next import of each file is
+    then a full one. Returns the names of the dropped tables.
+    """
+    inspector = inspect(bind)
+    existing = set(inspector.get_table_names())
+    dropped = []
+    for table in bookkeeping_tables:
+        if table.name not in existing:
+            continue
+        columns = set(c['name'] for c in inspector.get_columns(table.name))
+        if not set(table.columns.keys()) <= columns:
+            table.drop(bind=bind)
+            dropped.append(table.name)
+    return dropped
+
+
+def file_digest(filepath, chunk_size=1 << 20):
+    """Hex encoded sha256 digest of the contents of `filepath`"""
+    digest = hashlib.sha256()
+    with open(filepath, 'rb') as fh:
+        for chunk in iter(lambda: fh.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def get_file_state(session, filename, tablename=None):
+    query = session.query(GeonameMetadata).filter_by(filename=filename)
+    if tablename is not None:
+        query = query.filter_by(tablename=tablename)
+    return query.first()
+
+
+def is_unchanged(session, importer):
+    state = get_file_state(session, importer.filename, importer.table.name)
+    return state is not None and state.content_hash == importer.content_hash
+
+
+def get_changed_importers(session, importers, cascade=True):
+    """Filter out the importers whose file hasn't changed since last import
+
+    `importers` must be sorted by their dependencies. With `cascade` enabled
+    an importer is kept whenever one of its dependencies is, which is
+    required when the tables are purged before importing since the rows
+    referencing a purged table have to go as well, together with the rows
+    that other files imported into the same table.
+    """
+    changed = [i for i in importers if not is_unchanged(session, i)]
+    if not cascade:
+        return changed
+    kept = []
+    for importer in importers:
+        if importer in changed or any(
+            other.model in importer.model_dependencies or
+            other.table is importer.table
+            for other in changed + kept
+        ):
+            kept.append(importer)
+    return kept
+
+
+def invalidate_table(session, tablename, exclude_filenames=()):
+    """Forget the files imported into `tablename`, e.g. after purging it"""
+    for model in (GeonameMetadata, GeonameImportCheckpoint):
+        query = session.query(model).filter_by(tablename=tablename)
+        if exclude_filenames:
+            query = query.filter(~model.filename.in_(exclude_filenames))
+        query.delete(synchronize_session=False)
+    session.commit()
+
+
+def record_import(session, importer):
+    """Remember the content hash and row count of a finished import"""
+    state = get_file_state(session, importer.filename, importer.table.name)
+    if state is None:
+        state = GeonameMetadata(filename=importer.filename,
+                                tablename=importer.table.name)
+        session.add(state)
+    state.content_hash = importer.content_hash
+    state.row_count = importer.row_count
+    state.last_updated = datetime.now(utc)
+    session.commit()
+    return state
+
+
+def record_delta(connection, filename, tablename, content_hash, row_count):
+    """Remember a daily delta file as applied, see `.daemon`
+
+    Executed with the connection that the delta is applied with, so that
+    it's recorded in the same transaction.
+    """
+    table = GeonameMetadata.__table__
+    connection.execute(
+        table.delete()
+        .where(table.c.filename == filename)
+        .where(table.c.tablename == tablename))
+    connection.execute(table.insert(), {
+        'filename': filename,
+        'tablename': tablename,
+        'content_hash': content_hash,
+        'row_count': row_count,
+        'last_updated': datetime.now(utc),
+    })
+
+
+def get_checkpoint(session, importer):
+    """The importer's checkpoint, if there is one that can be resumed"""
+    checkpoint = session.query(GeonameImportCheckpoint).get(
+        (importer.filename, importer.table.name))
+    if (
+        checkpoint is not None and
+        checkpoint.content_hash == importer.content_hash
+    ):
+        return checkpoint
+    return None
+
+
+def save_checkpoint(connection, importer):
+    """Save the importer's progress
+
+    Executed with the connection that the rows are written with, so that
+    the checkpoint is committed in the same transaction as the rows.
+    """
+    table = GeonameImportCheckpoint.__table__
+    delete_checkpoint(connection, importer)
+    connection.execute(table.insert(), {
+        'filename': importer.filename,
+        'tablename': importer.table.name,
+        'content_hash': importer.content_hash,
+        'byte_offset': importer.reader.offset,
+        'rownum': importer.reader.rownum,
+        'row_count': importer.row_count,
+        'last_key': importer.last_key,
+        'last_updated': datetime.now(utc),
+    })
+
+
+def delete_checkpoint(connection, importer):
+    table = GeonameImportCheckpoint.__table__
+    connection.execute(
+        table.delete()
+        .where(table.c.filename == importer.filename)
+        .where(table.c.tablename == importer.table.name))
+
+
+def row_digest(values):
+    # Only used to detect changes, so collisions aren't a security concern.
+    # 8 bytes keeps the sidecar file small.
+    return hashlib.md5(repr(values).encode('utf-8')).digest()[:8]
+
+
+class RowHashes(object):
+    """Per-row digests of a file, persisted in `<filepath>.rowhashes`
+
+    Rows are identified by their primary key values. Compared to the
+    digests saved from the previous import this tells which rows are new or
+    changed (`is_unchanged`) and which have been removed (`deleted_keys`).
+
+    The digests describe what was imported last time, so they are only
+    valid as long as the database isn't modified by other means.
+    """
+
+    suffix = '.rowhashes'
+
+    def __init__(self, filepath, key_names, field_names):
+        self.path = filepath + self.suffix
+        self.key_names = tuple(key_names)
+        self.field_names = tuple(field_names)
+        self.previous = self.load()
+        self.current = {}
+
+    def load(self):
+        if not os.path.exists(self.path):
+            return {}
+        with open(self.path, 'rb') as fh:
+            return pickle.load(fh)
+
+    def save(self):
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'wb') as fh:
+            pickle.dump(self.current, fh, pickle.HIGHEST_PROTOCOL)
+        os.rename(tmp_path, self.path)
+
+    def get_key(self, row):
+        if len(self.key_names) == 1:
+            return row[self.key_names[0]]
+        return tuple(row[n] for n in self.key_names)
+
+    def is_unchanged(self, row):
+        key = self.get_key(row)
+        digest = row_digest(tuple(row.get(n) for n in self.field_names))
+        self.current[key] = digest
+        return self.previous.get(key) == digest
+
+    def deleted_keys(self):
+        return [k for k in self.previous if k not in self.current]
+
+
+class IdSet(object):
+    """A set of non-negative integers, kept as a bitmap
+
+    One bit per integer up to the largest one, so the ids of all ~12M
+    geonames take about 1.5MB instead of the hundreds of megabytes of a
+    `set` of them.
+    """
+
+    def __init__(self, ids=()):
+        self.bits = bytearray()
+        self.count = 0
+        for value in ids:
+            self.add(value)
+
+    @classmethod
+    def from_column(cls, bind, column, batch_size=100000):
+        """The values of an integer table column, streamed"""
+        id_set = cls()
+        for rows in iter_row_batches(bind, select([column]), batch_size):
+            for row in rows:
+                id_set.add(row[0])
+        return id_set
+
+    def add(self, value):
+        index = value >> 3
+        if index >= len(self.bits):
+            # Grows at least twofold, to keep the number of copies down
+            self.bits.extend(bytearray(max(index + 1 - len(self.bits),
+                                           len(self.bits))))
+        mask = 1 << (value & 7)
+        if not self.bits[index] & mask:
+            self.bits[index] |= mask
+            self.count += 1
+
+    def __contains__(self, value):
+        index = value >> 3
+        return index < len(self.bits) and bool(
+            self.bits[index] & (1 << (value & 7)))
+
+    def __len__(self):
+        return self.count
+
+    def _iter_bits(self, bytes_and_masks):
+        for index, byte in bytes_and_masks:
+            if byte:
+                for bit in range(8):
+                    if byte & (1 << bit):
+                        yield (index << 3) | bit
+
+    def __iter__(self):
+        return self._iter_bits(enumerate(self.bits))
+
+    def difference(self, other):
+        """Iterator over the values that aren't in `other`"""
+        other_bits = other.bits
+        num_other = len(other_bits)
+        return self._iter_bits(
+            (index, byte & ~other_bits[index] if index < num_other else byte)
+            for index, byte in enumerate(self.bits))
+
+
+class ExistingKeys(object):
+    """Skips the rows whose integer key is in `existing`, see `IdSet`
+
+    Used in place of `RowHashes` (it has the same interface) when switching
+    to a primary geonames file that overlaps with the one imported, e.g.
+    from cities5000.txt to cities1000.txt. Rows of geonames that are in the
+    table already aren't written again, and `deleted_keys` are those that
+    aren't in the new file.
+
+    The importers of files going into the same table, like no-country.txt
+    next to a cities file, share the `IdSet` of the `current` keys, so that
+    only the keys in neither file are deleted.
+    """
+
+    def __init__(self, existing, key_name, current=None):
+        self.existing = existing
+        self.key_name = key_name
+        self.current = IdSet() if current is None else current
+
+    def is_unchanged(self, row):
+        key = row[self.key_name]
+        self.current.add(key)
+        return key in self.existing
+
+    def deleted_keys(self):
+        return self.existing.difference(self.current)
+
+    def save(self):
+        pass
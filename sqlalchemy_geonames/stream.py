@@ -0,0 +1,97 @@
+"""Reading whole tables in constant memory
+
+`session.query(Geoname)` loads every row of the result, and makes a mapped
+instance with its identity map entry and lazy relationships of each. For
+full table scans, e.g. to feed a search index, read the rows through a
+server-side cursor instead::
+
+    for row in iter_rows(engine, Geoname, ['geonameid', 'name'],
+                         filters=[Geoname.country_code == 'SE']):
+        row.geonameid, row.name
+
+    for batch in iter_column_batches(engine, Geoname, ['name', 'population']):
+        batch['name'], batch['population']  # Lists of up to 10000 values
+
+Rows are tuples that can also be read by column name, batches are dicts of
+lists like the results of `.reverse.reverse_geocode`. Only `batch_size`
+rows are held in memory at a time. On PostgreSQL the rows are read through
+a named (server-side) cursor, SQLite steps through its results on demand
+anyway.
+
+Mapped instances can be streamed the same way with
+`query.yield_per(batch_size)`, but they still end up in the session's
+identity map.
+"""
+from sqlalchemy import and_, select
+from sqlalchemy.engine import Connection
+from ._compat import string_types
+
+DEFAULT_BATCH_SIZE = 10000
+
+
+def _columns(table, columns):
+    if columns is None:
+        return list(table.columns)
+    return [table.c[column] if isinstance(column, string_types) else column
+            for column in columns]
+
+
+def stream_select(model, columns=None, filters=(), order_by=None):
+    """The statement read by `iter_rows`"""
+    table = getattr(model, '__table__', model)
+    statement = select(_columns(table, columns)).select_from(table)
+    if filters:
+        statement = statement.where(and_(*filters))
+    if order_by is not None:
+        statement = statement.order_by(order_by)
+    return statement
+
+
+def iter_row_batches(bind, statement, batch_size=DEFAULT_BATCH_SIZE):
+    """Lists of up to `batch_size` rows of `statement`"""
+    if isinstance(bind, Connection):
+        connection, close = bind, False
+    else:
+        connection, close = bind.connect(), True
+    try:
+        result = connection.execution_options(
+            stream_results=True, max_row_buffer=batch_size,
+        ).execute(statement)
+        try:
+            while True:
+                rows = result.fetchmany(batch_size)
+                if not rows:
+                    break
+                yield rows
+        finally:
+            result.close()
+    finally:
+        if close:
+            connection.close()
+
+
+def iter_rows(bind, model, columns=None, filters=(), order_by=None,
+              batch_size=DEFAULT_BATCH_SIZE):
+    """Rows of `model`, a mapped class or a table, see module docstring
+
+    `columns` are column names or columns of the table, all of them if
+    None. Only rows matching all `filters`, SQL expressions, are read.
+    `batch_size` rows are fetched from the database at a time.
+
+    `bind` is an engine or a connection. Rows can be written to other
+    tables through the connection while its rows are read.
+    """
+    statement = stream_select(model, columns, filters, order_by)
+    for rows in iter_row_batches(bind, statement, batch_size):
+        for row in rows:
+            yield row
+
+
+def iter_column_batches(bind, model, columns=None, filters=(), order_by=None,
+                        batch_size=DEFAULT_BATCH_SIZE):
+    """As `iter_rows`, but yields a dict with a list per column name"""
+    statement = stream_select(model, columns, filters, order_by)
+    names = list(statement.c.keys())
+    for rows in iter_row_batches(bind, statement, batch_size):
+        yield dict((name, list(values))
+                   for name, values in zip(names, zip(*rows)))
@@ -2,6 +2,6 @@ dropuser sqla_geonames
 dropdb sqla_geonames
 createuser sqla_geonames
 createdb -O sqla_geonames sqla_geonames
-for ext in postgis postgis_topology fuzzystrmatch postgis_tiger_geocoder
+for ext in postgis postgis_topology fuzzystrmatch postgis_tiger_geocoder pg_trgm
     do psql -d sqla_geonames -c "CREATE EXTENSION $ext;"
 done
@@ -0,0 +1,59 @@
+import os
+
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from sqlalchemy_geonames import GeonameBase, get_importer_instances, state
+
+# Imported by `imported_engine` unless the test module has `test_filenames`
+# of its own, or the fixture is parametrized with other ones.
+test_filenames = (
+    'featureCodes_en.txt',
+    'timeZones.txt',
+    'countryInfo.txt',
+    'cities1000.txt',
+)
+
+
+def tst_filepath(filename):
+    return os.path.join(os.path.dirname(__file__), 'files', filename)
+
+
+def import_tst_files(engine, filenames=test_filenames, **kwargs):
+    """Create the tables and import the test files `filenames` into them
+
+    The keyword arguments are passed on to `get_importer_instances`.
+    """
+    GeonameBase.metadata.create_all(bind=engine)
+    session = sessionmaker(bind=engine)()
+    filepaths = [tst_filepath(fn) for fn in filenames]
+    for importer in get_importer_instances(session, *filepaths, **kwargs):
+        importer.run()
+        state.record_import(session, importer)
+    session.close()
+
+
+def get_tst_filenames(request):
+    return getattr(request, 'param', None) or getattr(
+        request.module, 'test_filenames', test_filenames)
+
+
+@pytest.fixture
+def imported_engine(request, tmpdir):
+    """A SQLite database file with the test files imported
+
+    Parametrize it indirectly with a tuple of filenames to import others.
+    """
+    engine = create_engine('sqlite:///' + str(tmpdir.join('geonames.db')))
+    import_tst_files(engine, get_tst_filenames(request))
+    yield engine
+    engine.dispose()
+
+
+@pytest.fixture(scope='module')
+def shared_imported_engine(request):
+    """Like `imported_engine`, but in memory and shared by the module"""
+    engine = create_engine('sqlite://')
+    import_tst_files(engine, get_tst_filenames(request))
+    return engine
@@ -0,0 +1,30 @@
+from sqlalchemy_geonames.batching import BatchSizer
+
+
+def test_batch_size_grows_towards_target():
+    sizer = BatchSizer(initial_size=100, target_seconds=1.0, max_size=1000)
+    # 100 rows in 0.01s means 10000 rows/second, but growth is limited to
+    # a factor 2 per flush and the size by `max_size`.
+    sizer.record(100, 10000, 0.01)
+    assert sizer.size == 200
+    for _ in range(5):
+        sizer.record(sizer.size, sizer.size * 100, sizer.size / 10000.0)
+    assert sizer.size == 1000
+    assert sizer.stats['largest_batch_size'] == 1000
+
+
+def test_batch_size_shrinks_when_slow():
+    sizer = BatchSizer(initial_size=1000, target_seconds=0.1, min_size=50)
+    sizer.record(1000, 100000, 10.0)
+    assert sizer.size == 500
+    for _ in range(10):
+        sizer.record(sizer.size, sizer.size * 100, sizer.size / 100.0)
+    assert sizer.size == 50
+
+
+def test_batch_size_limited_by_bytes():
+    sizer = BatchSizer(initial_size=100, max_bytes=10000)
+    sizer.record(100, 10000, 0.001)
+    assert sizer.size == 100
+    assert sizer.is_full(10, 10000)
+    assert not sizer.is_full(10, 100)
@@ -0,0 +1,87 @@
+import pytest
+from sqlalchemy import event
+from sqlalchemy.orm import sessionmaker
+
+from sqlalchemy_geonames import (DatabaseSink, Geoname, GeonameCountry,
+                                 get_importer_instances, state)
+from sqlalchemy_geonames.cache import ReferenceCache, get_reference_cache
+
+from conftest import tst_filepath
+
+test_filenames = (
+    'cities1000.txt',
+    'timeZones.txt',
+    'featureCodes_en.txt',
+    'countryInfo.txt',
+    'admin1CodesASCII.txt',
+)
+
+
+@pytest.fixture
+def session(imported_engine):
+    session = sessionmaker(bind=imported_engine)()
+    yield session
+    session.close()
+
+
+def count_queries(engine):
+    queries = []
+    event.listen(engine, 'before_cursor_execute',
+                 lambda *args: queries.append(args[2]))
+    return queries
+
+
+def test_lookups_without_queries(session):
+    cache = get_reference_cache(session.bind)
+    assert get_reference_cache(session.bind) is cache
+    geonames = session.query(Geoname).all()
+    cache.country('SE')  # Loads the cache
+    queries = count_queries(session.bind)
+    for geoname in geonames:
+        country = cache.country_of(geoname)
+        assert country is None or country.iso == geoname.country_code
+        cache.timezone_of(geoname)
+        cache.feature_of(geoname)
+    assert cache.admin1('FR', 'B9').name == u'Rh\xf4ne-Alpes'
+    assert queries == []
+    with pytest.raises(AttributeError):
+        cache.country('SE').country = u'Changed'
+
+
+def test_reload_after_import(session):
+    cache = ReferenceCache(session.bind, ttl=0)
+    assert cache.country('SE').country == u'Sweden'
+    session.query(GeonameCountry).filter_by(iso='SE').update(
+        {'country': u'Sverige'})
+    session.commit()
+    # Not reloaded, as no new import has been recorded
+    assert cache.country('SE').country == u'Sweden'
+    importer, = get_importer_instances(
+        session, tst_filepath('countryInfo.txt'))
+    state.record_import(session, importer)
+    assert cache.country('SE').country == u'Sverige'
+
+
+def test_feature_translations(session):
+    translation_filepaths = [tst_filepath('featureCodes_en.txt'),
+                             tst_filepath('featureCodes_sv.txt')]
+    importers = get_importer_instances(
+        session, translation_filepaths=translation_filepaths)
+    for importer in importers:
+        importer.run()
+        state.record_import(session, importer)
+    # Each file replaces only the rows of its own language
+    importer, = get_importer_instances(
+        session, translation_filepaths=translation_filepaths[1:],
+        sinks=[DatabaseSink(session.bind, upsert=True)])
+    importer.run()
+
+    cache = ReferenceCache(session.bind)
+    assert cache.feature_languages() == ['en', 'sv']
+    assert cache.feature('ADM2', 'sv').name == (
+        u'andra ordningens administrativ avdelning')
+    assert cache.feature('ADM2', 'en').name == (
+        u'second-order administrative division')
+    assert cache.feature('ADM2').name == cache.feature('ADM2', 'en').name
+    # Falls back to the untranslated feature
+    assert cache.feature('ADM2', 'fi').name == cache.feature('ADM2').name
@@ -0,0 +1,181 @@
+# -*- coding: utf-8 -*-
+import io
+import json
+import os
+from datetime import date, timedelta
+
+import pytest
+from sqlalchemy.orm import sessionmaker
+
+from sqlalchemy_geonames import (Geoname, GeonameAlternateName,
+                                 GeonameMetadata, geohash,
+                                 get_importer_instances)
+from sqlalchemy_geonames.daemon import (DeltaDaemon, DirectorySource,
+                                        serve_metrics)
+from sqlalchemy_geonames.sinks import DatabaseSink
+from sqlalchemy_geonames.state import record_import
+
+try:
+    from urllib.request import urlopen
+    from urllib.error import HTTPError
+except ImportError:
+    from urllib2 import HTTPError, urlopen
+
+from conftest import tst_filepath
+
+
+@pytest.fixture
+def session(imported_engine):
+    session = sessionmaker(bind=imported_engine)()
+    yield session
+    session.close()
+
+
+def geoname_line(source_geonameid, **changes):
+    with io.open(tst_filepath('cities1000.txt'), encoding='utf-8') as fh:
+        for line in fh:
+            cells = line.rstrip(u'\n').split(u'\t')
+            if cells[0] == str(source_geonameid):
+                break
+    cells[0] = str(changes.pop('geonameid', source_geonameid))
+    if 'name' in changes:
+        cells[1] = changes.pop('name')
+    if 'latitude' in changes:
+        cells[4] = str(changes.pop('latitude'))
+    if 'longitude' in changes:
+        cells[5] = str(changes.pop('longitude'))
+    return u'\t'.join(cells)
+
+
+def write_day(directory, day, modifications=(), deletes=(),
+              alternate_names=(), alternate_name_deletes=()):
+    files = {
+        'modifications': modifications,
+        'deletes': deletes,
+        'alternateNamesModifications': alternate_names,
+        'alternateNamesDeletes': alternate_name_deletes,
+    }
+    for prefix, lines in files.items():
+        filepath = os.path.join(str(directory), '{}-{}.txt'.format(
+            prefix, day.isoformat()))
+        with io.open(filepath, 'w', encoding='utf-8') as fh:
+            fh.write(u''.join(line + u'\n' for line in lines))
+
+
+def make_daemon(session, directory, today, **kwargs):
+    daemon = DeltaDaemon(session.bind, DirectorySource(str(directory)),
+                         since=date(2024, 1, 1), **kwargs)
+    daemon.today = lambda: today
+    return daemon
+
+
+def test_applies_days_in_order(session, tmpdir):
+    write_day(tmpdir, date(2024, 1, 1),
+              modifications=[geoname_line(1262410, name=u'Murtazapur'),
+                             geoname_line(1262410, geonameid=99999999)])
+    write_day(tmpdir, date(2024, 1, 2),
+              modifications=[geoname_line(1262410, name=u'Murtajapur')],
+              deletes=[u'99999999\tMurtajāpur\tduplicate'])
+    daemon = make_daemon(session, tmpdir, today=date(2024, 1, 4))
+    assert daemon.poll() == 2
+    assert session.query(Geoname).get(1262410).name == u'Murtajapur'
+    assert session.query(Geoname).get(99999999) is None
+    # Fed back from the coordinates
+    assert session.query(Geoname).get(1262410).point == (
+        u'POINT(77.36714 20.73263)')
+    assert session.query(GeonameMetadata).filter_by(
+        filename='deletes-2024-01-02.txt').one().row_count == 1
+
+    # 2024-01-03 hasn't been published yet
+    status = daemon.status()
+    assert status['last_applied_date'] == '2024-01-02'
+    assert status['lag_days'] == 1
+    assert status['healthy'] is True
+    assert daemon.poll() == 0
+
+    write_day(tmpdir, date(2024, 1, 3))
+    assert daemon.poll() == 1
+    assert daemon.status()['lag_days'] == 0
+
+
+def test_reports_gaps(session, tmpdir):
+    write_day(tmpdir, date(2024, 1, 1))
+    write_day(tmpdir, date(2024, 1, 3))
+    daemon = make_daemon(session, tmpdir, today=date(2024, 1, 4))
+    assert daemon.poll() == 1
+    status = daemon.status()
+    assert status['gap_date'] == '2024-01-02'
+    assert status['healthy'] is False
+
+    # Catching up with a full import, the deltas up to the day before it
+    # are part of the dump
+    sink = DatabaseSink(session.bind, upsert=True)
+    importer, = get_importer_instances(
+        session, tst_filepath('cities1000.txt'), sinks=[sink])
+    importer.run()
+    sink.close()
+    imported = record_import(session, importer).last_updated.date()
+    daemon.today = lambda: imported
+    assert daemon.poll() == 0
+    status = daemon.status()
+    assert status['gap_date'] is None
+    assert status['last_applied_date'] == (
+        imported - timedelta(days=2)).isoformat()
+    assert status['healthy'] is True
+
+
+def test_alternate_names(session, tmpdir):
+    write_day(tmpdir, date(2024, 1, 1), alternate_names=[
+        u'1\t3553478\tes\tLa Habana\t1\t\t\t\t\t',
+        u'2\t3553478\ten\tHavana\t1\t1\t\t\t\t',
+    ], alternate_name_deletes=[u'2\t3553478\t'])
+    daemon = make_daemon(session, tmpdir, today=date(2024, 1, 2),
+                         alternate_names=True)
+    assert daemon.poll() == 1, daemon.last_error
+    alternate_name, = session.query(GeonameAlternateName).all()
+    assert alternate_name.alternate_name == u'La Habana'
+    assert alternate_name.is_preferred_name is True
+    assert alternate_name.is_short_name is False
+
+
+def test_serve_metrics(session, tmpdir):
+    daemon = make_daemon(session, tmpdir, today=date(2024, 1, 4))
+    daemon.poll()
+    server = serve_metrics(daemon, 0, host='127.0.0.1')
+    try:
+        url = 'http://127.0.0.1:{}'.format(server.server_address[1])
+        metrics = urlopen(url + '/metrics').read().decode('utf-8')
+        assert 'geonames_delta_lag_days 3\n' in metrics
+        with pytest.raises(HTTPError) as excinfo:
+            urlopen(url + '/health')
+        assert excinfo.value.code == 503
+        assert json.loads(excinfo.value.read().decode('utf-8'))[
+            'last_applied_date'] == '2023-12-31'
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+def test_geohash(session, tmpdir):
+    sink = DatabaseSink(session.bind, upsert=True)
+    importer, = get_importer_instances(
+        session, tst_filepath('cities1000.txt'), sinks=[sink],
+        geohash=True)
+    importer.run()
+    sink.close()
+    assert session.query(Geoname).get(1262410).geohash == (
+        geohash.encode(20.73263, 77.36714))
+
+    # Moved to Paris, and a new geoname there
+    write_day(tmpdir, date(2024, 1, 1), modifications=[
+        geoname_line(1262410, latitude=48.85, longitude=2.35),
+        geoname_line(1262410, geonameid=99999999, latitude=48.85,
+                     longitude=2.35),
+    ])
+    daemon = make_daemon(session, tmpdir, today=date(2024, 1, 2),
+                         geohash=True)
+    assert daemon.poll() == 1, daemon.last_error
+    expected = geohash.encode(48.85, 2.35)
+    assert expected == 'u09tvkz5y'
+    assert session.query(Geoname).get(1262410).geohash == expected
+    assert session.query(Geoname).get(99999999).geohash == expected
@@ -0,0 +1,40 @@
+import os
+
+from sqlalchemy_geonames import dryrun, get_importer_instances
+
+from conftest import tst_filepath
+
+
+def test_dry_run():
+    importer, = get_importer_instances(
+        None, tst_filepath('cities1000.txt'), geohash=True)
+    report = dryrun.dry_run(importer, batch_size=300)
+    assert report['rows'] == 1000
+    assert report['bytes'] == os.path.getsize(importer.filepath)
+    assert [stage['name'] for stage in report['stages']] == [
+        'read', 'clear_empty_fks_modifier', 'set_geohash_modifier']
+    assert not report['issues']
+    text = dryrun.format_report(report)
+    assert text.startswith(u'cities1000.txt: 1,000 rows')
+    assert u'set_geohash_modifier' in text
+
+
+def test_dry_run_counts_invalid_rows(tmpdir):
+    filepath = str(tmpdir.join('countryInfo.txt'))
+    with open(tst_filepath('countryInfo.txt')) as src:
+        lines = [line for line in src if not line.startswith('#')][:3]
+    cells = lines[1].split('\t')
+    cells[7] = 'many'  # population
+    lines[1] = '\t'.join(cells)
+    with open(filepath, 'w') as fh:
+        fh.writelines(lines)
+        fh.write('XX\tXXX\n')
+    importer, = get_importer_instances(None, filepath)
+    report = dryrun.dry_run(importer)
+    assert report['rows'] == 2
+    issues = report['issues']
+    assert issues.counts['invalid'] == 2
+    assert issues.counts['malformed'] == 1
+    text = dryrun.format_report(report)
+    assert u'1 malformed, 2 invalid rows' in text
+    assert u'invalid row #1: ' in text
@@ -0,0 +1,41 @@
+import pytest
+
+from sqlalchemy_geonames import engines
+
+POSTGRESQL_URL = 'postgresql+psycopg2://geonames@localhost/geonames'
+
+
+def test_import_profile_options():
+    options = engines.get_engine_options(
+        POSTGRESQL_URL, 'import', settings={'work_mem': '1GB'},
+        connect_args={'options': '-c search_path=geo'})
+    assert options['executemany_mode'] == 'values'
+    assert 'pool_size' not in options
+    assert options['connect_args']['options'] == (
+        '-c search_path=geo -c maintenance_work_mem=1GB '
+        '-c statement_timeout=0 -c synchronous_commit=off -c work_mem=1GB')
+
+
+def test_query_profile_options():
+    options = engines.get_engine_options(
+        POSTGRESQL_URL, 'query', settings={'application_name': 'geo app'},
+        pool_size=5)
+    assert options['pool_size'] == 5
+    assert options['pool_pre_ping'] is True
+    assert 'executemany_mode' not in options
+    assert options['connect_args']['options'] == (
+        '-c application_name=geo\\ app -c statement_timeout=30s')
+    # Neither settings nor pool options for SQLite
+    assert engines.get_engine_options('sqlite://', 'query') == {}
+    assert engines.get_engine_options(POSTGRESQL_URL) == {}
+    with pytest.raises(ValueError):
+        engines.get_engine_options(POSTGRESQL_URL, 'fastest')
+
+
+@pytest.mark.parametrize('profile,synchronous', [
+    ('import', 0),
+    ('default', 2),
+])
+def test_sqlite_pragmas(profile, synchronous):
+    engine = engines.create_engine('sqlite://', profile)
+    assert engine.execute('PRAGMA synchronous').scalar() == synchronous
@@ -0,0 +1,48 @@
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from sqlalchemy_geonames import Geoname, geohash
+
+from conftest import import_tst_files
+
+
+@pytest.fixture(scope='module')
+def session():
+    engine = create_engine('sqlite://')
+    import_tst_files(engine, geohash=True)
+    session = sessionmaker(bind=engine)()
+    yield session
+    session.close()
+
+
+def test_encode():
+    assert geohash.encode(57.64911, 10.40744, 11) == 'u4pruydqqvj'
+    assert geohash.encode(57.64911, 10.40744, 5) == 'u4pru'
+    min_lat, min_lon, max_lat, max_lon = geohash.decode_bbox('u4pru')
+    assert min_lat <= 57.64911 <= max_lat
+    assert min_lon <= 10.40744 <= max_lon
+
+
+def test_covering_geohashes():
+    geohashes = geohash.covering_geohashes(59.3, 18.0, 59.4, 18.1,
+                                           max_cells=16)
+    assert 0 < len(geohashes) <= 16
+    assert geohash.encode(59.35, 18.05)[:len(geohashes[0])] in geohashes
+
+
+def test_geonames_near_bbox(session):
+    geoname = session.query(Geoname).filter(Geoname.geohash.isnot(None))\
+                     .first()
+    lat, lon = (sum(p) / 2 for p in zip(
+        geohash.decode_bbox(geoname.geohash)[:2],
+        geohash.decode_bbox(geoname.geohash)[2:]))
+    query = geohash.geonames_near_bbox(session, lat - 0.01, lon - 0.01,
+                                       lat + 0.01, lon + 0.01)
+    assert geoname in query.all()
+
+
+def test_cell_counts(session):
+    counts = geohash.cell_counts(session, 1)
+    assert sum(count for cell, count in counts) == 1000
+    assert all(len(cell) == 1 for cell, count in counts)
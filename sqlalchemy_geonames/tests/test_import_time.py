@@ -0,0 +1,46 @@
+import json
+import subprocess
+import sys
+
+import pytest
+
+# Importing the package or its readers must not pull in these, which take
+# most of the time of importing the importers. Checked rather than timed, as
+# timings depend on the machine and its load.
+HEAVY_MODULES = ('sqlalchemy', 'geoalchemy2', 'requests', 'progressbar',
+                 'psycopg2', 'scipy', 'shapely', 'pyarrow',
+                 'sqlalchemy_geonames.models', 'sqlalchemy_geonames.imports')
+
+measure_script = '''
+import json, sys
+{statement}
+print(json.dumps({{
+    "modules": [m for m in {heavy_modules!r} if m in sys.modules],
+}}))
+'''
+
+
+def measure_import(statement):
+    script = measure_script.format(statement=statement,
+                                   heavy_modules=HEAVY_MODULES)
+    output = subprocess.check_output([sys.executable, '-c', script])
+    return json.loads(output.decode('utf-8'))
+
+
+@pytest.mark.skipif(sys.version_info < (3, 7),
+                    reason='Lazy imports require module level __getattr__')
+@pytest.mark.parametrize('statement', [
+    'import sqlalchemy_geonames',
+    'from sqlalchemy_geonames.reader import GeonameReader',
+])
+def test_import_time(statement):
+    result = measure_import(statement)
+    assert result['modules'] == []
+
+
+def test_lazy_attributes():
+    import sqlalchemy_geonames
+    assert sqlalchemy_geonames.Geoname.__tablename__ == 'geoname'
+    assert 'Geoname' in dir(sqlalchemy_geonames)
+    with pytest.raises(AttributeError):
+        sqlalchemy_geonames.DoesNotExist
@@ -0,0 +1,105 @@
+import os
+import shutil
+
+import pytest
+
+from sqlalchemy_geonames import get_importer_instances, parsecache
+from sqlalchemy_geonames.reader import GeonameReader
+
+from conftest import tst_filepath
+
+
+@pytest.fixture
+def filepath(tmpdir):
+    filepath = str(tmpdir.join('cities1000.txt'))
+    shutil.copy(tst_filepath('cities1000.txt'), filepath)
+    return filepath
+
+
+def cache_filenames(filepath):
+    return sorted(name for name in os.listdir(os.path.dirname(filepath))
+                  if name.endswith(parsecache.suffix))
+
+
+def test_reads_from_cache(filepath, monkeypatch):
+    expected = list(GeonameReader(filepath))
+    middle = GeonameReader(filepath)
+    rows = iter(middle)
+    for _ in range(500):
+        next(rows)
+    reader = GeonameReader(filepath, parse_cache=True)
+    assert list(reader) == expected
+    assert os.path.exists(parsecache.get_cache_path(reader))
+
+    def read_rows(self):
+        raise AssertionError('Read the file')
+    monkeypatch.setattr(GeonameReader, 'read_rows', read_rows)
+    cached = GeonameReader(filepath, parse_cache=True)
+    assert list(cached) == expected
+    assert (cached.offset, cached.rownum) == (reader.offset, reader.rownum)
+
+    # Resumed from a row in the middle of a chunk
+    resumed = GeonameReader(filepath, offset=middle.offset,
+                            rownum=middle.rownum, parse_cache=True)
+    assert list(resumed) == expected[500:]
+
+
+def test_cache_is_keyed_by_content_and_columns(filepath):
+    reader = GeonameReader(filepath, parse_cache=True)
+    list(reader)
+    columns = ('geonameid', 'name', 'latitude', 'longitude')
+    selected = GeonameReader(filepath, columns=columns, parse_cache=True)
+    rows = list(selected)
+    assert set(rows[0]) == set(columns)
+    # Only the latest cache is kept
+    path = parsecache.get_cache_path(selected)
+    assert path != parsecache.get_cache_path(reader)
+    assert cache_filenames(filepath) == [os.path.basename(path)]
+
+    # An incomplete read leaves no cache behind
+    with open(filepath, 'a') as fh:
+        fh.write(open(tst_filepath('cities5000.txt')).readline())
+    next(iter(GeonameReader(filepath, parse_cache=True)))
+    assert cache_filenames(filepath) == [os.path.basename(path)]
+    assert not [name for name in os.listdir(os.path.dirname(filepath))
+                if name.endswith('.tmp')]
+
+    reader = GeonameReader(filepath, parse_cache=True)
+    assert len(list(reader)) == 1001
+    assert cache_filenames(filepath) == [
+        os.path.basename(parsecache.get_cache_path(reader))]
+
+
+def test_importer_parse_cache(filepath):
+    importer, = get_importer_instances(None, filepath, parse_cache=True)
+    rows = list(importer.get_reader())
+    assert len(rows) == 1000
+    assert cache_filenames(filepath)
+    importer, = get_importer_instances(None, filepath, parse_cache=True,
+                                       rejects=True)
+    # Rejects have to be written on every read
+    assert importer.get_reader().on_error is not None
+
+
+def test_cache_is_keyed_by_modification_time(filepath, monkeypatch):
+    expected = list(GeonameReader(filepath, parse_cache=True))
+    path = parsecache.get_cache_path(GeonameReader(filepath))
+
+    def content_digest(filepath):
+        raise AssertionError('Hashed the file')
+    monkeypatch.setattr(parsecache, 'content_digest', content_digest)
+    assert list(GeonameReader(filepath, parse_cache=True)) == expected
+    monkeypatch.undo()
+
+    # A file that was only touched is hashed, and keeps its cache
+    stat = os.stat(filepath)
+    os.utime(filepath, (stat.st_atime, stat.st_mtime + 10))
+
+    def read_rows(self):
+        raise AssertionError('Read the file')
+    monkeypatch.setattr(GeonameReader, 'read_rows', read_rows)
+    reader = GeonameReader(filepath, parse_cache=True)
+    assert list(reader) == expected
+    touched_path = parsecache.get_cache_path(reader)
+    assert touched_path != path
+    assert cache_filenames(filepath) == [os.path.basename(touched_path)]
@@ -0,0 +1,133 @@
+import pytest
+from sqlalchemy.dialects import postgresql
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.schema import CreateTable
+from sqlalchemy.sql.expression import Insert
+
+from sqlalchemy_geonames import partitioning
+from sqlalchemy_geonames.imports import GeonameImportOptions, Importer
+
+from conftest import tst_filepath
+
+
+def test_partition_names():
+    assert partitioning.get_partition_name('SE') == 'geoname_se'
+    assert partitioning.get_partition_name(None) == 'geoname_default'
+    assert partitioning.get_partition_name('') == 'geoname_default'
+    with pytest.raises(ValueError):
+        partitioning.get_partition_name("SE'; DROP TABLE geoname; --")
+
+
+def test_partitioned_table_ddl():
+    table = partitioning.get_partitioned_table('feature_class')
+    ddl = str(CreateTable(table).compile(dialect=postgresql.dialect()))
+    assert 'PARTITION BY LIST (feature_class)' in ddl
+    # Unique constraints would have to include the partition column
+    assert 'PRIMARY KEY' not in ddl
+    with pytest.raises(ValueError):
+        partitioning.get_partitioned_table('name')
+
+
+class RecordingEngine(object):
+    """Records the statements of the partition sinks
+
+    The partitioning DDL only runs on PostgreSQL, so this stands in for both
+    the engine and its connection.
+    """
+
+    dialect = postgresql.dialect()
+
+    def __init__(self, existing_partitions=()):
+        self.existing_partitions = existing_partitions
+        self.statements = []
+        self.scalar_result = None
+
+    def connect(self):
+        return self
+
+    def execution_options(self, **options):
+        return self
+
+    def begin(self):
+        return self
+
+    def commit(self):
+        self.statements.append(('COMMIT', None))
+
+    def rollback(self):
+        self.statements.append(('ROLLBACK', None))
+
+    def close(self):
+        pass
+
+    def execute(self, statement, *multiparams, **params):
+        if isinstance(statement, Insert):
+            self.statements.append((statement.table.name, multiparams[0]))
+        else:
+            self.statements.append((str(statement).strip(), None))
+        self.scalar_result = params.get('name') in self.existing_partitions
+        return self
+
+    def scalar(self):
+        return 'geoname_se' if self.scalar_result else None
+
+    def ddl(self):
+        return [s for s, rows in self.statements if rows is None]
+
+    def inserted_rows(self, tablename):
+        return [row for s, rows in self.statements if s == tablename
+                for row in rows]
+
+
+def get_geoname_importer(engine, sink):
+    session = sessionmaker(bind=engine)()
+    return Importer(GeonameImportOptions,
+                    tst_filepath('cities1000.txt'), session,
+                    sinks=[sink])
+
+
+def test_routing_sink_inserts_into_partitions():
+    engine = RecordingEngine()
+    sink = partitioning.PartitionRoutingSink(engine, 'country_code')
+    get_geoname_importer(engine, sink).run()
+
+    created = [s for s in engine.ddl() if ' PARTITION OF ' in s]
+    assert ('CREATE TABLE IF NOT EXISTS geoname_se PARTITION OF geoname '
+            "(PRIMARY KEY (geonameid)) FOR VALUES IN ('SE')") in created
+    # Once per partition, even though rows come in several batches
+    assert len(created) == len(set(created))
+    num_rows = 0
+    for statement in created:
+        name = statement.split()[5]
+        rows = engine.inserted_rows(name)
+        assert rows
+        assert set(partitioning.get_partition_name(r['country_code'])
+                   for r in rows) == set([name])
+        num_rows += len(rows)
+    assert num_rows == 1000
+    assert engine.inserted_rows('geoname') == []
+    assert engine.statements[-1] == ('COMMIT', None)
+
+
+def test_swap_sink_replaces_partition():
+    engine = RecordingEngine(existing_partitions=['geoname_se'])
+    sink = partitioning.PartitionSwapSink(engine, 'country_code', 'SE')
+    get_geoname_importer(engine, sink).run()
+
+    rows = engine.inserted_rows('geoname_se_new')
+    assert rows and all(r['country_code'] == 'SE' for r in rows)
+    assert sink.skipped_count == 1000 - len(rows)
+    ddl = engine.ddl()
+    assert ddl[0] == 'DROP TABLE IF EXISTS geoname_se_new'
+    assert ddl[1].startswith('CREATE TABLE geoname_se_new')
+    swap = ddl[ddl.index('SELECT to_regclass(:name)') + 1:]
+    assert swap == [
+        'ALTER TABLE geoname DETACH PARTITION geoname_se',
+        'DROP TABLE geoname_se',
+        "ALTER TABLE geoname ATTACH PARTITION geoname_se_new "
+        "FOR VALUES IN ('SE')",
+        'ALTER TABLE geoname_se_new DROP CONSTRAINT geoname_se_new_bound',
+        'ALTER TABLE geoname_se_new RENAME TO geoname_se',
+        'ALTER INDEX geoname_se_new_pkey RENAME TO geoname_se_pkey',
+        'COMMIT',
+    ]
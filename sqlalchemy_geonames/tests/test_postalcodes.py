@@ -0,0 +1,75 @@
+import pytest
+from sqlalchemy.orm import sessionmaker
+
+from sqlalchemy_geonames import GeonamePostalCode, get_importer_instances
+from sqlalchemy_geonames.postalcodes import (nearest_postal_codes,
+                                             postal_codes_with_prefix)
+from sqlalchemy_geonames.sinks import DatabaseSink
+
+from conftest import tst_filepath
+
+test_filenames = ('postalCodes.txt',)
+
+
+@pytest.fixture
+def session(imported_engine):
+    session = sessionmaker(bind=imported_engine)()
+    yield session
+    session.close()
+
+
+def test_postal_code_import(session):
+    assert session.query(GeonamePostalCode).count() == 12
+    unknown = session.query(GeonamePostalCode).filter_by(
+        country_code='GB').one()
+    assert unknown.point is None and unknown.accuracy is None
+
+
+def test_postal_code_prefix(session):
+    codes = postal_codes_with_prefix(session, 'SE', '111').all()
+    assert [c.postal_code for c in codes] == ['111 20', '111 21']
+    assert postal_codes_with_prefix(session, 'DE', '111').count() == 0
+
+
+def test_nearest_postal_code(session):
+    nearest, = nearest_postal_codes(session, 52.52, 13.39)
+    assert nearest.postal_code == '10117'
+    nearest = nearest_postal_codes(session, 42.55, 1.6, limit=2)
+    assert [c.postal_code for c in nearest] == ['AD200', 'AD100']
+
+
+def test_postal_code_upsert_replaces(session):
+    sink = DatabaseSink(session.bind, upsert=True)
+    importer, = get_importer_instances(
+        session, tst_filepath('postalCodes.txt'), sinks=[sink])
+    importer.run()
+    importer.delete_missing()
+    sink.close()
+    assert session.query(GeonamePostalCode).count() == 12
+
+
+def add_postal_code(session, country_code, postal_code, latitude,
+                    longitude):
+    session.add(GeonamePostalCode(
+        country_code=country_code, postal_code=postal_code,
+        place_name=postal_code, admin1_name=u'', admin1_code=u'',
+        admin2_name=u'', admin2_code=u'', admin3_name=u'', admin3_code=u'',
+        latitude=latitude, longitude=longitude))
+    session.commit()
+
+
+def test_nearest_postal_code_at_high_latitude(session):
+    # A degree of longitude is only about 23km at 78N, a tenth of a
+    # degree of latitude is 11km
+    add_postal_code(session, 'SJ', 'east', 78.0, 16.0)
+    add_postal_code(session, 'SJ', 'north', 78.3, 15.0)
+    nearest = nearest_postal_codes(session, 78.0, 15.0, country_code='SJ',
+                                   limit=2)
+    assert [c.postal_code for c in nearest] == ['east', 'north']
+
+
+def test_nearest_postal_code_across_antimeridian(session):
+    add_postal_code(session, 'FJ', 'west', -17.0, -179.9)
+    add_postal_code(session, 'FJ', 'south', -17.5, 179.9)
+    nearest, = nearest_postal_codes(session, -17.0, 179.9)
+    assert nearest.postal_code == 'west'
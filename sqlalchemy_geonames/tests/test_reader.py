@@ -0,0 +1,85 @@
+import pytest
+
+from sqlalchemy_geonames import get_importer_instances, reader
+from sqlalchemy_geonames.reader import (GeonameAlternateNamesReader,
+                                        GeonameCountryInfoReader,
+                                        GeonameFeatureReader, GeonameReader)
+
+from conftest import tst_filepath
+
+
+def test_reads_rows():
+    rows = list(GeonameReader(tst_filepath('cities1000.txt')))
+    assert len(rows) == 1000
+    assert all(isinstance(row['name'], type(u'')) for row in rows)
+    assert len(rows[0]) == len(GeonameReader.field_definitions)
+
+
+def test_skips_comments_and_preprocesses_rows():
+    rows = list(GeonameCountryInfoReader(tst_filepath('countryInfo.txt')))
+    assert not any(row['iso'].startswith(u'#') for row in rows)
+    row = next(iter(GeonameFeatureReader(
+        tst_filepath('featureCodes_en.txt'))))
+    assert len(row['feature_class']) == 1
+
+
+def test_only_reads_selected_columns():
+    filepath = tst_filepath('cities1000.txt')
+    columns = ('geonameid', 'name', 'latitude', 'longitude')
+    reader = GeonameReader(filepath, columns=columns)
+    rows = list(reader)
+    assert len(rows) == 1000
+    assert set(rows[0]) == set(columns)
+    assert [r['name'] for r in rows] == [
+        r['name'] for r in GeonameReader(filepath)]
+
+    with pytest.raises(ValueError):
+        GeonameReader(filepath, columns=('geonameid', 'nonexistent'))
+
+
+def test_importer_skip_columns():
+    filepath = tst_filepath('cities1000.txt')
+    importer, = get_importer_instances(
+        None, filepath, skip_columns=['alternatenames', 'dem'])
+    assert 'name' in importer.field_names
+    assert 'alternatenames' not in importer.field_names
+    assert 'alternatenames' not in next(iter(importer.get_reader()))
+
+    # Not nullable, and needed for the point respectively
+    for column in ('name', 'latitude'):
+        with pytest.raises(ValueError):
+            get_importer_instances(None, filepath, skip_columns=[column])
+
+
+def test_counts_rows_with_missing_values(tmpdir, monkeypatch):
+    filepath = str(tmpdir.join('alternateNames.txt'))
+    with open(filepath, 'w') as fh:
+        # The old format lacks the period columns, and is padded
+        for i in range(1, 31):
+            fh.write('{}\t1\ten\tName {}\t\t\t\t\n'.format(i, i))
+        fh.write('31\t1\ten\tName\t\t\t\t\t\t\tExtra\n')
+    warnings = []
+    monkeypatch.setattr(reader.logger, 'warning', warnings.append)
+    r = GeonameAlternateNamesReader(filepath)
+    assert len(list(r)) == 31
+    assert r.issues.counts['padded'] == 30
+    assert r.issues.counts['malformed'] == 1
+    assert len(r.issues.samples['padded']) == r.issues.max_samples
+    assert r.issues.samples['padded'][0] == (
+        0, u'1\t1\ten\tName 1\t\t\t\t')
+    assert r.issues.summary() == u'1 malformed, 30 padded rows'
+    # The first rows, that further rows are only counted, and the summary
+    assert len(warnings) == r.issues.max_warnings + 2
+    assert warnings[-1].endswith(r.issues.summary())
+
+
+def test_skips_and_counts_invalid_rows():
+    errors = []
+    r = GeonameFeatureReader(tst_filepath('featureCodes_en.txt'),
+                             on_error=lambda *args: errors.append(args))
+    rows = list(r)
+    # null, the last row, has no description
+    assert r.issues.counts['skipped'] == 1
+    assert r.issues.samples['skipped'][0][1].startswith(u'null')
+    assert len(rows) + 1 == r.rownum
+    assert not errors and not r.issues.counts['invalid']
@@ -0,0 +1,81 @@
+import io
+import json
+
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from sqlalchemy_geonames import Geoname, GeonameBase, sqlite, state
+from sqlalchemy_geonames.imports import GeonameImportOptions, Importer
+
+from conftest import tst_filepath
+
+
+@pytest.fixture
+def session(tmpdir):
+    engine = create_engine('sqlite:///' + str(tmpdir.join('geonames.db')))
+    sqlite.enable_savepoints(engine)
+    GeonameBase.metadata.create_all(bind=engine)
+    session = sessionmaker(bind=engine)()
+    yield session
+    session.close()
+
+
+class Crash(Exception):
+    pass
+
+
+def crash_modifier(session, model, row):
+    if row['geonameid'] == 529709:  # Row #700 in cities1000.txt
+        raise Crash()
+    return row
+
+
+class CrashingImportOptions(GeonameImportOptions):
+    modifiers = GeonameImportOptions.modifiers + [crash_modifier]
+
+
+def test_resume_from_checkpoint(session):
+    filepath = tst_filepath('cities1000.txt')
+    importer = Importer(CrashingImportOptions, filepath, session,
+                        checkpoint_interval=200)
+    with pytest.raises(Crash):
+        importer.run()
+    checkpoint = state.get_checkpoint(session, importer)
+    assert 0 < checkpoint.row_count < 700
+    assert session.query(Geoname).count() == checkpoint.row_count
+
+    importer = Importer(GeonameImportOptions, filepath, session,
+                        checkpoint_interval=200)
+    importer.resume(checkpoint)
+    # Release SQLite's read lock before writing
+    session.commit()
+    importer.run()
+    assert importer.row_count == 1000
+    assert session.query(Geoname).count() == 1000
+    session.expire_all()
+    assert state.get_checkpoint(session, importer) is None
+
+
+def test_rejects(session, tmpdir):
+    with io.open(tst_filepath('cities1000.txt'), encoding='utf-8') as fh:
+        lines = fh.readlines()[:10]
+    # A duplicate primary key and a population that isn't a number
+    lines.append(lines[0])
+    cells = lines[1].split(u'\t')
+    cells[14] = u'many'
+    lines[1] = u'\t'.join(cells)
+    filepath = str(tmpdir.join('cities1000.txt'))
+    with io.open(filepath, 'w', encoding='utf-8') as fh:
+        fh.writelines(lines)
+
+    importer = Importer(GeonameImportOptions, filepath, session,
+                        reject_filepath=filepath + '.rejects')
+    importer.run()
+    assert session.query(Geoname).count() == 9
+    with io.open(filepath + '.rejects', encoding='utf-8') as fh:
+        rejects = [json.loads(line) for line in fh]
+    assert rejects[0]['rownum'] == 1
+    assert rejects[0]['error'].startswith('ValueError')
+    assert rejects[1]['row']['geonameid'] == int(lines[0].split(u'\t')[0])
+    assert rejects[1]['error'].startswith('IntegrityError')
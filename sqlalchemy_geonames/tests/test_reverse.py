@@ -0,0 +1,61 @@
+import math
+import random
+import sys
+
+import pytest
+
+from sqlalchemy_geonames.reverse import PlaceIndex, reverse_geocode
+
+
+@pytest.fixture(params=['python', 'scipy'])
+def index_kind(request, monkeypatch):
+    if request.param == 'python':
+        # Makes the import of scipy fail
+        monkeypatch.setitem(sys.modules, 'scipy.spatial', None)
+    else:
+        pytest.importorskip('scipy.spatial')
+    return request.param
+
+
+def haversine(lat1, lon1, lat2, lon2):
+    lat1, lon1, lat2, lon2 = map(math.radians, (lat1, lon1, lat2, lon2))
+    a = (math.sin((lat2 - lat1) / 2) ** 2 +
+         math.cos(lat1) * math.cos(lat2) * math.sin((lon2 - lon1) / 2) ** 2)
+    return 2 * 6371008.8 * math.asin(math.sqrt(a))
+
+
+def test_nearest_place(shared_imported_engine, index_kind):
+    # Murtajāpur, and a position a few kilometers away from it
+    result = reverse_geocode(shared_imported_engine, [20.73263, 20.75],
+                             [77.36714, 77.4])
+    assert result['geonameid'] == [1262410, 1262410]
+    assert result['name'][0] == u'Murtajāpur'
+    assert result['country_code'] == [u'IN', u'IN']
+    assert result['distance'][0] == pytest.approx(0, abs=1)
+    assert 3000 < result['distance'][1] < 5000
+
+    # Nothing close enough in the middle of the Pacific
+    result = reverse_geocode(shared_imported_engine, [0.0], [-150.0],
+                             max_distance=100000)
+    assert result == {'geonameid': [None], 'name': [None],
+                      'country_code': [None], 'distance': [None]}
+
+
+def test_matches_brute_force(shared_imported_engine, index_kind):
+    index = PlaceIndex.from_database(shared_imported_engine)
+    # Stored as POINT(<longitude> <latitude>) on SQLite
+    places = []
+    for point, in shared_imported_engine.execute(
+        "SELECT point FROM geoname WHERE feature_class = 'P'"
+    ):
+        longitude, latitude = map(float, point[6:-1].split())
+        places.append((latitude, longitude))
+    assert len(places) == len(index)
+    rng = random.Random(1)
+    latitudes = [rng.uniform(-60, 70) for _ in range(50)]
+    longitudes = [rng.uniform(-180, 180) for _ in range(50)]
+    result = index.nearest(latitudes, longitudes)
+    for lat, lon, distance in zip(latitudes, longitudes, result['distance']):
+        expected = min(haversine(lat, lon, p_lat, p_lon)
+                       for p_lat, p_lon in places)
+        assert distance == pytest.approx(expected, rel=1e-6)
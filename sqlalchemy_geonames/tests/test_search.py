@@ -0,0 +1,53 @@
+import pytest
+from sqlalchemy.orm import sessionmaker
+
+from sqlalchemy_geonames.bin.benchmark_search import run_benchmark
+from sqlalchemy_geonames.search import (build_name_table, normalize_name,
+                                        search, similarity)
+
+
+@pytest.fixture(scope='module')
+def session(shared_imported_engine):
+    build_name_table(shared_imported_engine, batch_size=100)
+    session = sessionmaker(bind=shared_imported_engine)()
+    yield session
+    session.close()
+
+
+def test_normalize_name():
+    assert normalize_name(u'Göteborg') == u'goteborg'
+    assert normalize_name(u"  L'Habana ") == u'l habana'
+    assert normalize_name(u'Tromsø') == u'tromso'
+    assert normalize_name(u'Łódź') == u'lodz'
+
+
+def test_similarity():
+    assert similarity(u'havana', u'havana') == 1
+    assert similarity(u'havana', u'aleppo') == 0
+    assert 0.3 < similarity(u'havanna', u'havana') < 1
+
+
+def test_search(session):
+    # Misspelled, and an alternate name
+    for text in (u'Havanna', u'hawana', u'La Habana'):
+        geoname, score = search(session, text)[0]
+        assert geoname.geonameid == 3553478
+    geoname, _ = search(session, u'murtajapor')[0]
+    assert geoname.name == u'Murtajāpur'
+    assert search(session, u'murtajapur', country_code=u'SE') == []
+    assert search(session, u'...') == []
+
+
+def test_exact_match_ranks_first(session):
+    results = search(session, u'san diego')
+    assert results[0][0].name == u'San Diego'
+    scores = [score for _, score in results]
+    assert scores == sorted(scores, reverse=True)
+
+
+def test_benchmark(session):
+    geonames = [(3553478, u'Havana'), (170063, u'Aleppo')]
+    stats = run_benchmark(session, geonames)
+    assert stats['searches'] == 2
+    # Typos early in short names may make them too dissimilar
+    assert 0 < stats['top1'] <= stats['found'] <= 1
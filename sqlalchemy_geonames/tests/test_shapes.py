@@ -0,0 +1,53 @@
+import sys
+
+import pytest
+from sqlalchemy.orm import sessionmaker
+
+from sqlalchemy_geonames import GeonameCountryShape
+from sqlalchemy_geonames.shapes import CountryShapeIndex, country_for_point
+
+test_filenames = ('countryInfo.txt', 'shapes_simplified_low.json')
+
+# (latitude, longitude, country code)
+positions = [
+    (59.33, 18.07, u'SE'),  # Stockholm
+    (59.91, 10.75, u'NO'),  # Oslo
+    (78.22, 15.65, u'NO'),  # Longyearbyen, on another polygon
+    (-26.2, 28.04, u'ZA'),  # Johannesburg
+    (-29.31, 27.48, u'LS'),  # Maseru, in a hole of South Africa
+    (-30.0, 40.0, None),
+]
+
+
+@pytest.fixture(scope='module')
+def session(shared_imported_engine):
+    session = sessionmaker(bind=shared_imported_engine)()
+    yield session
+    session.close()
+
+
+def test_shape_import(session):
+    shape = session.query(GeonameCountryShape).get(2661886)
+    assert shape.country.iso == u'SE'
+    assert (shape.min_latitude, shape.min_longitude,
+            shape.max_latitude, shape.max_longitude) == (55, 11, 69, 24)
+
+
+def test_country_for_point(session):
+    for latitude, longitude, country_code in positions:
+        country = country_for_point(session, latitude, longitude)
+        assert (country and country.iso) == country_code
+
+
+@pytest.mark.parametrize('shapely', [False, True])
+def test_country_shape_index(session, shapely, monkeypatch):
+    if shapely:
+        pytest.importorskip('shapely')
+    else:
+        # Makes the import of shapely fail
+        monkeypatch.setitem(sys.modules, 'shapely.geometry', None)
+    index = CountryShapeIndex.from_database(session.bind)
+    assert len(index) == 4
+    latitudes, longitudes, country_codes = zip(*positions)
+    assert index.country_codes_for(latitudes, longitudes) == list(
+        country_codes)
@@ -0,0 +1,78 @@
+import io
+import json
+
+import pytest
+
+from sqlalchemy_geonames import NDJSONSink, get_importer_instances
+from sqlalchemy_geonames.sinks import NULL_PARTITION
+
+from conftest import tst_filepath
+
+
+def test_ndjson_sink_partitions_by_country(tmpdir):
+    sink = NDJSONSink(str(tmpdir), partition_by='country_code')
+    filepath = tst_filepath('cities1000.txt')
+    importer, = get_importer_instances(None, filepath, sinks=[sink])
+    importer.run()
+
+    table_dir = tmpdir.join('geoname')
+    partitions = set(p.basename for p in table_dir.listdir())
+    assert 'country_code=SE' in partitions
+    assert 'country_code={}'.format(NULL_PARTITION) not in partitions
+
+    num_rows = 0
+    for partition in table_dir.listdir():
+        country_code = partition.basename.partition('=')[2]
+        with io.open(str(partition.join('part-0.ndjson')),
+                     encoding='utf-8') as fh:
+            for line in fh:
+                row = json.loads(line)
+                assert row['country_code'] == country_code
+                num_rows += 1
+    assert num_rows == 1000
+
+
+def test_parquet_sink(tmpdir):
+    pq = pytest.importorskip('pyarrow.parquet')
+    from sqlalchemy_geonames import ParquetSink
+
+    sink = ParquetSink(str(tmpdir), partition_by='country_code',
+                       row_group_size=100)
+    filepath = tst_filepath('cities1000.txt')
+    importer, = get_importer_instances(None, filepath, sinks=[sink])
+    importer.run()
+
+    table = pq.read_table(str(tmpdir.join('geoname')))
+    assert table.num_rows == 1000
+    assert str(table.schema.field('latitude').type) == 'double'
+    assert str(table.schema.field('modification_date').type) == 'date32[day]'
+
+
+def test_file_sinks_keep_files_sharing_a_table(tmpdir):
+    sink = NDJSONSink(str(tmpdir.join('flat')))
+    partitioned_sink = NDJSONSink(str(tmpdir.join('partitioned')),
+                                  partition_by='feature_class')
+    filepaths = [tst_filepath('featureCodes_en.txt'),
+                 tst_filepath('featureCodes_sv.txt')]
+    importers = get_importer_instances(None, *filepaths,
+                                       sinks=[sink, partitioned_sink])
+    for importer in importers:
+        importer.run()
+
+    def read_rows(path):
+        with io.open(str(path), encoding='utf-8') as fh:
+            return [json.loads(line) for line in fh]
+
+    flat_dir = tmpdir.join('flat')
+    first = read_rows(flat_dir.join('geonamefeature.ndjson'))
+    second = read_rows(flat_dir.join('geonamefeature-1.ndjson'))
+    assert first and second
+    assert first != second
+
+    num_rows = 0
+    for partition in tmpdir.join('partitioned', 'geonamefeature').listdir():
+        assert set(p.basename for p in partition.listdir()) <= set(
+            ['part-0.ndjson', 'part-1.ndjson'])
+        for path in partition.listdir():
+            num_rows += len(read_rows(path))
+    assert num_rows == len(first) + len(second)
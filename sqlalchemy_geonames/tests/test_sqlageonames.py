@@ -0,0 +1,192 @@
+import os
+import shutil
+import sys
+from zipfile import ZipFile
+
+import pytest
+from sqlalchemy import create_engine
+
+from sqlalchemy_geonames.bin import sqlageonames
+from sqlalchemy_geonames.files import filename_config
+
+from conftest import tst_filepath
+
+
+@pytest.fixture
+def download_dir(tmpdir):
+    """The test files, as `sqlageonames -c` expects them to be downloaded"""
+    download_dir = tmpdir.mkdir('downloads')
+    for filename, opts in filename_config.items():
+        source = tst_filepath(filename)
+        if not os.path.exists(source):
+            continue
+        if not opts.get('unzip'):
+            shutil.copy(source, str(download_dir.join(filename)))
+            continue
+        zip_filename = opts.get('download_filename',
+                                opts['url'].rpartition('/')[2])
+        with ZipFile(str(download_dir.join(zip_filename)), 'w') as zf:
+            zf.write(source, opts.get('zip_member', filename))
+    return download_dir
+
+
+def run_main(monkeypatch, *args):
+    monkeypatch.setattr(sys, 'argv', ['sqlageonames'] + list(args))
+    sqlageonames.main()
+
+
+def assert_usage_error(monkeypatch, *args):
+    with pytest.raises(SystemExit) as excinfo:
+        run_main(monkeypatch, 'cities1000.txt', *args)
+    assert excinfo.value.code == 2
+
+
+@pytest.fixture
+def import_geonames(monkeypatch, tmpdir, download_dir):
+    """Runs `sqlageonames` into a SQLite database, returns its engine"""
+    db_filepath = str(tmpdir.join('geonames.db'))
+
+    def import_geonames(*args, **kwargs):
+        filename = kwargs.pop('filename', 'cities1000.txt')
+        run_main(monkeypatch, filename, '-t', 'sqlite', '-d', db_filepath,
+                 '-c', '-D', str(download_dir), *args)
+        return create_engine('sqlite:///' + db_filepath)
+    return import_geonames
+
+
+def count_rows(engine, tablename, where='1 = 1'):
+    return engine.execute('SELECT count(*) FROM {} WHERE {}'.format(
+        tablename, where)).scalar()
+
+
+def count_lines(filename):
+    with open(tst_filepath(filename), 'rb') as fh:
+        return sum(1 for line in fh if not line.startswith(b'#'))
+
+
+def test_sqlite_import(import_geonames):
+    engine = import_geonames()
+    assert count_rows(engine, 'geoname') == count_lines('cities1000.txt')
+    assert count_rows(engine, 'geonamecountry') > 0
+
+
+def test_upsert(import_geonames):
+    import_geonames()
+    engine = import_geonames('--upsert')
+    assert count_rows(engine, 'geoname') == count_lines('cities1000.txt')
+
+
+def test_skip_unchanged(import_geonames, capsys):
+    import_geonames()
+    capsys.readouterr()
+    import_geonames('--skip-unchanged')
+    assert 'Skipping cities1000.txt, unchanged since the last import' in (
+        capsys.readouterr().out)
+    engine = import_geonames('--upsert', '--row-hashes')
+    assert count_rows(engine, 'geoname') == count_lines('cities1000.txt')
+
+
+def test_row_hashes_require_upsert(monkeypatch):
+    assert_usage_error(monkeypatch, '-t', 'sqlite', '-d', 'geonames.db',
+                       '--row-hashes')
+
+
+def test_checkpoints_and_rejects(import_geonames, download_dir):
+    engine = import_geonames('--checkpoint-interval', '100', '--resume',
+                             '--rejects')
+    assert count_rows(engine, 'geoname') == count_lines('cities1000.txt')
+    # Removed once the import has finished
+    assert count_rows(engine, 'geonameimportcheckpoint') == 0
+    assert not download_dir.listdir(lambda p: p.ext == '.rejects')
+
+
+def test_postal_codes(import_geonames):
+    engine = import_geonames('--postal-codes')
+    assert count_rows(engine, 'geonamepostalcode') == 12
+
+
+def test_partition_by_requires_postgresql(monkeypatch):
+    assert_usage_error(monkeypatch, '-t', 'sqlite', '-d', 'geonames.db',
+                       '--partition-by', 'country_code')
+
+
+def test_geohash(import_geonames):
+    from sqlalchemy_geonames import geohash
+    engine = import_geonames('--geohash')
+    assert count_rows(engine, 'geoname', 'geohash IS NULL') == 0
+    assert engine.execute('SELECT geohash FROM geoname '
+                          'WHERE geonameid = 1262410').scalar() == (
+        geohash.encode(20.73263, 77.36714))
+
+
+def test_skip_columns(import_geonames):
+    engine = import_geonames('--skip-columns', 'dem,alternatenames')
+    assert count_rows(engine, 'geoname') == count_lines('cities1000.txt')
+    assert count_rows(engine, 'geoname', 'dem IS NOT NULL OR '
+                      'alternatenames IS NOT NULL') == 0
+
+
+def test_feature_languages(import_geonames, monkeypatch):
+    engine = import_geonames('--feature-languages', 'sv')
+    assert engine.execute('SELECT DISTINCT language_code FROM '
+                          'geonamefeaturetranslation ORDER BY 1'
+                          ).fetchall() == [('en',), ('sv',)]
+    assert_usage_error(monkeypatch, '-t', 'sqlite', '-d', 'geonames.db',
+                       '--feature-languages', 'xx')
+
+
+def test_country_shapes(import_geonames):
+    engine = import_geonames('--country-shapes')
+    assert count_rows(engine, 'geonamecountryshape') == 4
+
+
+def test_search_names(import_geonames):
+    engine = import_geonames('--search-names')
+    assert count_rows(engine, 'geonamename') > 0
+
+
+def test_alternate_names(import_geonames):
+    engine = import_geonames('--alternate-names')
+    assert count_rows(engine, 'geonamealternatename') > 0
+
+
+def get_geonameids(filename):
+    with open(tst_filepath(filename), 'rb') as fh:
+        return set(int(line.split(b'\t', 1)[0]) for line in fh)
+
+
+def test_switch_primary(import_geonames):
+    import_geonames()
+    engine = import_geonames('--switch-primary', filename='cities5000.txt')
+    geonameids = set(geonameid for geonameid, in engine.execute(
+        'SELECT geonameid FROM geoname'))
+    assert geonameids == get_geonameids('cities5000.txt')
+
+
+def test_dry_run(monkeypatch, capsys, download_dir):
+    run_main(monkeypatch, 'cities1000.txt', '-c', '-D', str(download_dir),
+             '--dry-run')
+    assert 'cities1000.txt: {:,} rows'.format(
+        count_lines('cities1000.txt')) in capsys.readouterr().out
+    # Without --dry-run a database is required
+    assert_usage_error(monkeypatch, '-c', '-D', str(download_dir))
+
+
+def test_engine_profile(import_geonames, monkeypatch):
+    engine = import_geonames('--engine-profile', 'default')
+    assert count_rows(engine, 'geoname') == count_lines('cities1000.txt')
+    assert_usage_error(monkeypatch, '-t', 'sqlite', '-d', 'geonames.db',
+                       '--db-setting', 'work_mem')
+
+
+def test_user_tags_and_language_codes(import_geonames):
+    engine = import_geonames('--user-tags')
+    assert count_rows(engine, 'geonameusertag') > 0
+    assert count_rows(engine, 'geonamelanguagecode') > 0
+
+
+def test_parse_cache(import_geonames, download_dir):
+    import_geonames('--parse-cache')
+    assert download_dir.listdir(lambda p: p.ext == '.parsed')
+    engine = import_geonames('--parse-cache')
+    assert count_rows(engine, 'geoname') == count_lines('cities1000.txt')
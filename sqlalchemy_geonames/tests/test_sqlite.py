@@ -0,0 +1,57 @@
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from sqlalchemy_geonames import Geoname
+from sqlalchemy_geonames import sqlite
+
+from conftest import import_tst_files
+
+
+@pytest.fixture(scope='module')
+def sqlite_filepath(tmpdir_factory):
+    filepath = str(tmpdir_factory.mktemp('sqlite').join('geonames.db'))
+    engine = create_engine('sqlite:///' + filepath)
+    sqlite.configure_bulk_load(engine)
+    import_tst_files(engine)
+    sqlite.create_indexes(engine)
+    sqlite.finalize_database(engine)
+    return filepath
+
+
+@pytest.fixture
+def sqlite_session(sqlite_filepath):
+    engine = sqlite.get_readonly_engine(sqlite_filepath)
+    session = sessionmaker(bind=engine)()
+    yield session
+    session.close()
+
+
+def test_sqlite_import(sqlite_session):
+    assert sqlite_session.query(Geoname).count() == 1000
+
+
+def test_sqlite_bbox(sqlite_session):
+    geoname = sqlite_session.query(Geoname).get(1262410)
+    # (longitude latitude)
+    assert geoname.point == u'POINT(77.36714 20.73263)'
+    x, y = map(float, geoname.point[6:-1].split())
+    geonames = sqlite.geonames_in_bbox(
+        sqlite_session, x - 0.01, y - 0.01, x + 0.01, y + 0.01).all()
+    assert geoname in geonames
+    assert len(geonames) < 10
+
+
+def test_sqlite_name_search(sqlite_session):
+    # Diacritics are ignored and the last word is matched as a prefix
+    names = [g.name for g in sqlite.search_names(sqlite_session, 'murtaj')]
+    assert names == [u'Murtajāpur']
+
+
+def test_readonly_engine_quotes_path(sqlite_filepath, tmpdir):
+    directory = tmpdir.mkdir('geo names?#%20')
+    filepath = str(directory.join('geonames%d#.db'))
+    with open(sqlite_filepath, 'rb') as src, open(filepath, 'wb') as dst:
+        dst.write(src.read())
+    engine = sqlite.get_readonly_engine(filepath)
+    assert engine.execute('SELECT count(*) FROM geoname').scalar() == 1000
@@ -0,0 +1,140 @@
+import io
+import os
+import shutil
+
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from sqlalchemy_geonames import (DatabaseSink, Geoname, GeonameBase,
+                                 GeonameMetadata, get_importer_instances,
+                                 state)
+
+from conftest import tst_filepath
+
+# The tests import the files themselves, into an empty `imported_engine`
+test_filenames = ()
+
+
+@pytest.fixture
+def session(imported_engine):
+    session = sessionmaker(bind=imported_engine)()
+    yield session
+    session.close()
+
+
+def test_unchanged_files_are_skipped(session, tmpdir):
+    filenames = ['countryInfo.txt', 'cities1000.txt']
+    filepaths = []
+    for filename in filenames:
+        filepath = str(tmpdir.join(filename))
+        shutil.copy(tst_filepath(filename), filepath)
+        filepaths.append(filepath)
+
+    importers = get_importer_instances(session, *filepaths)
+    assert state.get_changed_importers(session, importers) == importers
+    for importer in importers:
+        importer.run()
+        state.record_import(session, importer)
+    assert state.get_file_state(session, 'cities1000.txt').row_count == 1000
+
+    importers = get_importer_instances(session, *filepaths)
+    assert state.get_changed_importers(session, importers) == []
+
+    # geonames referencing countries have to be reimported when the
+    # countries are purged, but not when they're upserted
+    with io.open(filepaths[0], 'a', encoding='utf-8') as fh:
+        fh.write(u'# A new comment\n')
+    importers = get_importer_instances(session, *filepaths)
+    changed = state.get_changed_importers(session, importers)
+    assert [i.filename for i in changed] == filenames
+    changed = state.get_changed_importers(session, importers, cascade=False)
+    assert [i.filename for i in changed] == ['countryInfo.txt']
+
+
+def run_upsert(session, filepath):
+    sink = DatabaseSink(session.bind, upsert=True)
+    importers = get_importer_instances(session, filepath, sinks=[sink],
+                                       row_hashes=True)
+    for importer in importers:
+        importer.run()
+    for importer in importers:
+        importer.delete_missing()
+    sink.close()
+
+
+def test_row_hashes(session, tmpdir):
+    with io.open(tst_filepath('cities1000.txt'), encoding='utf-8') as fh:
+        lines = fh.readlines()
+    filepath = str(tmpdir.join('cities1000.txt'))
+    with io.open(filepath, 'w', encoding='utf-8') as fh:
+        fh.writelines(lines)
+    run_upsert(session, filepath)
+    assert os.path.exists(filepath + state.RowHashes.suffix)
+
+    # Make it obvious if unchanged rows are written again
+    session.query(Geoname).update({'name': u'Untouched'})
+    session.commit()
+
+    cells = lines[0].split(u'\t')
+    cells[1] = u'Renamed'
+    lines[0] = u'\t'.join(cells)
+    removed_geonameid = int(lines.pop().split(u'\t')[0])
+    with io.open(filepath, 'w', encoding='utf-8') as fh:
+        fh.writelines(lines)
+    run_upsert(session, filepath)
+
+    names = set(name for name, in session.query(Geoname.name))
+    assert names == set([u'Untouched', u'Renamed'])
+    assert session.query(Geoname).get(removed_geonameid) is None
+    assert session.query(Geoname).count() == 999
+
+
+def test_file_imported_into_several_tables(session, tmpdir):
+    filepaths = []
+    for filename in ('featureCodes_en.txt', 'featureCodes_sv.txt'):
+        filepath = str(tmpdir.join(filename))
+        shutil.copy(tst_filepath(filename), filepath)
+        filepaths.append(filepath)
+    importers = get_importer_instances(session, filepaths[0],
+                                       translation_filepaths=filepaths)
+    for importer in importers:
+        importer.run()
+        state.record_import(session, importer)
+    assert state.get_changed_importers(session, importers) == []
+    tablenames = set(s.tablename for s in session.query(GeonameMetadata))
+    assert tablenames == set(['geonamefeature', 'geonamefeaturetranslation'])
+
+    # All files of a purged table have to be reimported
+    with io.open(filepaths[1], 'a', encoding='utf-8') as fh:
+        fh.write(u'X.NEW\tNew\tA new feature\n')
+    importers = get_importer_instances(session, filepaths[0],
+                                       translation_filepaths=filepaths)
+    changed = state.get_changed_importers(session, importers)
+    assert [i.table.name for i in changed] == ['geonamefeaturetranslation'] * 2
+
+
+def test_id_set():
+    from sqlalchemy_geonames.state import IdSet
+    ids = IdSet([5, 3, 12000000, 5])
+    assert len(ids) == 3
+    assert 5 in ids and 4 not in ids and 13000000 not in ids
+    assert list(ids) == [3, 5, 12000000]
+    assert list(ids.difference(IdSet([3, 7]))) == [5, 12000000]
+
+
+def test_outdated_bookkeeping_tables_are_dropped(tmpdir):
+    engine = create_engine('sqlite:///' + str(tmpdir.join('old.db')))
+    # geonamemetadata as created by older versions
+    engine.execute('CREATE TABLE geonamemetadata (id INTEGER PRIMARY KEY, '
+                   'last_updated DATETIME NOT NULL)')
+    assert state.upgrade_bookkeeping_tables(engine) == ['geonamemetadata']
+    GeonameBase.metadata.create_all(bind=engine)
+    session = sessionmaker(bind=engine)()
+    importer, = get_importer_instances(session,
+                                       tst_filepath('countryInfo.txt'))
+    importer.run()
+    state.record_import(session, importer)
+    assert state.upgrade_bookkeeping_tables(engine) == []
+    assert state.get_file_state(session, 'countryInfo.txt') is not None
+    session.close()
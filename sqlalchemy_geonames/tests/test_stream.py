@@ -0,0 +1,26 @@
+from sqlalchemy_geonames import Geoname
+from sqlalchemy_geonames.stream import iter_column_batches, iter_rows
+
+test_filenames = ('cities1000.txt',)
+
+
+def test_iter_rows(shared_imported_engine):
+    rows = list(iter_rows(shared_imported_engine, Geoname,
+                          ['geonameid', 'name'],
+                          filters=[Geoname.country_code == u'SE'],
+                          order_by=Geoname.geonameid, batch_size=3))
+    assert rows
+    assert all(len(row) == 2 for row in rows)
+    geonameids = [row.geonameid for row in rows]
+    assert geonameids == sorted(geonameids)
+    count = shared_imported_engine.execute(
+        'SELECT count(*) FROM geoname WHERE country_code = ?', u'SE').scalar()
+    assert len(rows) == count
+
+
+def test_iter_column_batches(shared_imported_engine):
+    batches = list(iter_column_batches(
+        shared_imported_engine, Geoname.__table__, [Geoname.name, 'population'],
+        batch_size=300))
+    assert [len(batch['name']) for batch in batches] == [300, 300, 300, 100]
+    assert set(batches[0]) == set(['name', 'population'])
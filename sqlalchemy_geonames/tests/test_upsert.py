@@ -0,0 +1,115 @@
+import io
+
+from sqlalchemy.orm import sessionmaker
+
+from sqlalchemy_geonames import DatabaseSink, Geoname, get_importer_instances
+
+from conftest import tst_filepath
+
+# The tests import the files themselves, into an empty `imported_engine`
+test_filenames = ()
+
+
+def run_upsert(session, filepath):
+    sink = DatabaseSink(session.bind, upsert=True)
+    importers = get_importer_instances(session, filepath, sinks=[sink])
+    for importer in importers:
+        importer.run()
+    for importer in reversed(importers):
+        importer.delete_missing()
+    sink.close()
+
+
+def test_upsert_only_touches_changed_rows(imported_engine, tmpdir):
+    engine = imported_engine
+    session = sessionmaker(bind=engine)()
+
+    with io.open(tst_filepath('cities1000.txt'), encoding='utf-8') as fh:
+        lines = fh.readlines()
+    filepath = str(tmpdir.join('cities1000.txt'))
+    with io.open(filepath, 'w', encoding='utf-8') as fh:
+        fh.writelines(lines)
+    run_upsert(session, filepath)
+    assert session.query(Geoname).count() == 1000
+
+    engine.execute('CREATE TABLE updated (geonameid INTEGER)')
+    engine.execute('CREATE TRIGGER log_update AFTER UPDATE ON geoname '
+                   'BEGIN INSERT INTO updated VALUES (new.geonameid); END')
+
+    # Rename the first geoname and drop the last one
+    cells = lines[0].split(u'\t')
+    cells[1] = u'Renamed'
+    lines[0] = u'\t'.join(cells)
+    removed_geonameid = int(lines.pop().split(u'\t')[0])
+    with io.open(filepath, 'w', encoding='utf-8') as fh:
+        fh.writelines(lines)
+    run_upsert(session, filepath)
+
+    updated = [r[0] for r in engine.execute('SELECT geonameid FROM updated')]
+    assert updated == [int(cells[0])]
+    assert session.query(Geoname).get(int(cells[0])).name == u'Renamed'
+    assert session.query(Geoname).get(removed_geonameid) is None
+    assert session.query(Geoname).count() == 999
+
+
+def test_switch_primary(imported_engine, tmpdir):
+    from sqlalchemy_geonames.bin.sqlageonames import run_importers
+    engine = imported_engine
+    session = sessionmaker(bind=engine)()
+
+    # A cities5000.txt made of the more populous half of cities1000.txt
+    cities1000 = tst_filepath('cities1000.txt')
+    with io.open(cities1000, encoding='utf-8') as fh:
+        lines = [line for line in fh
+                 if int(line.split(u'\t')[14]) >= 5000]
+    cities5000 = str(tmpdir.join('cities5000.txt'))
+    with io.open(cities5000, 'w', encoding='utf-8') as fh:
+        fh.writelines(lines)
+    run_importers(session, [cities5000])
+    assert session.query(Geoname).count() == len(lines)
+
+    # Rows that are there already aren't written again
+    first_geonameid = int(lines[0].split(u'\t')[0])
+    engine.execute("UPDATE geoname SET name = 'Kept' WHERE geonameid = ?",
+                   first_geonameid)
+    run_importers(session, [cities1000], switch_primary=True)
+    assert session.query(Geoname).count() == 1000
+    assert session.query(Geoname).get(first_geonameid).name == u'Kept'
+
+    run_importers(session, [cities5000], switch_primary=True)
+    assert session.query(Geoname).count() == len(lines)
+    filenames = [r[0] for r in engine.execute(
+        "SELECT filename FROM geonamemetadata WHERE tablename = 'geoname'")]
+    assert filenames == ['cities5000.txt']
+
+
+def test_no_country_geonames_merged(imported_engine, tmpdir):
+    from sqlalchemy_geonames.bin.sqlageonames import run_importers
+    engine = imported_engine
+    session = sessionmaker(bind=engine)()
+
+    with io.open(tst_filepath('allCountries.txt'),
+                 encoding='utf-8') as fh:
+        no_country_lines = [line for line in fh
+                            if not line.split(u'\t')[8]]
+    no_country = str(tmpdir.join('no-country.txt'))
+    with io.open(no_country, 'w', encoding='utf-8') as fh:
+        fh.writelines(no_country_lines)
+    cities1000 = tst_filepath('cities1000.txt')
+    count = 1000 + len(no_country_lines)
+
+    run_importers(session, [cities1000, no_country])
+    assert session.query(Geoname).count() == count
+    geoname = session.query(Geoname).get(
+        int(no_country_lines[0].split(u'\t')[0]))
+    assert geoname.country_code is None
+
+    # Neither file's rows are deleted as missing from the other one
+    run_importers(session, [cities1000, no_country], upsert=True)
+    assert session.query(Geoname).count() == count
+    run_importers(session, [cities1000, no_country], switch_primary=True)
+    assert session.query(Geoname).count() == count
+    filenames = [r[0] for r in engine.execute(
+        "SELECT filename FROM geonamemetadata WHERE tablename = 'geoname' "
+        "ORDER BY filename")]
+    assert filenames == ['cities1000.txt', 'no-country.txt']
@@ -0,0 +1,24 @@
+from sqlalchemy.orm import sessionmaker
+
+from sqlalchemy_geonames import GeonameLanguageCode, GeonameUserTag
+from sqlalchemy_geonames.usertags import geonames_with_tag, tags_of
+
+test_filenames = ('cities1000.txt', 'userTags.txt', 'iso-languagecodes.txt')
+
+
+def test_user_tags_and_language_codes(imported_engine):
+    session = sessionmaker(bind=imported_engine)()
+
+    # Without the header
+    assert session.query(GeonameLanguageCode).count() == 7766
+    swedish = session.query(GeonameLanguageCode).get(u'swe')
+    assert swedish.iso_639_1 == u'sv'
+    assert swedish.language_name == u'Swedish'
+
+    # Duplicates included
+    assert session.query(GeonameUserTag).count() == 56171
+    geonames = geonames_with_tag(session, u'place').all()
+    assert geonames
+    for geoname in geonames[:10]:
+        assert u'place' in tags_of(session, geoname.geonameid)
+    assert geonames_with_tag(session, u'no such tag').count() == 0
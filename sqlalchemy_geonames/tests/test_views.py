@@ -0,0 +1,47 @@
+import pytest
+from sqlalchemy.exc import InvalidRequestError
+from sqlalchemy.orm import sessionmaker
+
+from sqlalchemy_geonames import GeonameBase, GeonameDetail
+from sqlalchemy_geonames import views
+
+test_filenames = (
+    'cities1000.txt',
+    'timeZones.txt',
+    'featureCodes_en.txt',
+    'countryInfo.txt',
+    'admin1CodesASCII.txt',
+    'admin2Codes.txt',
+)
+
+
+@pytest.fixture
+def session(imported_engine):
+    views.refresh_views(imported_engine)
+    session = sessionmaker(bind=imported_engine)()
+    yield session
+    session.close()
+
+
+def test_geoname_detail(session):
+    assert session.query(GeonameDetail).count() == 1000
+    detail = session.query(GeonameDetail).get(2997304)
+    assert detail.name == u'Lovagny'
+    assert detail.country_name == u'France'
+    assert detail.admin1_name == u'Rh\xf4ne-Alpes'
+    assert detail.admin2_name == u'D\xe9partement de la Haute-Savoie'
+    assert detail.feature_name is not None
+    assert detail.gmt_offset is not None
+
+
+def test_geoname_detail_is_read_only(session):
+    detail = session.query(GeonameDetail).first()
+    detail.name = u'Changed'
+    with pytest.raises(InvalidRequestError):
+        session.flush()
+    session.rollback()
+
+
+def test_drop_all_drops_views(session):
+    GeonameBase.metadata.drop_all(bind=session.bind)
+    assert not views.view_exists(session.bind)
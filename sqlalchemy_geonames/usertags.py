@@ -0,0 +1,25 @@
+"""User tag lookups"""
+from .models import Geoname, GeonameUserTag
+
+
+def geonames_with_tag(session, tag):
+    """Query for the imported geonames tagged with `tag`
+
+    Found through the index on the tag and geonameid of `GeonameUserTag`.
+    Geonames that are tagged but weren't imported, e.g. villages when only
+    cities15000.txt was, are left out.
+    """
+    return (
+        session.query(Geoname)
+        .join(GeonameUserTag, GeonameUserTag.geonameid == Geoname.geonameid)
+        .filter(GeonameUserTag.tag == tag)
+        .distinct()
+    )
+
+
+def tags_of(session, geonameid):
+    """The tags of a geoname, sorted"""
+    query = (session.query(GeonameUserTag.tag)
+             .filter(GeonameUserTag.geonameid == geonameid)
+             .distinct().order_by(GeonameUserTag.tag))
+    return [tag for tag, in query]
@@ -36,6 +36,13 @@ def try_int(value):
         return None
 
 
+def try_float(value):
+    try:
+        return float(value)
+    except ValueError:
+        return None
+
+
 def normalize_path(path):
     return os.path.abspath(os.path.expanduser(path))
 
@@ -0,0 +1,165 @@
+"""Denormalized, read-only geoname data
+
+`geonamedetail` holds every geoname together with the names and values
+that are usually looked up through its relationships: the country name,
+feature name, admin division names and timezone offsets. Reading a
+`GeonameDetail` is thus a single table read without any further queries.
+
+On PostgreSQL it's a materialized view, on SQLite a regular table. Either
+way it has to be refreshed after the data has changed::
+
+    create_views(engine)  # Once, after the tables have been created
+    ... run the importers ...
+    refresh_views(engine)
+
+`sqlageonames` takes care of both.
+"""
+from sqlalchemy import (Column, Index, MetaData, Table, Text, event, select,
+                        text, type_coerce)
+from sqlalchemy.exc import InvalidRequestError
+from sqlalchemy.schema import CreateIndex
+from .models import (GeonameBase, Geoname, GeonameAdmin1Code,
+                     GeonameAdmin2Code, GeonameCountry, GeonameFeature,
+                     GeonameTimezone)
+from .sqlite import is_sqlite
+from .utils import simple_repr
+
+DETAIL_VIEWNAME = 'geonamedetail'
+
+
+def _detail_select(for_ddl=False):
+    geoname = Geoname.__table__
+    country = GeonameCountry.__table__
+    feature = GeonameFeature.__table__
+    timezone = GeonameTimezone.__table__
+    admin1 = GeonameAdmin1Code.__table__
+    admin2 = GeonameAdmin2Code.__table__
+    admin1_code = geoname.c.country_code + u'.' + geoname.c.admin1_code
+    admin2_code = admin1_code + u'.' + geoname.c.admin2_code
+    point = geoname.c.point
+    if for_ddl:
+        # Keep geoalchemy2 from wrapping the column in ST_AsBinary
+        point = type_coerce(point, Text).label('point')
+    return select([
+        geoname.c.geonameid,
+        geoname.c.name,
+        geoname.c.asciiname,
+        point,
+        geoname.c.feature_class,
+        geoname.c.feature_code,
+        feature.c.name.label('feature_name'),
+        geoname.c.country_code,
+        country.c.country.label('country_name'),
+        geoname.c.admin1_code,
+        admin1.c.name.label('admin1_name'),
+        geoname.c.admin2_code,
+        admin2.c.name.label('admin2_name'),
+        geoname.c.population,
+        geoname.c.elevation,
+        geoname.c.timezone_id,
+        timezone.c.gmt_offset,
+        timezone.c.dst_offset,
+        timezone.c.raw_offset,
+    ]).select_from(
+        geoname
+        .outerjoin(feature, feature.c.feature_code == geoname.c.feature_code)
+        .outerjoin(country, country.c.iso == geoname.c.country_code)
+        .outerjoin(admin1, admin1.c.code == admin1_code)
+        .outerjoin(admin2, admin2.c.code == admin2_code)
+        .outerjoin(timezone,
+                   timezone.c.timezone_id == geoname.c.timezone_id)
+    )
+
+
+# Not part of `GeonameBase.metadata`, so that `create_all` leaves it alone
+_metadata = MetaData()
+
+detail_table = Table(
+    DETAIL_VIEWNAME, _metadata,
+    *[Column(c.name, c.type, primary_key=c.name == 'geonameid')
+      for c in _detail_select().columns]
+)
+
+# geonameid has to be unique for concurrent refreshes on PostgreSQL
+_detail_indexes = [
+    Index('ux_geonamedetail_geonameid', detail_table.c.geonameid,
+          unique=True),
+    Index('ix_geonamedetail_country_code_feature_class',
+          detail_table.c.country_code, detail_table.c.feature_class),
+    Index('ix_geonamedetail_name', detail_table.c.name),
+]
+
+
+class GeonameDetail(GeonameBase):
+    """A geoname with its related names and values, see module docstring"""
+    __table__ = detail_table
+    __repr__ = simple_repr('name')
+
+
+def _read_only(mapper, connection, target):
+    raise InvalidRequestError('{} is read-only'.format(
+        target.__class__.__name__))
+
+
+for _event_name in ('before_insert', 'before_update', 'before_delete'):
+    event.listen(GeonameDetail, _event_name, _read_only)
+
+
+def _compile(bind, element):
+    return str(element.compile(dialect=bind.dialect,
+                               compile_kwargs={'literal_binds': True}))
+
+
+def view_exists(bind):
+    if is_sqlite(bind):
+        return bind.dialect.has_table(bind, DETAIL_VIEWNAME)
+    return bool(bind.execute(
+        text('SELECT 1 FROM pg_matviews WHERE matviewname = :name'),
+        name=DETAIL_VIEWNAME).scalar())
+
+
+def create_views(bind):
+    """Create the views, left empty until `refresh_views` is called"""
+    if view_exists(bind):
+        return
+    query = _compile(bind, _detail_select(for_ddl=True))
+    if is_sqlite(bind):
+        bind.execute('CREATE TABLE {} AS {} LIMIT 0'.format(
+            DETAIL_VIEWNAME, query))
+    else:
+        bind.execute('CREATE MATERIALIZED VIEW {} AS {} WITH NO DATA'.format(
+            DETAIL_VIEWNAME, query))
+    for index in _detail_indexes:
+        bind.execute(CreateIndex(index))
+
+
+def drop_views(bind):
+    if is_sqlite(bind):
+        bind.execute('DROP TABLE IF EXISTS {}'.format(DETAIL_VIEWNAME))
+    else:
+        bind.execute('DROP MATERIALIZED VIEW IF EXISTS {}'.format(
+            DETAIL_VIEWNAME))
+
+
+def refresh_views(bind, concurrently=False):
+    """Bring the views up to date with the tables, creating them if needed
+
+    With `concurrently` the view can be read while it's being refreshed,
+    at the cost of a slower refresh. Only applies to PostgreSQL, and only
+    to views that have been refreshed before.
+    """
+    create_views(bind)
+    if is_sqlite(bind):
+        with bind.connect() as connection, connection.begin():
+            connection.execute(detail_table.delete())
+            connection.execute(
+                'INSERT INTO {} {}'.format(
+                    DETAIL_VIEWNAME,
+                    _compile(bind, _detail_select(for_ddl=True))))
+        return
+    populated = bind.execute(
+        text('SELECT ispopulated FROM pg_matviews WHERE matviewname = :name'),
+        name=DETAIL_VIEWNAME).scalar()
+    bind.execute('REFRESH MATERIALIZED VIEW {}{}'.format(
+        'CONCURRENTLY ' if concurrently and populated else '',
+        DETAIL_VIEWNAME))